@@ -1,14 +1,27 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import F
 from cloudinary.models import CloudinaryField
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     photo = CloudinaryField("photo", blank=True, null=True)
 
+    # счётчики заказов: +1 при создании заказа (store/signals.py),
+    # пересчёт — `manage.py rebuild_order_counters`
+    order_count    = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
     def __str__(self):
         return self.user.username
 
+    @classmethod
+    def record_order(cls, user_id, amount):
+        cls.objects.filter(user_id=user_id).update(
+            order_count=F("order_count") + 1,
+            lifetime_spend=F("lifetime_spend") + amount,
+        )
+
 
 from django.db.models.signals import post_save
 from django.dispatch import receiver
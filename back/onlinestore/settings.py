@@ -3,6 +3,8 @@ from datetime import timedelta
 import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -86,6 +88,8 @@ CLOUDINARY_STORAGE = {
     "API_SECRET": os.getenv("CLOUDINARY_API_SECRET"),
     "SECURE": True,
 }
+# ширины (px) вариантов изображений товара, считаются при сохранении ProductImage
+PRODUCT_IMAGE_VARIANTS = {"thumb": 200, "card": 480, "full": 1200}
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
 USE_I18N = True
@@ -113,6 +117,41 @@ REST_FRAMEWORK = {
         "heavy": "10/min",  # тяжелый запрос — 10 в минуту
     },
 }
+# быстрый read-only путь для списков товаров / заказов / отзывов (store/fastpath.py)
+FAST_READ_SERIALIZERS = os.environ.get("FAST_READ_SERIALIZERS", "0") == "1"
+
+# keyset-пагинация каталога (store/pagination.py)
+PRODUCT_PAGE_SIZE = 24
+PRODUCT_MAX_PAGE_SIZE = 100
+PRODUCT_BATCH_MAX_IDS = 100     # ?ids=1,5,9 — корзина / checkout
+# история заказов (GET /orders/)
+ORDER_PAGE_SIZE = 20
+ORDER_MAX_PAGE_SIZE = 100
+PROFILE_RECENT_ORDERS = 5        # GET /profile/ — последние заказы, вся история в /orders/
+# холодное хранилище (store/archive.py): заказы старше N дней уходят в ArchivedOrder
+ORDER_ARCHIVE_AFTER_DAYS = 365
+ORDER_ARCHIVE_CHUNK = 500        # заказов на транзакцию
+# /analytics/ читает только агрегаты, их дописывает Celery (store/analytics.py)
+SALES_ROLLUP_CHUNK = 1000        # заказов на транзакцию
+SALES_ROLLUP_LAG = 60            # сек — свежие заказы ждут следующего прогона
+# купоны (store/coupons.py): Bloom-фильтр кодов отсекает перебор без запросов к БД
+COUPON_BLOOM_REBUILD = 60 * 10   # сек, период пересборки (beat ниже)
+COUPON_BLOOM_CHECK = 5           # сек, как часто воркер проверяет новую версию
+COUPON_BLOOM_ERROR_RATE = 0.001
+COUPON_CACHE_TTL = 30            # сек, кэш действующих купонов
+COUPON_EXPIRY_CHUNK = 1000       # ночная чистка просроченных: строк на транзакцию
+COUPON_EXPIRY_PAUSE = 0.05       # сек между порциями
+# кэш ответов Gemini (store/gemini.py): ключ — нормализованный промпт
+GEMINI_CACHE_TTL = 60 * 60       # сек, общий кэш (Redis)
+GEMINI_CACHE_L1_TTL = 60 * 5     # сек, LRU внутри воркера
+GEMINI_CACHE_MAX_ENTRIES = 512
+GEMINI_SINGLE_FLIGHT_WAIT = 30   # сек, сколько дубль ждёт чужой вызов
+# кампании (store/campaigns.py): коды генерируются заранее, регистрация берёт готовый из пула
+WELCOME_COUPON_CAMPAIGN = "welcome"
+COUPON_BATCH_SIZE = 5000         # кодов на INSERT
+COUPON_POOL_LOW_WATER = 10_000   # меньше — пул пополняется
+COUPON_POOL_REFILL = 50_000      # до скольких кодов пополнять
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=120), 
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),    
@@ -128,6 +167,22 @@ CACHES = {
         "LOCATION": os.environ.get("REDIS_URL"),
     }
 }
+# ответы каталога инвалидируются по тегам (store/cache.py), поэтому TTL можно держать большим
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 6
+# L1: LRU внутри каждого воркера перед Redis
+CATALOG_L1_TIMEOUT = 10          # сек
+CATALOG_L1_MAX_ENTRIES = 256
+CATALOG_GENERATION_TTL = 1       # сек, за сколько воркеры увидят инвалидацию
+# список товаров из снимка, который пересобирает Celery beat (store/snapshot.py)
+PRODUCT_LIST_SNAPSHOT = os.environ.get("PRODUCT_LIST_SNAPSHOT", "0") == "1"
+PRODUCT_SNAPSHOT_MAX_AGE = 300   # сек, после этого снимок обновляется в фоне
+# POST /checkout/ → 202 + опрос статуса, заказ создаёт Celery (store.tasks.process_checkout_task)
+CHECKOUT_ASYNC = os.environ.get("CHECKOUT_ASYNC", "0") == "1"
+CHECKOUT_PROCESSING_TIMEOUT = 60 * 5  # сек — дольше в processing значит, что воркер умер
+CHECKOUT_MAX_ATTEMPTS = 3        # после стольких зависших попыток checkout помечается failed
+# Idempotency-Key для POST /checkout/ и /orders/create/ (store/idempotency.py)
+IDEMPOTENCY_TTL = 60 * 60 * 24   # сек, сколько хранится ответ для повторов
+IDEMPOTENCY_WAIT = 10            # сек, сколько дубль ждёт первый запрос
 
 PASSWORD_HASHERS = [
 
@@ -148,6 +203,7 @@ SWAGGER_SETTINGS = {
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 # CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 SILKY_PYTHON_PROFILER = True 
@@ -162,6 +218,34 @@ CELERY_BEAT_SCHEDULE = {
         "task": "store.tasks.deactivate_expired_coupons",
         "schedule": 60*60*24,   # каждый день
     },
+    "refresh-product-list-snapshot": {
+        "task": "store.tasks.refresh_product_list_snapshot",
+        "schedule": 60,         # каждую минуту (работает только при PRODUCT_LIST_SNAPSHOT)
+    },
+    "archive-old-orders": {
+        "task": "store.tasks.archive_old_orders",
+        "schedule": 60*60*24,   # каждый день
+    },
+    "update-sales-rollups": {
+        "task": "store.tasks.update_sales_rollups",
+        "schedule": 60*5,       # каждые 5 минут
+    },
+    "top-up-welcome-coupon-pool": {
+        "task": "store.tasks.top_up_welcome_coupon_pool",
+        "schedule": 60*60,      # каждый час
+    },
+    "rebuild-coupon-filter": {
+        "task": "store.tasks.rebuild_coupon_filter",
+        "schedule": 60*10,      # COUPON_BLOOM_REBUILD
+    },
+    "recover-stale-checkouts": {
+        "task": "store.tasks.recover_stale_checkouts",
+        "schedule": 60,         # CHECKOUT_PROCESSING_TIMEOUT
+    },
+    "reconcile-stock-shards": {
+        "task": "store.tasks.reconcile_stock_shards",
+        "schedule": 30,         # остаток «горячих» товаров (Product.hot_shards) в карточке
+    },
 }
 
 MEDIA_URL = '/media/'
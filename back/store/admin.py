@@ -1,7 +1,9 @@
 from django.contrib import admin
-from .models import Product,Checkout, Order, OrderItem,ProductImage, Review, Coupon
+from django.db import transaction
+from .models import Product,Checkout, Order, OrderItem,ProductImage, Review, Coupon, CouponCampaign, StockShard
 from django.contrib.auth.models import User
 from accounts.models import Profile
+from .cache import bump, orders_tag
 
 admin.site.register(Product)
 
@@ -9,7 +11,25 @@ admin.site.register(Checkout)
 admin.site.register(Order)
 admin.site.register(ProductImage)
 admin.site.register(Review)
-admin.site.register(OrderItem)
 admin.site.register(Coupon)
+admin.site.register(CouponCampaign)
+admin.site.register(StockShard)
 admin.site.register(Profile)
-admin.site.site_header = "NeuroCart Admin"
\ No newline at end of file
+admin.site.site_header = "NeuroCart Admin"
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(admin.ModelAdmin):
+    # у OrderItem нет post_delete (см. store/signals.py) — версию истории заказов поднимаем здесь
+    def delete_model(self, request, obj):
+        self._bump_orders([obj.order_id])
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        self._bump_orders(queryset.values_list("order_id", flat=True))
+        super().delete_queryset(request, queryset)
+
+    @staticmethod
+    def _bump_orders(order_ids):
+        user_ids = set(Order.objects.filter(pk__in=order_ids).values_list("user_id", flat=True))
+        transaction.on_commit(lambda: bump(*(orders_tag(user_id) for user_id in user_ids)))
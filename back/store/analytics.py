@@ -0,0 +1,137 @@
+# onlinestore/store/analytics.py
+"""
+Incremental sales rollups for the /analytics/ endpoints.
+
+`update_rollups()` reads only the orders above the RollupCheckpoint
+high-water mark, SALES_ROLLUP_CHUNK orders per transaction, and adds them
+to the hourly and daily ProductSalesRollup / CategorySalesRollup rows.
+Checkpoint and rollups are written in the same transaction, so a run that
+dies halfway never counts an order twice. Dashboards read the rollups
+only and never touch Order / OrderItem.
+
+Orders younger than SALES_ROLLUP_LAG seconds are left for the next run:
+ids are handed out before commit, so a slow transaction could otherwise
+commit an id below the mark after the mark has moved past it. Status
+changes after an order was rolled up (e.g. a later cancellation) are not
+reflected until `manage.py rebuild_sales_rollups`.
+"""
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import CategorySalesRollup, Order, OrderItem, ProductSalesRollup, RollupCheckpoint
+
+CHECKPOINT = "sales"
+GRANULARITIES = ("hour", "day")
+
+
+def truncate(moment, granularity):
+    """Start of the UTC hour / day that contains `moment`."""
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == "day" else moment
+
+
+def update_rollups(chunk_size=None, max_chunks=None):
+    """Rolls up new orders chunk by chunk; returns how many orders were read."""
+    chunk_size = chunk_size or getattr(settings, "SALES_ROLLUP_CHUNK", 1000)
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, "SALES_ROLLUP_LAG", 60))
+    RollupCheckpoint.objects.get_or_create(name=CHECKPOINT)
+    processed = chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        count = _rollup_chunk(cutoff, chunk_size)
+        if not count:
+            break
+        processed += count
+        chunks += 1
+    return processed
+
+
+def rebuild_rollups(chunk_size=None):
+    """
+    Drops all rollups and replays every order still in the hot tables. The
+    reset is one short transaction; the replay then runs chunk by chunk like
+    `update_rollups`, so no transaction spans the whole history (dashboards
+    show partial numbers until it catches up).
+    """
+    with transaction.atomic():
+        ProductSalesRollup.objects.all().delete()
+        CategorySalesRollup.objects.all().delete()
+        RollupCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={"last_order_id": 0})
+    return update_rollups(chunk_size)
+
+
+@transaction.atomic
+def _rollup_chunk(cutoff, chunk_size):
+    # блокировка чекпоинта — два воркера не прибавят один и тот же заказ дважды
+    checkpoint = RollupCheckpoint.objects.select_for_update().get(name=CHECKPOINT)
+    ids = list(
+        Order.objects.filter(id__gt=checkpoint.last_order_id, order_date__lt=cutoff)
+        .order_by("id").values_list("id", flat=True)[:chunk_size]
+    )
+    if not ids:
+        return 0
+
+    lines = (
+        OrderItem.objects.filter(order_id__in=ids).exclude(order__status="cancelled")
+        .values("order_id", "product_id", "quantity", "order__order_date", "product__category",
+                price=Coalesce("unit_price", "product__price"))
+    )
+    by_product = defaultdict(lambda: [None, Decimal(0), 0, set()])
+    by_category = defaultdict(lambda: [Decimal(0), 0, set()])
+    for line in lines:
+        revenue = line["price"] * line["quantity"]
+        for granularity in GRANULARITIES:
+            bucket = truncate(line["order__order_date"], granularity)
+            row = by_product[(granularity, bucket, line["product_id"])]
+            row[0] = line["product__category"]
+            row[1] += revenue
+            row[2] += line["quantity"]
+            row[3].add(line["order_id"])
+            row = by_category[(granularity, bucket, line["product__category"])]
+            row[0] += revenue
+            row[1] += line["quantity"]
+            row[2].add(line["order_id"])
+
+    _merge(ProductSalesRollup, "product_id", {
+        key: {"category": category, "revenue": revenue, "units": units, "orders": len(orders)}
+        for key, (category, revenue, units, orders) in by_product.items()
+    })
+    _merge(CategorySalesRollup, "category", {
+        key: {"revenue": revenue, "units": units, "orders": len(orders)}
+        for key, (revenue, units, orders) in by_category.items()
+    })
+
+    checkpoint.last_order_id = ids[-1]
+    checkpoint.save(update_fields=["last_order_id", "updated_at"])
+    return len(ids)
+
+
+def _merge(model, dimension, deltas):
+    """Adds `deltas` {(granularity, bucket, dimension): values} to existing rows or creates them."""
+    if not deltas:
+        return
+    existing = {
+        (row.granularity, row.bucket, getattr(row, dimension)): row
+        for row in model.objects.select_for_update().filter(
+            granularity__in={key[0] for key in deltas},
+            bucket__in={key[1] for key in deltas},
+            **{f"{dimension}__in": {key[2] for key in deltas}},
+        )
+    }
+    updated, created = [], []
+    for (granularity, bucket, value), delta in deltas.items():
+        row = existing.get((granularity, bucket, value))
+        if row is None:
+            created.append(model(granularity=granularity, bucket=bucket, **{dimension: value}, **delta))
+            continue
+        row.revenue += delta["revenue"]
+        row.units += delta["units"]
+        row.orders += delta["orders"]
+        updated.append(row)
+    model.objects.bulk_update(updated, ["revenue", "units", "orders"])
+    model.objects.bulk_create(created)
@@ -0,0 +1,94 @@
+# onlinestore/store/archive.py
+"""
+Cold storage for old orders.
+
+`archive_orders()` moves orders older than ORDER_ARCHIVE_AFTER_DAYS, with
+their items and checkouts, into ArchivedOrder rows, ORDER_ARCHIVE_CHUNK
+orders per transaction, so a run can be stopped at any point and resumed.
+The hot tables and their indexes then only hold recent orders; read paths
+look at the archive only when asked (?include_archived=1).
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump, orders_tag
+from .models import ArchivedOrder, Checkout, CheckoutItem, Order, OrderItem
+
+# данные карты (card_number, cvv, ...) в архив не попадают
+CHECKOUT_FIELDS = (
+    "id", "first_name", "last_name", "email", "address", "apartment", "country",
+    "state", "zip_code", "created_at", "status", "coupon_code",
+)
+
+
+def archive_cutoff():
+    return timezone.now() - timedelta(days=getattr(settings, "ORDER_ARCHIVE_AFTER_DAYS", 365))
+
+
+def archive_orders(before=None, chunk_size=None, max_chunks=None):
+    """Archives orders placed before `before` chunk by chunk; returns how many."""
+    before = before or archive_cutoff()
+    chunk_size = chunk_size or getattr(settings, "ORDER_ARCHIVE_CHUNK", 500)
+    archived = chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        count = _archive_chunk(before, chunk_size)
+        if not count:
+            break
+        archived += count
+        chunks += 1
+    return archived
+
+
+@transaction.atomic
+def _archive_chunk(before, chunk_size):
+    ids = list(
+        Order.objects.filter(order_date__lt=before).order_by("id")
+        .select_for_update(skip_locked=True).values_list("id", flat=True)[:chunk_size]
+    )
+    if not ids:
+        return 0
+
+    items = defaultdict(list)
+    for row in (OrderItem.objects.filter(order_id__in=ids).order_by("id")
+                .values("id", "order_id", "quantity", "unit_price", "product_id", "product__name", "product__price")):
+        items[row["order_id"]].append({
+            "id": row["id"],
+            "product": {"id": row["product_id"], "name": row["product__name"], "price": row["product__price"]},
+            "unit_price": row["unit_price"],
+            "quantity": row["quantity"],
+        })
+
+    checkouts = {}
+    checkout_rows = list(Checkout.objects.filter(order_id__in=ids).values("order_id", *CHECKOUT_FIELDS))
+    checkout_ids = [row["id"] for row in checkout_rows]
+    checkout_items = defaultdict(list)
+    for row in CheckoutItem.objects.filter(checkout_id__in=checkout_ids).order_by("id").values(
+            "checkout_id", "product_id", "quantity"):
+        checkout_items[row.pop("checkout_id")].append(row)
+    for row in checkout_rows:
+        row["items"] = checkout_items[row["id"]]
+        checkouts[row.pop("order_id")] = row
+
+    orders = list(Order.objects.filter(pk__in=ids).values("id", "user_id", "amount", "status", "order_date"))
+    ArchivedOrder.objects.bulk_create(
+        [
+            ArchivedOrder(**row, items=items[row["id"]], item_count=len(items[row["id"]]),
+                          checkout=checkouts.get(row["id"]))
+            for row in orders
+        ],
+        ignore_conflicts=True,  # повторный прогон после сбоя не падает на уже перенесённых
+    )
+
+    # у позиций и checkout нет delete-сигналов — Collector удаляет их одним DELETE
+    # без выборки; счётчики профиля «за всё время» учитывают архив
+    # (rebuild_order_counters), а кэш истории сбрасываем одним bump ниже
+    Checkout.objects.filter(pk__in=checkout_ids).delete()
+    Order.objects.filter(pk__in=ids).delete()
+
+    tags = {orders_tag(row["user_id"]) for row in orders}
+    transaction.on_commit(lambda: bump(*tags))
+    return len(ids)
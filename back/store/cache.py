@@ -0,0 +1,347 @@
+# onlinestore/store/cache.py
+"""
+Versioned, tag-based response cache.
+
+Every cached response key embeds the current generation of its tags
+("products", "product:<id>", ...). Writes bump the generation counters,
+so all variants of a list/detail response (any query string, any page,
+any Accept header) miss at once — nothing has to be deleted by key.
+
+Reads go through two tiers: a small per-worker LRU (L1) in front of the
+shared Redis cache (L2). Generations are kept in L1 for only
+CATALOG_GENERATION_TTL seconds, so every worker notices a bump within
+that window; payload keys embed the generation, so L1 never serves a
+response that belongs to an older generation than the worker knows of.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+
+CATALOG_TIMEOUT = getattr(settings, "CATALOG_CACHE_TIMEOUT", 60 * 60 * 6)
+L1_TIMEOUT = getattr(settings, "CATALOG_L1_TIMEOUT", 10)
+L1_MAX_ENTRIES = getattr(settings, "CATALOG_L1_MAX_ENTRIES", 256)
+GENERATION_TTL = getattr(settings, "CATALOG_GENERATION_TTL", 1)
+
+_MISSING = object()
+
+
+class LocalLRUCache:
+    """Thread-safe, size-bounded in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache:
+    """L1 (this worker) → L2 (django cache / Redis) with per-tier hit counters."""
+
+    def __init__(self, local):
+        self.local = local
+        self.counters = Counter()
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self.counters["l1_hits"] += 1
+            return value
+        self.counters["l1_misses"] += 1
+
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            self.counters["l2_misses"] += 1
+            return default
+        self.counters["l2_hits"] += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value, timeout=CATALOG_TIMEOUT):
+        cache.set(key, value, timeout)
+        self.local.set(key, value)
+
+    def stats(self):
+        return {
+            "l1_hits": self.counters["l1_hits"],
+            "l1_misses": self.counters["l1_misses"],
+            "l2_hits": self.counters["l2_hits"],
+            "l2_misses": self.counters["l2_misses"],
+            "l1_entries": len(self.local),
+            "l1_max_entries": self.local.max_entries,
+        }
+
+
+# один экземпляр на процесс (gunicorn worker)
+tiered_cache = TieredCache(LocalLRUCache(L1_MAX_ENTRIES, L1_TIMEOUT))
+_local_generations = LocalLRUCache(4096, GENERATION_TTL)
+
+
+@receiver(setting_changed)
+def _reset_local_tier(setting, **kwargs):
+    # override_settings(CACHES=...) в тестах — L1 не должен пережить смену L2
+    if setting == "CACHES":
+        tiered_cache.local.clear()
+        _local_generations.clear()
+
+CATALOG_TAG = "catalog"        # всё содержимое каталога — для массовых операций
+PRODUCT_LIST_TAG = "products"  # любые списки товаров
+PRODUCT_STOCK_TAG = "products:stock"  # только списки, которые показывают quantity
+
+
+def product_tag(product_id):
+    return f"product:{product_id}"
+
+
+def orders_tag(user_id):
+    return f"orders:user:{user_id}"
+
+
+def _generation_key(tag):
+    return f"cachegen:{tag}"
+
+
+def _modified_key(tag):
+    return f"cachegen:{tag}:at"
+
+
+def _initial_generation():
+    # если Redis вытеснил счётчик, новое значение не совпадёт со старыми ключами
+    return int(time.time() * 1000)
+
+
+def get_generations(tags):
+    """
+    Returns {tag: generation}. Fresh local values are used as-is; the rest
+    are fetched with a single cache round trip.
+    """
+    generations = {}
+    keys = {}
+    for tag in tags:
+        key = _generation_key(tag)
+        value = _local_generations.get(key)
+        if value is None:
+            keys[key] = tag
+        else:
+            generations[tag] = value
+    if not keys:
+        return generations
+
+    found = cache.get_many(keys)
+    for key, tag in keys.items():
+        if key not in found:
+            cache.add(key, _initial_generation(), timeout=None)
+            found[key] = cache.get(key)
+        generations[tag] = found[key]
+        _local_generations.set(key, found[key])
+    return generations
+
+
+def get_last_modified(tags):
+    """Latest bump time of `tags` as an aware datetime, or None if never bumped."""
+    stamps = []
+    keys = []
+    for tag in tags:
+        key = _modified_key(tag)
+        value = _local_generations.get(key)
+        if value is None:
+            keys.append(key)
+        else:
+            stamps.append(value)
+    if keys:
+        found = cache.get_many(keys)
+        for key in keys:
+            value = found.get(key, 0)
+            _local_generations.set(key, value)
+            stamps.append(value)
+    stamp = max(stamps, default=0)
+    return datetime.fromtimestamp(stamp, tz=timezone.utc) if stamp else None
+
+
+def bump(*tags):
+    """Invalidates every cached response that depends on any of `tags`."""
+    now = time.time()
+    cache.set_many({_modified_key(tag): now for tag in tags}, timeout=None)
+    for tag in tags:
+        _local_generations.set(_modified_key(tag), now)
+        key = _generation_key(tag)
+        try:
+            value = cache.incr(key)
+        except ValueError:
+            value = _initial_generation()
+            if not cache.add(key, value, timeout=None):
+                value = cache.incr(key)
+        # этот воркер видит новое поколение сразу, остальные — через GENERATION_TTL
+        _local_generations.set(key, value)
+
+
+def _version(generations):
+    version = ".".join(str(generations[tag]) for tag in sorted(generations))
+    if len(generations) > 4:
+        # ?ids= зависит от десятков тегов — ключ кэша не должен расти с ними
+        version = hashlib.md5(version.encode(), usedforsecurity=False).hexdigest()
+    return version
+
+
+def _response_key(request, key_prefix, generations):
+    raw = "|".join([
+        request.get_full_path(),
+        request.META.get("HTTP_ACCEPT", ""),
+        request.META.get("HTTP_ACCEPT_LANGUAGE", ""),
+    ])
+    digest = hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+    return f"views.{key_prefix}.{digest}.{_version(generations)}"
+
+
+def cache_response(key_prefix, tags, timeout=CATALOG_TIMEOUT):
+    """
+    Drop-in replacement for `cache_page` on DRF handlers:
+
+        @method_decorator(cache_response("products_list", lambda request: [PRODUCT_LIST_TAG]), name="get")
+
+    `tags(request, *args, **kwargs)` returns the tags the response depends on.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view_func(request, *args, **kwargs)
+
+            generations = get_generations(tags(request, *args, **kwargs))
+            key = _response_key(request, key_prefix, generations)
+            cached = tiered_cache.get(key)
+            if cached is not None:
+                status_code, content_type, content = cached
+                return HttpResponse(content, status=status_code, content_type=content_type)
+
+            response = view_func(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming:
+                return response
+            if getattr(response, "skip_response_cache", False):
+                # ответ из снимка (store/snapshot.py) может быть старше текущего поколения
+                return response
+
+            def store(rendered):
+                tiered_cache.set(key, (rendered.status_code, rendered["Content-Type"], rendered.content), timeout)
+
+            if hasattr(response, "render") and callable(response.render):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapped
+    return decorator
+
+
+def conditional_response(tags, extra_version=None):
+    """
+    Weak ETag / Last-Modified for a handler, computed from tag generations only.
+    A matching If-None-Match / If-Modified-Since returns 304 before the view
+    (and the serializer) runs. Put it above `cache_response`.
+
+    `extra_version()` may add a marker that is not a tag — e.g. the version of
+    the product list snapshot, which can lag behind the generations.
+    """
+    def etag(request, *args, **kwargs):
+        version = _version(get_generations(tags(request, *args, **kwargs)))
+        if extra_version is not None:
+            version = f"{version}.{extra_version()}"
+        accept = hashlib.md5(request.META.get("HTTP_ACCEPT", "").encode(),
+                             usedforsecurity=False).hexdigest()[:8]
+        return f'W/"{version}-{accept}"'
+
+    def last_modified(request, *args, **kwargs):
+        if extra_version is not None:
+            return None  # снимок мог устареть относительно тегов — только ETag
+        return get_last_modified(tags(request, *args, **kwargs))
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+# ────────── теги каталога ──────────
+def _shows_quantity(params):
+    def split(value):
+        return {name.strip() for name in (value or "").split(",")}
+
+    if params.get("fields"):
+        return "quantity" in split(params["fields"])
+    if "ids" in params or params.get("view") == "full":
+        return True
+    return "quantity" in split(params.get("expand"))
+
+
+def product_list_tags(request, *args, **kwargs):
+    # списание стока (Product.reserve_stock) поднимает только PRODUCT_STOCK_TAG и
+    # теги товаров: карточки по умолчанию и снимок списка quantity не показывают
+    tags = [CATALOG_TAG, PRODUCT_LIST_TAG]
+    if _shows_quantity(request.GET):
+        tags.append(PRODUCT_STOCK_TAG)
+    ids = request.GET.get("ids")
+    if ids is not None:
+        # ?ids=1,5,9 (корзина) зависит только от этих товаров
+        limit = getattr(settings, "PRODUCT_BATCH_MAX_IDS", 100)
+        pks = [part.strip() for part in ids.split(",") if part.strip().isdigit()][:limit]
+        tags += [product_tag(pk) for pk in pks]
+    return tags
+
+
+def product_detail_tags(request, *args, pk=None, **kwargs):
+    return [CATALOG_TAG, product_tag(pk)]
+
+
+def product_reviews_tags(request, *args, product_pk=None, **kwargs):
+    return [CATALOG_TAG, product_tag(product_pk)]
+
+
+def user_orders_tags(request, *args, **kwargs):
+    return [orders_tag(request.user.pk)]
+
+
+def order_detail_tags(request, *args, pk=None, **kwargs):
+    # деталь заказа показывает живые товары (цена, остаток, описание) — зависит и от них
+    from .models import OrderItem
+
+    product_ids = (OrderItem.objects.filter(order_id=pk, order__user_id=request.user.pk)
+                   .values_list("product_id", flat=True).distinct())
+    return [orders_tag(request.user.pk), CATALOG_TAG, *(product_tag(pid) for pid in product_ids)]
@@ -0,0 +1,131 @@
+# onlinestore/store/campaigns.py
+"""
+Coupon campaigns: pools of pre-generated codes.
+
+`generate_codes()` fills a campaign in batches: random bytes for the whole
+batch are drawn at once and mapped onto the code alphabet with one
+bytes.translate, duplicates are dropped in memory, and each batch goes in
+with a multi-row INSERT ... ON CONFLICT DO NOTHING (bulk_create with
+ignore_conflicts). Collisions with existing codes are simply topped up by
+the next batch.
+
+Pooled codes are inactive until issued. `claim_code()` hands one to a user
+with a single conditional UPDATE (SKIP LOCKED, so concurrent sign-ups take
+different rows); registration never generates a code itself.
+"""
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Subquery
+from django.utils import timezone
+
+from .coupons import remember_code
+from .models import Coupon, CouponCampaign
+
+# без 0/O и 1/I; 256 делится на 32 — каждый символ равновероятен
+ALPHABET = b"ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+CODE_LENGTH = 8
+_TRANSLATE = bytes(ALPHABET[i % len(ALPHABET)] for i in range(256))
+
+
+def random_codes(count, prefix=""):
+    """`count` random codes (possibly with duplicates), generated in one batch."""
+    raw = secrets.token_bytes(count * CODE_LENGTH).translate(_TRANSLATE).decode()
+    return [prefix + raw[i:i + CODE_LENGTH] for i in range(0, len(raw), CODE_LENGTH)]
+
+
+def _batch_size():
+    return getattr(settings, "COUPON_BATCH_SIZE", 5000)
+
+
+def generate_codes(campaign, count, batch_size=None):
+    """Adds `count` new unissued codes to the campaign; returns how many were inserted."""
+    batch_size = batch_size or _batch_size()
+    inserted = 0
+    while inserted < count:
+        codes = set(random_codes(min(count - inserted, batch_size), campaign.prefix))
+        # считаем только эту пачку (по уникальному индексу code), а не весь пул кампании
+        batch = Coupon.objects.filter(campaign=campaign, code__in=codes)
+        existed = batch.count()
+        now = timezone.now()
+        Coupon.objects.bulk_create(
+            [
+                # expires_at — заглушка, срок ставится при выдаче
+                Coupon(code=code, campaign=campaign, amount=campaign.amount, expires_at=now, is_active=False)
+                for code in codes
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,  # коллизии с существующими кодами — добираем следующей пачкой
+        )
+        inserted += batch.count() - existed
+    return inserted
+
+
+def pool_size(campaign):
+    return Coupon.objects.filter(campaign=campaign, issued_at__isnull=True).count()
+
+
+def _issue_values(campaign):
+    now = timezone.now()
+    return {"issued_at": now, "is_active": True, "expires_at": now + timedelta(days=campaign.valid_days)}
+
+
+def claim_code(campaign, user):
+    """
+    Issues one pooled code to `user`:
+
+        UPDATE coupon SET user_id = .., is_active, issued_at, expires_at
+        WHERE id IN (SELECT id ... WHERE campaign_id = .. AND issued_at IS NULL
+                     LIMIT 1 FOR UPDATE SKIP LOCKED)
+
+    Returns the Coupon, or None if the pool is empty.
+    """
+    pool = Coupon.objects.filter(campaign=campaign, issued_at__isnull=True).order_by()
+    with transaction.atomic():
+        claimed = Coupon.objects.filter(
+            pk__in=Subquery(pool.select_for_update(skip_locked=True).values("pk")[:1])
+        ).update(user=user, **_issue_values(campaign))
+        if not claimed:
+            return None
+        coupon = Coupon.objects.get(user=user)
+    remember_code(coupon.code)  # UPDATE не шлёт post_save — фильтр купонов узнаёт код сам
+    return coupon
+
+
+@transaction.atomic
+def issue_codes(campaign, count):
+    """Issues `count` unbound pooled codes (e.g. for a mailing) and returns them."""
+    ids = list(
+        Coupon.objects.filter(campaign=campaign, issued_at__isnull=True).order_by()
+        .select_for_update(skip_locked=True).values_list("pk", flat=True)[:count]
+    )
+    Coupon.objects.filter(pk__in=ids).update(**_issue_values(campaign))
+    codes = list(Coupon.objects.filter(pk__in=ids).values_list("code", flat=True))
+    for code in codes:
+        remember_code(code)
+    return codes
+
+
+# ────────── welcome-купоны ──────────
+def welcome_campaign():
+    campaign, _ = CouponCampaign.objects.get_or_create(
+        name=getattr(settings, "WELCOME_COUPON_CAMPAIGN", "welcome"),
+        defaults={"amount": 5000, "valid_days": 30},
+    )
+    return campaign
+
+
+def top_up_welcome_pool():
+    """Refills the welcome pool to COUPON_POOL_REFILL codes once it drops below COUPON_POOL_LOW_WATER."""
+    campaign = welcome_campaign()
+    available = pool_size(campaign)
+    if available >= getattr(settings, "COUPON_POOL_LOW_WATER", 10_000):
+        return 0
+    return generate_codes(campaign, getattr(settings, "COUPON_POOL_REFILL", 50_000) - available)
+
+
+def claim_welcome_coupon(user):
+    """Registration: one pooled welcome code for a new user, or None if the pool is empty."""
+    return claim_code(welcome_campaign(), user)
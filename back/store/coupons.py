@@ -0,0 +1,226 @@
+# onlinestore/store/coupons.py
+"""
+Coupon lookups that keep guessed codes away from the database.
+
+- A Bloom filter over every existing code is rebuilt by Celery beat
+  (`rebuild_coupon_filter`) and published in the cache; each worker keeps
+  a local copy and reloads it when the published version changes. A code
+  the filter has never seen is rejected without a query.
+- Codes created after the last rebuild are added to the local copy and
+  get a short-lived "fresh" marker in the cache as soon as they are saved
+  (before commit), so other workers accept them until the next rebuild
+  picks them up. The filter therefore never rejects an existing code; a
+  false positive just costs the usual query. Until the first rebuild (or
+  after the cache lost the filter) every lookup goes to the database.
+- Valid coupons are kept in the cache for COUPON_CACHE_TTL seconds;
+  saves and redemptions drop the entry (see store/signals.py).
+
+Callers still check `is_valid`; redemption itself is Coupon.redeem().
+Expiry is lazy too: `is_valid` compares expires_at on read, and
+`expire_coupons()` only clears the is_active flag afterwards, in chunks.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Subquery
+from django.dispatch import receiver
+from django.utils import timezone
+
+FILTER_KEY = "coupons:bloom"
+FILTER_VERSION_KEY = "coupons:bloom:version"
+EXPIRY_PROGRESS_KEY = "coupons:expiry:progress"
+MAX_CODE_LENGTH = 20  # Coupon.code max_length
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b digest)."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def _cache_ttl():
+    return getattr(settings, "COUPON_CACHE_TTL", 30)
+
+
+def _rebuild_interval():
+    return getattr(settings, "COUPON_BLOOM_REBUILD", 60 * 10)
+
+
+def _code_key(code):
+    return f"coupons:code:{hashlib.md5(code.encode(), usedforsecurity=False).hexdigest()}"
+
+
+def _fresh_key(code):
+    return f"{_code_key(code)}:fresh"
+
+
+# ────────── фильтр (один на процесс) ──────────
+class _LocalFilter:
+    def __init__(self):
+        self.filter = None
+        self.version = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+
+_local = _LocalFilter()
+counters = Counter()
+
+
+@receiver(setting_changed)
+def _reset_local_filter(setting, **kwargs):
+    # как в store/cache.py: локальная копия не должна пережить смену кэша
+    if setting == "CACHES":
+        with _local.lock:
+            _local.filter, _local.version, _local.checked_at = None, None, 0.0
+
+
+def build_filter():
+    """Builds the filter from every code in the table and publishes it to all workers."""
+    from .models import Coupon
+
+    started = time.time()
+    codes = Coupon.objects.values_list("code", flat=True)
+    bloom = BloomFilter(
+        max(codes.count() * 2, getattr(settings, "COUPON_BLOOM_MIN_CAPACITY", 10_000)),
+        getattr(settings, "COUPON_BLOOM_ERROR_RATE", 0.001),
+    )
+    for code in codes.iterator(chunk_size=5000):
+        bloom.add(code)
+    cache.set(FILTER_KEY, bloom, timeout=None)
+    cache.set(FILTER_VERSION_KEY, started, timeout=None)
+    with _local.lock:
+        _local.filter, _local.version, _local.checked_at = bloom, started, time.monotonic()
+    return bloom
+
+
+def current_filter():
+    """This worker's copy, reloaded at most every COUPON_BLOOM_CHECK seconds if a newer one was published."""
+    if time.monotonic() - _local.checked_at < getattr(settings, "COUPON_BLOOM_CHECK", 5):
+        return _local.filter
+    version = cache.get(FILTER_VERSION_KEY)
+    with _local.lock:
+        _local.checked_at = time.monotonic()
+        if version is None:
+            # кэш очищен вместе с маркерами новых кодов — локальной копии больше нельзя верить
+            _local.filter = _local.version = None
+        elif version != _local.version:
+            bloom = cache.get(FILTER_KEY)
+            if bloom is not None:
+                _local.filter, _local.version = bloom, version
+        return _local.filter
+
+
+def might_exist(code):
+    bloom = current_filter()
+    if bloom is None:
+        return True  # фильтр ещё не собран — спрашиваем БД
+    return code in bloom or cache.get(_fresh_key(code)) is not None
+
+
+# ────────── поиск купона ──────────
+def lookup_coupon(code):
+    """Returns the Coupon with this code or None; a miss usually costs no query."""
+    from .models import Coupon
+
+    if not code or len(code) > MAX_CODE_LENGTH:
+        counters["filtered"] += 1
+        return None
+    coupon = cache.get(_code_key(code))
+    if coupon is not None:
+        counters["cache_hits"] += 1
+        return coupon
+    if not might_exist(code):
+        counters["filtered"] += 1
+        return None
+    counters["db_lookups"] += 1
+    coupon = Coupon.objects.filter(code=code).first()
+    if coupon is None:
+        counters["false_positives"] += 1
+    elif coupon.is_valid:
+        cache.set(_code_key(code), coupon, _cache_ttl())
+    return coupon
+
+
+def remember_code(code):
+    """A new code: visible to this worker at once, to the others via the fresh marker."""
+    with _local.lock:
+        if _local.filter is not None:
+            _local.filter.add(code)
+    cache.set(_fresh_key(code), 1, timeout=2 * _rebuild_interval())
+
+
+def forget_coupon(code):
+    """Drops the cached coupon (after a save or a redemption)."""
+    cache.delete(_code_key(code))
+
+
+def stats():
+    return {
+        "cache_hits": counters["cache_hits"],
+        "filtered": counters["filtered"],
+        "db_lookups": counters["db_lookups"],
+        "false_positives": counters["false_positives"],
+        "filter_bits": _local.filter.size if _local.filter is not None else 0,
+        "expiry": cache.get(EXPIRY_PROGRESS_KEY),
+    }
+
+
+# ────────── чистка просроченных ──────────
+def expire_coupons(chunk_size=None, max_chunks=None):
+    """
+    Deactivates expired coupons COUPON_EXPIRY_CHUNK rows per transaction:
+
+        UPDATE coupon SET is_active = false WHERE id IN (
+            SELECT id ... WHERE is_active AND expires_at < now
+            ORDER BY expires_at LIMIT n FOR UPDATE SKIP LOCKED)
+
+    The subquery walks the partial index on expires_at WHERE is_active, and
+    every committed chunk drops out of that index, so the index itself is
+    the checkpoint: a stopped run resumes where it left off. Rows locked by
+    a checkout are skipped and picked up next time. Progress is kept in the
+    cache for monitoring; returns how many coupons were deactivated.
+    """
+    from .models import Coupon
+
+    chunk_size = chunk_size or getattr(settings, "COUPON_EXPIRY_CHUNK", 1000)
+    pause = getattr(settings, "COUPON_EXPIRY_PAUSE", 0)
+    cutoff = timezone.now()
+    expired = (Coupon.objects.filter(is_active=True, expires_at__lt=cutoff)
+               .order_by("expires_at").select_for_update(skip_locked=True).values("pk"))
+    total = chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        with transaction.atomic():
+            count = Coupon.objects.filter(pk__in=Subquery(expired[:chunk_size])).update(is_active=False)
+        if not count:
+            break
+        total += count
+        chunks += 1
+        cache.set(EXPIRY_PROGRESS_KEY, {"cutoff": cutoff, "expired": total, "chunks": chunks}, timeout=None)
+        if pause:
+            time.sleep(pause)  # реплики и autovacuum успевают за чистку
+    return total
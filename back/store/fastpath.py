@@ -0,0 +1,123 @@
+# onlinestore/store/fastpath.py
+"""
+Read-only fast path for the high-volume list endpoints.
+
+Rows come straight from `.values()`. Each DRF serializer is compiled once
+into a tuple of (output name, row key, to_representation) getters, so the
+per-row work is a dict lookup plus the very same field conversion DRF
+would apply — no model instances, no get_attribute chains, no nested
+serializer instances. The output is identical to the serializers
+(FastPathParityTests compares the rendered bytes).
+"""
+from functools import cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+
+
+def fast_path_enabled():
+    return getattr(settings, "FAST_READ_SERIALIZERS", False)
+
+
+def _identity(value):
+    return value
+
+
+class RowSerializer:
+    """
+    Compiled getters for one serializer class.
+
+    - plain fields read `prefix + field.source` and reuse field.to_representation;
+    - related fields read the `<source>_id` column;
+    - `sources` maps a field to another column (e.g. "user" → "user__username");
+    - `nested` fields are expected to be filled into the row by the caller.
+    """
+
+    def __init__(self, serializer_class, prefix="", sources=None, nested=()):
+        sources = sources or {}
+        self.getters = []
+        self.columns = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if name in nested:
+                self.getters.append((name, name, _identity))
+                continue
+            if name in sources:
+                key, convert = prefix + sources[name], _identity
+            elif isinstance(field, serializers.RelatedField):
+                key, convert = f"{prefix}{field.source}_id", _identity
+            elif isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField)) \
+                    or "." in field.source:
+                raise ImproperlyConfigured(
+                    f"{serializer_class.__name__}.{name} needs a `sources` or `nested` entry"
+                )
+            else:
+                key, convert = prefix + field.source, field.to_representation
+            self.columns.append(key)
+            self.getters.append((name, key, convert))
+        self.getters = tuple(self.getters)
+
+    def __call__(self, row):
+        data = {}
+        for name, key, convert in self.getters:
+            value = row[key]
+            data[name] = None if value is None else convert(value)
+        return data
+
+
+# ────────── скомпилированные сериализаторы (один раз на процесс) ──────────
+@cache
+def product_card_row():
+    from .serializers import ProductCardSerializer
+    return RowSerializer(ProductCardSerializer, nested=("image",))
+
+
+@cache
+def review_row():
+    from .serializers import ReviewSerializer
+    return RowSerializer(ReviewSerializer, sources={"user": "user__username"})
+
+
+@cache
+def order_summary_row():
+    from .serializers import OrderSummarySerializer
+    return RowSerializer(OrderSummarySerializer)
+
+
+# ────────── сборщики ответов ──────────
+def product_card_columns():
+    return product_card_row().columns
+
+
+def product_cards(rows):
+    """`rows` — Product .values(*product_card_columns()) rows (e.g. one page)."""
+    from .models import ProductImage, build_image_urls
+
+    compiled = product_card_row()
+    first_image = {}
+    images = ProductImage.objects.filter(
+        product_id__in=[row["id"] for row in rows]
+    ).order_by("id").values_list("product_id", "url", "image")
+    for product_id, url, image in images:
+        if product_id not in first_image:
+            first_image[product_id] = url or build_image_urls(image)[0]
+    for row in rows:
+        row["image"] = first_image.get(row["id"])
+    return [compiled(row) for row in rows]
+
+
+def reviews(queryset):
+    compiled = review_row()
+    return [compiled(row) for row in queryset.values(*compiled.columns)]
+
+
+def order_summary_columns():
+    return order_summary_row().columns
+
+
+def order_summaries(rows):
+    """`rows` — Order .values(*order_summary_columns()) rows with item_count annotated."""
+    compiled = order_summary_row()
+    return [compiled(row) for row in rows]
@@ -0,0 +1,152 @@
+# onlinestore/store/gemini.py
+"""
+Response cache and request coalescing for Gemini calls.
+
+Answers are keyed by model + normalized prompt (whitespace collapsed,
+case folded) and kept in the same two tiers as the catalog cache: a
+bounded per-worker LRU with a short TTL in front of the shared cache
+(GEMINI_CACHE_TTL). Identical prompts that miss at the same time share
+one upstream call: inside a worker through an in-flight future, across
+workers through a cache.add lock (as in store/snapshot.py) — the others
+wait up to GEMINI_SINGLE_FLIGHT_WAIT for the answer, then call Gemini
+themselves rather than fail. Errors are never cached.
+
+`bypass=True` skips the lookup (the fresh answer still replaces the cached
+one). `stats()` feeds GET /cache/stats/.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .cache import LocalLRUCache, TieredCache
+
+LOCK_TIMEOUT = 120           # сек — страховка, если воркер умер во время вызова
+
+answer_cache = TieredCache(LocalLRUCache(
+    getattr(settings, "GEMINI_CACHE_MAX_ENTRIES", 512),
+    getattr(settings, "GEMINI_CACHE_L1_TTL", 60 * 5),
+))
+counters = Counter()
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+@receiver(setting_changed)
+def _reset_local_tier(setting, **kwargs):
+    if setting == "CACHES":
+        answer_cache.local.clear()
+
+
+def normalize_prompt(text):
+    return " ".join(text.split()).casefold()
+
+
+def prompt_key(model, contents):
+    digest = hashlib.sha256(f"{model}\0{normalize_prompt(contents)}".encode()).hexdigest()
+    return f"gemini:answer:{digest}"
+
+
+def _ttl():
+    return getattr(settings, "GEMINI_CACHE_TTL", 60 * 60)
+
+
+def _wait():
+    return getattr(settings, "GEMINI_SINGLE_FLIGHT_WAIT", 30)
+
+
+def _call(client, model, contents, key):
+    counters["upstream_calls"] += 1
+    try:
+        answer = client.models.generate_content(model=model, contents=contents).text
+    except Exception:
+        counters["upstream_errors"] += 1
+        raise
+    if answer:
+        answer_cache.set(key, answer, _ttl())
+    return answer
+
+
+def _fetch_once(client, model, contents, key):
+    """Calls Gemini unless another worker already does; then waits for its answer."""
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            return _call(client, model, contents, key)
+        finally:
+            cache.delete(lock_key)
+    counters["coalesced"] += 1
+    deadline = time.monotonic() + _wait()
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        answer = cache.get(key)
+        if answer is not None:
+            return answer
+        if not cache.get(lock_key):
+            break  # другой воркер завершился с ошибкой
+    return _call(client, model, contents, key)
+
+
+def generate(client, model, contents, bypass=False):
+    """`client.models.generate_content(...).text`, served from the cache when possible."""
+    key = prompt_key(model, contents)
+    if bypass:
+        counters["bypass"] += 1
+        return _call(client, model, contents, key)
+
+    answer = answer_cache.get(key)
+    if answer is not None:
+        counters["hits"] += 1
+        return answer
+    counters["misses"] += 1
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        counters["coalesced"] += 1
+        try:
+            return future.result(timeout=_wait())
+        except FutureTimeout:
+            return _call(client, model, contents, key)
+
+    try:
+        answer = _fetch_once(client, model, contents, key)
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(answer)
+        return answer
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def bypass_requested(request):
+    """`Cache-Control: no-cache` or ?no_cache=1 forces a fresh answer."""
+    return ("no-cache" in request.META.get("HTTP_CACHE_CONTROL", "")
+            or request.query_params.get("no_cache") in ("1", "true"))
+
+
+def stats():
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        "hits": counters["hits"],
+        "misses": counters["misses"],
+        "hit_rate": round(counters["hits"] / lookups, 4) if lookups else None,
+        "coalesced": counters["coalesced"],
+        "bypass": counters["bypass"],
+        "upstream_calls": counters["upstream_calls"],
+        "upstream_errors": counters["upstream_errors"],
+        "tiers": answer_cache.stats(),
+    }
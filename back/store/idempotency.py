@@ -0,0 +1,121 @@
+# onlinestore/store/idempotency.py
+"""
+Idempotency-Key support for POST handlers that create orders.
+
+The first request with a given key takes a short cache.add lock, runs the
+view and stores the rendered response for IDEMPOTENCY_TTL. A retry with the
+same key (and the same body) gets the stored response back without running
+the serializer again; a duplicate that arrives while the first one is still
+running waits for it instead of racing it. Keys are scoped per user.
+"""
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http.request import RawPostDataException
+from django.http import HttpResponse, JsonResponse
+
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+MAX_KEY_LENGTH = 255
+LOCK_TIMEOUT = 60            # сек — страховка, если воркер умер посреди запроса
+
+
+def _ttl():
+    return getattr(settings, "IDEMPOTENCY_TTL", 60 * 60 * 24)
+
+
+def _wait():
+    return getattr(settings, "IDEMPOTENCY_WAIT", 10)
+
+
+def _fingerprint(request):
+    try:
+        body = request.body
+    except RawPostDataException:  # поток уже прочитал парсер DRF
+        body = json.dumps(request.data, sort_keys=True, default=str).encode()
+    return hashlib.sha256(body).hexdigest()
+
+
+def _replay(stored):
+    fingerprint, status_code, content_type, content, location = stored
+    response = HttpResponse(content, status=status_code, content_type=content_type)
+    if location:
+        response["Location"] = location
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _error(message, status_code):
+    return JsonResponse({"detail": message}, status=status_code)
+
+
+def idempotent(scope):
+    """
+    Decorator for a DRF handler, applied like `cache_response`:
+
+        @method_decorator(idempotent("checkout"), name="post")
+
+    Requests without an Idempotency-Key header are passed through untouched.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            raw_key = request.META.get(HEADER)
+            if not raw_key:
+                return view_func(request, *args, **kwargs)
+            if len(raw_key) > MAX_KEY_LENGTH:
+                return _error("Idempotency-Key is too long.", 400)
+
+            owner = request.user.pk if request.user.is_authenticated else "anon"
+            digest = hashlib.sha256(raw_key.encode()).hexdigest()
+            key = f"idempotency:{scope}:{owner}:{digest}"
+            lock_key = f"{key}:lock"
+            fingerprint = _fingerprint(request)
+
+            stored = cache.get(key)
+            if stored is None:
+                # тот же ключ уже обрабатывается — ждём его ответ, а не создаём дубль
+                deadline = time.monotonic() + _wait()
+                while not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+                    stored = cache.get(key)
+                    if stored is not None:
+                        break
+                    if time.monotonic() >= deadline:
+                        return _error("A request with this Idempotency-Key is still in progress.", 409)
+                    time.sleep(0.05)
+                else:
+                    stored = cache.get(key)  # первый мог завершиться между get и add
+                    if stored is not None:
+                        cache.delete(lock_key)
+            if stored is not None:
+                if stored[0] != fingerprint:
+                    return _error("Idempotency-Key was already used with a different request body.", 422)
+                return _replay(stored)
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except BaseException:
+                cache.delete(lock_key)
+                raise
+
+            def store(rendered):
+                try:
+                    # 5xx не сохраняем — повтор должен выполнить запрос заново
+                    if rendered.status_code < 500:
+                        cache.set(key, (
+                            fingerprint, rendered.status_code, rendered["Content-Type"],
+                            rendered.content, rendered.get("Location"),
+                        ), _ttl())
+                finally:
+                    cache.delete(lock_key)
+
+            if hasattr(response, "render") and callable(response.render):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Moves old orders, their items and checkouts into ArchivedOrder."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Archive orders older than this (default: ORDER_ARCHIVE_AFTER_DAYS).")
+        parser.add_argument("--chunk", type=int, help="Orders per transaction (default: ORDER_ARCHIVE_CHUNK).")
+        parser.add_argument("--max-chunks", type=int, help="Stop after this many chunks.")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["days"]) if options["days"] is not None else None
+        count = archive_orders(before, options["chunk"], options["max_chunks"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {count} orders"))
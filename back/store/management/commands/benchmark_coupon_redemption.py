@@ -0,0 +1,92 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from store.models import Coupon
+
+
+class Command(BaseCommand):
+    help = (
+        "Lets N workers redeem the same coupon at the same instant, for several "
+        "coupons, and reports winners per coupon and per-attempt latency. Use a "
+        "real Postgres database: SQLite serializes all writers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--coupons", type=int, default=50)
+        parser.add_argument("--workers", type=int, default=16)
+        parser.add_argument(
+            "--mode", choices=["conditional", "naive"], default="conditional",
+            help="conditional: Coupon.redeem; naive: check is_valid, then save "
+                 "(shows the double redemption).",
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        redeem = getattr(self, f"redeem_{options['mode']}")
+        barrier = threading.Barrier(workers)
+        latencies = []
+
+        def attempt(code):
+            try:
+                barrier.wait()  # все воркеры стартуют одновременно
+                started = time.perf_counter()
+                with transaction.atomic():
+                    won = redeem(code)
+                latencies.append(time.perf_counter() - started)
+                return won
+            finally:
+                close_old_connections()
+
+        prefix = f"BENCH{get_random_string(6).upper()}"
+        winners = []
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for n in range(options["coupons"]):
+                    code = f"{prefix}{n}"
+                    Coupon.objects.create(code=code, expires_at=timezone.now() + timedelta(hours=1))
+                    winners.append(sum(pool.map(attempt, [code] * workers)))
+            elapsed = time.perf_counter() - started
+        finally:
+            Coupon.objects.filter(code__startswith=prefix).delete()
+
+        latencies.sort()
+        wrong = [count for count in winners if count != 1]
+        self.stdout.write(
+            f"{connection.vendor}, mode={options['mode']}: {options['coupons']} coupons x "
+            f"{workers} workers, {elapsed:.2f}s"
+        )
+        self.stdout.write(
+            f"attempt latency: p50={statistics.median(latencies) * 1000:.1f}ms "
+            f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms "
+            f"max={latencies[-1] * 1000:.1f}ms"
+        )
+        style = self.style.ERROR if wrong else self.style.SUCCESS
+        self.stdout.write(style(
+            f"coupons with exactly one winner: {len(winners) - len(wrong)}/{len(winners)}, "
+            f"max winners={max(winners)}"
+        ))
+
+    # ────────── стратегии ──────────
+    @staticmethod
+    def redeem_conditional(code):
+        coupon = Coupon.objects.only("pk").get(code=code)
+        return int(coupon.redeem())
+
+    @staticmethod
+    def redeem_naive(code):
+        coupon = Coupon.objects.get(code=code)
+        if not coupon.is_valid:
+            return 0
+        time.sleep(0.001)  # окно между проверкой и записью, как в старом checkout
+        coupon.is_active = False
+        coupon.save(update_fields=["is_active"])
+        return 1
@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+
+from store.models import InsufficientStock, Product, StockShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs parallel one-item checkouts against a single SKU and reports "
+        "throughput and oversell. Use a real Postgres database: SQLite "
+        "serializes all writers and says nothing about row contention."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checkouts", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=32)
+        parser.add_argument("--stock", type=int, default=100)
+        parser.add_argument(
+            "--mode", choices=["conditional", "select_for_update", "naive"], default="conditional",
+            help="conditional: Product.reserve_stock; select_for_update: row lock, "
+                 "check, save; naive: read then write (shows the oversell).",
+        )
+        parser.add_argument(
+            "--shards", type=int, default=0,
+            help="conditional mode only: split the stock into N StockShard counters.",
+        )
+
+    def handle(self, *args, **options):
+        if options["shards"] and options["mode"] != "conditional":
+            raise CommandError("--shards works with --mode=conditional only")
+        product = Product.objects.create(name="stock benchmark", price=1, quantity=options["stock"])
+        if options["shards"]:
+            product.shard_stock(options["shards"])
+        reserve = getattr(self, f"reserve_{options['mode']}")
+
+        def checkout(_):
+            try:
+                with transaction.atomic():
+                    return reserve(product.pk, product.hot_shards)
+            finally:
+                close_old_connections()
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                sold = sum(pool.map(checkout, range(options["checkouts"])))
+            elapsed = time.perf_counter() - started
+            StockShard.reconcile([product.pk])
+            remaining = Product.objects.get(pk=product.pk).quantity
+        finally:
+            Product.objects.filter(pk=product.pk).delete()
+
+        oversell = max(sold - options["stock"], 0)
+        lost_updates = sold - (options["stock"] - remaining)  # продано, но не списано
+        self.stdout.write(
+            f"{connection.vendor}, mode={options['mode']}, shards={options['shards']}: "
+            f"{options['checkouts']} checkouts, "
+            f"{options['workers']} workers, {elapsed:.2f}s "
+            f"({options['checkouts'] / elapsed:.0f} checkouts/s)"
+        )
+        self.stdout.write(f"sold={sold} stock={options['stock']} remaining={remaining}")
+        style = self.style.ERROR if oversell or lost_updates else self.style.SUCCESS
+        self.stdout.write(style(f"oversell={oversell} lost_updates={lost_updates}"))
+
+    # ────────── стратегии ──────────
+    @staticmethod
+    def reserve_conditional(product_id, shards):
+        try:
+            Product.reserve_stock({product_id: 1}, {product_id: shards})
+        except InsufficientStock:
+            return 0
+        return 1
+
+    @staticmethod
+    def reserve_select_for_update(product_id, shards):
+        product = Product.objects.select_for_update().get(pk=product_id)
+        if product.quantity < 1:
+            return 0
+        product.quantity -= 1
+        product.save(update_fields=["quantity"])
+        return 1
+
+    @staticmethod
+    def reserve_naive(product_id, shards):
+        quantity = Product.objects.filter(pk=product_id).values_list("quantity", flat=True).get()
+        if quantity < 1:
+            return 0
+        # абсолютное значение, прочитанное до записи, — гонка «lost update»
+        Product.objects.filter(pk=product_id).update(quantity=quantity - 1)
+        return 1
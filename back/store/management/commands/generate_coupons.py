@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.campaigns import generate_codes, issue_codes, pool_size
+from store.models import CouponCampaign
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-generates unissued coupon codes for a campaign (created if missing). "
+        "With --issue N, also issues N codes and prints them, one per line."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("campaign", help="Campaign name (slug), e.g. welcome.")
+        parser.add_argument("--count", type=int, default=0, help="How many codes to add to the pool.")
+        parser.add_argument("--amount", type=float, default=5000, help="Discount for a new campaign.")
+        parser.add_argument("--valid-days", type=int, default=30, help="Validity after issue, new campaign.")
+        parser.add_argument("--prefix", default="", help="Code prefix for a new campaign.")
+        parser.add_argument("--batch", type=int, help="Codes per INSERT (default: COUPON_BATCH_SIZE).")
+        parser.add_argument("--issue", type=int, default=0, help="Issue this many codes and print them.")
+
+    def handle(self, *args, **options):
+        campaign, created = CouponCampaign.objects.get_or_create(
+            name=options["campaign"],
+            defaults={"amount": options["amount"], "valid_days": options["valid_days"],
+                      "prefix": options["prefix"]},
+        )
+        if options["count"]:
+            started = time.perf_counter()
+            inserted = generate_codes(campaign, options["count"], options["batch"])
+            elapsed = time.perf_counter() - started
+            self.stderr.write(self.style.SUCCESS(
+                f"{campaign}: +{inserted} codes in {elapsed:.1f}s ({inserted / elapsed:.0f}/s), "
+                f"{pool_size(campaign)} unissued"
+            ))
+        if options["issue"]:
+            for code in issue_codes(campaign, options["issue"]):
+                self.stdout.write(code)
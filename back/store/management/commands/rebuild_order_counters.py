@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from accounts.models import Profile
+from store.models import ArchivedOrder, Order
+
+
+class Command(BaseCommand):
+    help = "Recomputes Profile.order_count / lifetime_spend from the orders table and the order archive."
+
+    def handle(self, *args, **options):
+        # счётчики «за всё время» — архивные заказы (store/archive.py) тоже считаются
+        totals = {}
+        for model in (Order, ArchivedOrder):
+            for row in model.objects.values("user_id").annotate(count=Count("id"), spend=Sum("amount")):
+                count, spend = totals.get(row["user_id"], (0, 0))
+                totals[row["user_id"]] = (count + row["count"], spend + (row["spend"] or 0))
+        profiles = []
+        for profile in Profile.objects.only("pk", "user_id").iterator(chunk_size=2000):
+            profile.order_count, profile.lifetime_spend = totals.get(profile.user_id, (0, 0))
+            profiles.append(profile)
+        with transaction.atomic():
+            Profile.objects.bulk_update(profiles, ["order_count", "lifetime_spend"], batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt order counters for {len(profiles)} profiles"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from store.cache import CATALOG_TAG, PRODUCT_LIST_TAG, bump, product_tag
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Rebuilds Product.rating_* aggregates from the reviews table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "product_ids", nargs="*", type=int,
+            help="Only rebuild these products (default: all).",
+        )
+
+    def handle(self, *args, **options):
+        product_ids = options["product_ids"] or None
+        count = Product.rebuild_ratings(product_ids)
+        # bulk_update не шлёт сигналы — сбрасываем кэш каталога сами
+        if product_ids:
+            bump(PRODUCT_LIST_TAG, *(product_tag(pk) for pk in product_ids))
+        else:
+            bump(CATALOG_TAG)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ratings for {count} products"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from store.analytics import rebuild_rollups, update_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Brings the /analytics/ sales rollups up to date. With --rebuild, drops "
+        "them and replays every order still in the hot tables; orders already "
+        "moved to ArchivedOrder are not replayed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Recompute from scratch.")
+        parser.add_argument("--chunk", type=int, help="Orders per transaction (default: SALES_ROLLUP_CHUNK).")
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            count = rebuild_rollups(options["chunk"])
+        else:
+            count = update_rollups(options["chunk"])
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {count} orders"))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store.models import Product, StockShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Splits a flash-sale product's stock into N StockShard counters "
+        "(0 turns sharding off), optionally setting a new total first; "
+        "with --reconcile folds all shards back into Product.quantity."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("product_id", nargs="?", type=int)
+        parser.add_argument("--shards", type=int, help="Number of shards, 0 to disable.")
+        parser.add_argument("--quantity", type=int, help="New total stock (restock).")
+        parser.add_argument("--reconcile", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["reconcile"]:
+            changed = StockShard.reconcile([options["product_id"]] if options["product_id"] else None)
+            self.stdout.write(self.style.SUCCESS(f"Reconciled, {len(changed)} products changed"))
+            return
+        if options["product_id"] is None:
+            raise CommandError("product_id is required")
+        try:
+            product = Product.objects.get(pk=options["product_id"])
+        except Product.DoesNotExist:
+            raise CommandError(f"Product {options['product_id']} does not exist")
+
+        shards = product.hot_shards if options["shards"] is None else options["shards"]
+        with transaction.atomic():  # строка товара заблокирована до конца
+            if options["quantity"] is not None:
+                product.shard_stock(0)  # собрать шарды в одну строку и задать новый остаток
+                Product.objects.filter(pk=product.pk).update(quantity=options["quantity"])
+                product.quantity = options["quantity"]
+            product.shard_stock(shards)
+        self.stdout.write(self.style.SUCCESS(
+            f"{product}: quantity={product.quantity}, shards={product.hot_shards}"
+        ))
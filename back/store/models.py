@@ -1,11 +1,18 @@
 # onlinestore/store/models.py
+import random
+from functools import lru_cache
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
 from cloudinary.models import CloudinaryField
-from django.db.models import Avg
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Now, NullIf
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 class Category(models.TextChoices):
     ELECTRONICS = "electronics", "Electronics"
     GAMING    = "gaming", "Gaming"
@@ -15,6 +22,14 @@ class Category(models.TextChoices):
     DIY         = "diy", "DIY & Tools"
     OTHER       = "other", "Other"
 
+class InsufficientStock(Exception):
+    """Raised by Product.reserve_stock; `product_ids` are the lines that were short."""
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Not enough stock for product(s) {product_ids}")
+
+
 class Product(models.Model):
     name        = models.CharField(max_length=100)
     price       = models.DecimalField(max_digits=8, decimal_places=2)
@@ -25,21 +40,316 @@ class Product(models.Model):
         default=Category.ELECTRONICS,
     )
     description = models.TextField(blank=True, null=True)
+    # >0 — «горячий» товар: остаток разложен по StockShard, а quantity —
+    # их сумма на момент последней сверки (меняйте сток через manage.py shard_stock)
+    hot_shards  = models.PositiveSmallIntegerField(default=0)
+
+    # ────────── денормализованные агрегаты отзывов ──────────
+    # обновляются в той же транзакции, что и Review (см. store/signals.py),
+    # пересобираются командой `manage.py rebuild_product_ratings`
+    rating_avg   = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum   = models.PositiveIntegerField(default=0)
+    stars_1      = models.PositiveIntegerField(default=0)
+    stars_2      = models.PositiveIntegerField(default=0)
+    stars_3      = models.PositiveIntegerField(default=0)
+    stars_4      = models.PositiveIntegerField(default=0)
+    stars_5      = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # ключи keyset-пагинации (store/pagination.py); ?category= идёт по второму
+        indexes = [
+            models.Index(fields=["price", "id"], name="product_price_id_idx"),
+            models.Index(fields=["category", "id"], name="product_category_id_idx"),
+        ]
 
-    # динамическое поле-свойство
     @property
     def rating(self):
-        return self.reviews.aggregate(avg=Avg("rate"))["avg"] or 0
+        return self.rating_avg
+
+    @property
+    def rating_histogram(self):
+        return {str(i): getattr(self, f"stars_{i}") for i in range(1, 6)}
+
+    @classmethod
+    def apply_rating_delta(cls, product_id, added=None, removed=None):
+        """
+        Incrementally adjusts the stored rating aggregates with one UPDATE.
+        `added` / `removed` are star values (1-5) of the review going in / out.
+        """
+        count_delta = (added is not None) - (removed is not None)
+        sum_delta = (added or 0) - (removed or 0)
+        count = F("rating_count") + count_delta
+        total = F("rating_sum") + sum_delta
+        fields = {
+            "rating_count": count,
+            "rating_sum": total,
+            # SET a = ..., b = f(a) читает старые значения строки, поэтому
+            # среднее считается из тех же выражений, а не из новых колонок
+            "rating_avg": Coalesce(
+                Cast(total, FloatField()) / NullIf(count, Value(0)),
+                Value(0.0),
+                output_field=FloatField(),
+            ),
+        }
+        if added is not None:
+            fields[f"stars_{added}"] = F(f"stars_{added}") + 1
+        if removed is not None:
+            key = f"stars_{removed}"
+            fields[key] = fields[key] - 1 if key in fields else F(key) - 1
+        cls.objects.filter(pk=product_id).update(**fields)
+
+    @classmethod
+    def rebuild_ratings(cls, product_ids=None):
+        """
+        Recomputes the rating aggregates from the reviews table.
+        Returns the number of products updated.
+        """
+        stats = Review.objects.values("product_id").annotate(
+            count=Count("id"),
+            total=Sum("rate"),
+            **{f"s{i}": Count("id", filter=Q(rate=i)) for i in range(1, 6)},
+        )
+        products = cls.objects.all()
+        if product_ids is not None:
+            stats = stats.filter(product_id__in=product_ids)
+            products = products.filter(pk__in=product_ids)
+        by_product = {row["product_id"]: row for row in stats}
+
+        updated = []
+        for product in products.only("pk").iterator(chunk_size=2000):
+            row = by_product.get(product.pk, {})
+            product.rating_count = row.get("count", 0)
+            product.rating_sum = row.get("total") or 0
+            product.rating_avg = (
+                product.rating_sum / product.rating_count if product.rating_count else 0
+            )
+            for i in range(1, 6):
+                setattr(product, f"stars_{i}", row.get(f"s{i}", 0))
+            updated.append(product)
+
+        with transaction.atomic():
+            cls.objects.bulk_update(
+                updated,
+                ["rating_avg", "rating_count", "rating_sum",
+                 "stars_1", "stars_2", "stars_3", "stars_4", "stars_5"],
+                batch_size=500,
+            )
+        return len(updated)
+
+    @classmethod
+    def reserve_stock(cls, quantities, shards=None):
+        """
+        Decrements stock for {product_id: quantity} all-or-nothing, with one
+        conditional UPDATE:
+
+            UPDATE ... SET quantity = quantity - CASE id WHEN .. THEN n END
+            WHERE id IN (...) AND quantity >= CASE id WHEN .. THEN n END
+
+        No SELECT ... FOR UPDATE: each row is locked only for the duration of
+        the UPDATE, and a concurrent checkout re-checks `quantity >= n` against
+        the committed value, so stock never goes negative. If any line is
+        short the savepoint is rolled back and InsufficientStock is raised.
+
+        `shards` maps hot products to their `hot_shards`; those lines are
+        taken from StockShard rows instead of the product row.
+        """
+        quantities = {pk: qty for pk, qty in quantities.items() if qty}
+        shards = shards or {}
+        regular = {pk: qty for pk, qty in quantities.items() if not shards.get(pk)}
+        try:
+            with transaction.atomic():
+                if regular:
+                    wanted = Case(
+                        *(When(pk=pk, then=Value(qty)) for pk, qty in regular.items()),
+                        output_field=models.IntegerField(),
+                    )
+                    updated = cls.objects.filter(pk__in=regular, quantity__gte=wanted).update(
+                        quantity=F("quantity") - wanted
+                    )
+                    if updated != len(regular):
+                        raise InsufficientStock(None)
+                for pk, qty in quantities.items():
+                    if shards.get(pk) and not StockShard.take(pk, shards[pk], qty):
+                        raise InsufficientStock([pk])
+        except InsufficientStock as exc:
+            if exc.product_ids is not None:
+                raise
+            # откат уже сделан — отдельным запросом выясняем, каких строк не хватило
+            available = dict(cls.objects.filter(pk__in=regular).values_list("pk", "quantity"))
+            raise InsufficientStock(sorted(
+                pk for pk, qty in regular.items() if available.get(pk, 0) < qty
+            ))
+
+        # UPDATE не шлёт сигналы: после коммита сбрасываем кэш товаров и их списков
+        # (полный ProductSerializer в /products/ показывает quantity);
+        # quantity «горячих» товаров меняет только сверка шардов
+        if regular:
+            pks = list(regular)
+            transaction.on_commit(lambda: invalidate_stock(pks))
+
+    def shard_stock(self, shards):
+        """
+        Switches the product to `shards` stock counters (0 — back to the plain
+        Product.quantity), carrying the current total over.
+        """
+        with transaction.atomic():
+            product = Product.objects.select_for_update().get(pk=self.pk)
+            total = product.quantity
+            if product.hot_shards:
+                locked = StockShard.objects.select_for_update().filter(product=product)
+                total = locked.aggregate(total=Coalesce(Sum("quantity"), 0))["total"]
+                locked.delete()
+            if shards:
+                StockShard.objects.bulk_create(
+                    StockShard(product=product, index=index, quantity=quantity)
+                    for index, quantity in enumerate(StockShard.split(total, shards))
+                )
+            self.quantity, self.hot_shards = total, shards
+            self.save(update_fields=["quantity", "hot_shards"])
 
     def __str__(self):
         return self.name
 
+# ────────── шарды остатка для flash-sale товаров ──────────
+class StockShard(models.Model):
+    """
+    One of Product.hot_shards sub-counters. A checkout locks a single random
+    shard row instead of the product row, so concurrent checkouts of the same
+    SKU mostly touch different rows; `reconcile` folds them back into
+    Product.quantity and evens them out.
+    """
+    product  = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="stock_shards")
+    index    = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "index"], name="stock_shard_product_index_uniq"),
+        ]
+
+    @staticmethod
+    def split(total, shards):
+        base, extra = divmod(total, shards)
+        return [base + (index < extra) for index in range(shards)]
+
+    @classmethod
+    def take(cls, product_id, shards, quantity):
+        """
+        Takes `quantity` from the product's shards: whole from one random
+        shard, falling back to the next ones; if none holds enough on its own,
+        drains them one by one. Returns False if the shards are short — the
+        caller's transaction then rolls the partial takes back.
+        """
+        start = random.randrange(shards)
+        order = [(start + step) % shards for step in range(shards)]
+        rows = cls.objects.filter(product_id=product_id)
+        for index in order:
+            if rows.filter(index=index, quantity__gte=quantity).update(quantity=F("quantity") - quantity):
+                return True
+
+        remaining = quantity
+        for index in order:
+            available = rows.filter(index=index).values_list("quantity", flat=True).first() or 0
+            part = min(available, remaining)
+            if part and rows.filter(index=index, quantity__gte=part).update(quantity=F("quantity") - part):
+                remaining -= part
+                if not remaining:
+                    return True
+        return False
+
+    @classmethod
+    def reconcile(cls, product_ids=None):
+        """
+        Writes the shard totals back into Product.quantity and rebalances the
+        shards evenly. Returns the ids of the products whose quantity changed.
+        """
+        products = Product.objects.filter(hot_shards__gt=0)
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        changed = []
+        for product in products.only("pk", "quantity", "hot_shards"):
+            with transaction.atomic():
+                shards = list(cls.objects.select_for_update().filter(product=product).order_by("index"))
+                total = sum(shard.quantity for shard in shards)
+                for shard, quantity in zip(shards, cls.split(total, len(shards) or 1)):
+                    shard.quantity = quantity
+                cls.objects.bulk_update(shards, ["quantity"])
+                if Product.objects.filter(pk=product.pk).exclude(quantity=total).update(quantity=total):
+                    changed.append(product.pk)
+        if changed:
+            invalidate_stock(changed)
+        return changed
+
+
+def invalidate_stock(product_ids):
+    """
+    Stock changed by a bulk UPDATE: drops the cached products and the list
+    variants that render quantity. Card lists and the list snapshot don't
+    show stock, so they survive checkouts.
+    """
+    from .cache import PRODUCT_STOCK_TAG, bump, product_tag
+
+    bump(PRODUCT_STOCK_TAG, *(product_tag(pk) for pk in product_ids))
+
+
+# ────────── URL изображений ──────────
+# канонический https-URL и размеры считаются один раз при сохранении ProductImage;
+# для старых строк без url — мемоизация на процесс по значению из БД
+IMAGE_VARIANTS = getattr(settings, "PRODUCT_IMAGE_VARIANTS",
+                         {"thumb": 200, "card": 480, "full": 1200})
+
+
+@lru_cache(maxsize=4096)
+def _image_urls(stored_value):
+    from cloudinary.utils import cloudinary_url
+
+    resource = ProductImage._meta.get_field("image").to_python(stored_value)
+    if not resource.public_id:  # не Cloudinary-ресурс, а готовый URL/путь
+        url, _ = cloudinary_url(stored_value, secure=True)
+        return url, {}
+    url = resource.build_url(secure=True)
+    variants = {
+        name: resource.build_url(secure=True, width=width, crop="limit",
+                                 fetch_format="auto", quality="auto")
+        for name, width in IMAGE_VARIANTS.items()
+    }
+    return url, variants
+
+
+def build_image_urls(image):
+    """(secure URL, {variant: URL}) for a CloudinaryField value; memoized."""
+    stored_value = ProductImage._meta.get_field("image").get_prep_value(image)
+    return _image_urls(stored_value)
+
+
 # ────────── до 3-х изображений ──────────
 class ProductImage(models.Model):
     product = models.ForeignKey(Product,
                                 related_name="images",
                                 on_delete=models.CASCADE)
     image   = CloudinaryField("image")
+    url      = models.URLField(max_length=500, blank=True, editable=False)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        # загрузка файла в Cloudinary происходит в pre_save поля, поэтому URL
+        # считаем после сохранения и дописываем одним UPDATE
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if not self.image or (update_fields is not None and "image" not in update_fields):
+            return
+        url, variants = build_image_urls(self.image)
+        if (url, variants) != (self.url, self.variants):
+            self.url, self.variants = url, variants
+            ProductImage.objects.filter(pk=self.pk).update(url=url, variants=variants)
+
+    @property
+    def image_urls(self):
+        """Stored URLs, or the memoized ones for rows saved before they existed."""
+        if self.url:
+            return self.url, self.variants
+        return build_image_urls(self.image)
 
     def clean(self):
         # max 3 картинки на товар
@@ -61,6 +371,21 @@ class Review(models.Model):
     class Meta:
         unique_together = ("product", "user")  # 1 отзыв на товар от пользователя
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # запоминаем исходные значения, чтобы сигнал мог посчитать дельту рейтинга
+        instance._loaded_rating = (instance.__dict__.get("product_id"),
+                                   instance.__dict__.get("rate"))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # post_save (store/signals.py) обновляет агрегаты Product —
+        # в одной транзакции с самим отзывом
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._loaded_rating = (self.product_id, self.rate)
+
     def __str__(self):
         return f"{self.rate}★ by {self.user} on {self.product}"
 
@@ -80,6 +405,10 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default='pending')
     order_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # история заказов: WHERE user_id = .. ORDER BY order_date DESC, id DESC (keyset)
+        indexes = [models.Index(fields=["user", "-order_date", "-id"], name="order_user_date_idx")]
+
     def __str__(self):
         return f"Order #{self.id} by {self.user.username}"
 
@@ -87,6 +416,15 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
+    # цена на момент покупки — выручка в отчётах не меняется вместе с Product.price
+    unit_price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+CHECKOUT_STATUS_CHOICES = (
+    ('pending', 'Pending'),
+    ('processing', 'Processing'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+)
+
 class Checkout(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
@@ -106,6 +444,15 @@ class Checkout(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     order = models.OneToOneField('Order', on_delete=models.SET_NULL, null=True, blank=True)
 
+    # асинхронный checkout (CHECKOUT_ASYNC): заказ создаёт воркер, клиент опрашивает статус
+    status = models.CharField(max_length=20, choices=CHECKOUT_STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True, default='')
+    coupon_code = models.CharField(max_length=20, blank=True, default='')
+    # когда воркер взял checkout в работу и какая это попытка — зависший
+    # processing перехватывает recover_stale_checkouts (store/tasks.py)
+    processing_started_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
     def __str__(self):
         return f"Checkout #{self.id} for {self.email}"
     
@@ -116,6 +463,78 @@ class CheckoutItem(models.Model):
 
     def __str__(self):
         return f"{self.quantity} of {self.product.name}"
+
+
+# ────────── холодное хранилище заказов ──────────
+class ArchivedOrder(models.Model):
+    """
+    An order moved out of the hot tables by store/archive.py, together with
+    its items and checkout, denormalized into JSON. Keeps the original order
+    id, so /orders/{id}/ links stay valid with ?include_archived=1.
+    """
+    id          = models.IntegerField(primary_key=True)
+    user        = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    amount      = models.DecimalField(max_digits=10, decimal_places=2)
+    status      = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES)
+    order_date  = models.DateTimeField()
+    item_count  = models.PositiveIntegerField(default=0)
+    items       = models.JSONField(default=list, encoder=DjangoJSONEncoder)  # [{"id", "product": {..}, "quantity"}]
+    checkout    = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)  # без данных карты
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "-order_date", "-id"], name="archived_user_date_idx")]
+
+    def __str__(self):
+        return f"Archived order #{self.id}"
+
+
+# ────────── агрегаты продаж для /analytics/ ──────────
+ROLLUP_GRANULARITY_CHOICES = (
+    ('hour', 'Hour'),
+    ('day', 'Day'),
+)
+
+
+class SalesRollup(models.Model):
+    """Revenue, units and order count per bucket; filled by store/analytics.py."""
+    granularity = models.CharField(max_length=4, choices=ROLLUP_GRANULARITY_CHOICES)
+    bucket      = models.DateTimeField()  # начало часа / дня (UTC)
+    category    = models.CharField(max_length=20, choices=Category.choices)
+    revenue     = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units       = models.PositiveIntegerField(default=0)
+    orders      = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class ProductSalesRollup(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_rollups')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["granularity", "bucket", "product"], name="product_rollup_uniq"),
+        ]
+        indexes = [models.Index(fields=["granularity", "product", "bucket"], name="product_rollup_idx")]
+
+
+class CategorySalesRollup(SalesRollup):
+    # orders — заказы с хотя бы одним товаром категории, не сумма по товарам
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["granularity", "bucket", "category"], name="category_rollup_uniq"),
+        ]
+
+
+class RollupCheckpoint(models.Model):
+    """High-water mark: every order with id <= last_order_id is already in the rollups."""
+    name          = models.CharField(max_length=50, unique=True)
+    last_order_id = models.PositiveBigIntegerField(default=0)
+    updated_at    = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_order_id}"
     
 class Chat(models.Model):
     user        = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chats")
@@ -133,6 +552,22 @@ class ChatMessage(models.Model):
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
+
+class CouponCampaign(models.Model):
+    """
+    A pool of pre-generated codes (store/campaigns.py). Codes are inserted
+    inactive and unissued; claiming one activates it for `valid_days`.
+    """
+    name        = models.SlugField(max_length=50, unique=True)
+    prefix      = models.CharField(max_length=8, blank=True, default='')
+    amount      = models.DecimalField(max_digits=10, decimal_places=2, default=5000)
+    valid_days  = models.PositiveIntegerField(default=30)
+    created_at  = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
 class Coupon(models.Model):
     """
     Welcome-coupon, один на каждого пользователя.
@@ -149,6 +584,19 @@ class Coupon(models.Model):
     amount      = models.DecimalField(max_digits=10, decimal_places=2, default=5000)
     expires_at  = models.DateTimeField()
     is_active   = models.BooleanField(default=True)
+    # код из пула кампании: issued_at IS NULL — ещё не выдан (и не активен)
+    campaign    = models.ForeignKey(CouponCampaign, on_delete=models.CASCADE, related_name="coupons",
+                                    null=True, blank=True)
+    issued_at   = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # выдача из пула: WHERE campaign_id = .. AND issued_at IS NULL LIMIT 1
+            models.Index(fields=["campaign"], condition=Q(issued_at__isnull=True), name="coupon_pool_idx"),
+            # чистка просроченных (store/coupons.expire_coupons): индекс содержит только
+            # активные купоны, погашенные и выключенные из него уходят
+            models.Index(fields=["expires_at"], condition=Q(is_active=True), name="coupon_active_expiry_idx"),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.expires_at:
@@ -157,7 +605,28 @@ class Coupon(models.Model):
 
     @property
     def is_valid(self):
+        # срок проверяется при чтении: is_active=False для просроченных ставит
+        # ночная чистка, до неё купон просто не проходит эту проверку
         return self.is_active and timezone.now() < self.expires_at
 
+    def redeem(self):
+        """
+        Deactivates the coupon if it is still redeemable, with one conditional
+        UPDATE ... WHERE is_active AND expires_at > now(). Returns False if
+        another checkout got there first or the coupon has expired.
+
+        No SELECT ... FOR UPDATE: a concurrent redemption re-checks the WHERE
+        against the committed row, so exactly one of them updates it. Call it
+        inside the checkout transaction — a rollback re-activates the coupon.
+        """
+        redeemed = Coupon.objects.filter(
+            pk=self.pk, is_active=True, expires_at__gt=Now()
+        ).update(is_active=False)
+        if redeemed:
+            self.is_active = False
+            from .coupons import forget_coupon
+            transaction.on_commit(lambda: forget_coupon(self.code))
+        return bool(redeemed)
+
     def __str__(self):
         return f"{self.code} → {self.user or 'unbound'}"
@@ -0,0 +1,241 @@
+# onlinestore/store/pagination.py
+import base64
+import json
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor (keyset) pagination over a tuple of sort keys.
+
+    The cursor stores the sort-key values of the boundary row, and the next page
+    is fetched with `WHERE (k1, k2, ...) > (v1, v2, ...)` expanded into ORs. So a
+    deep page costs the same index range scan as page one, unlike OFFSET.
+    Every ordering must end with a unique column to keep the order stable.
+    """
+    page_size = 24
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    invalid_cursor_message = "Invalid cursor"
+
+    # ?ordering=<name> → поля сортировки; последнее поле должно быть уникальным
+    orderings = {"id": ("id",), "-id": ("-id",)}
+    default_ordering = "id"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Pages over the union of several querysets with the same sort-key
+        columns (e.g. hot + archived orders): each one is fetched with the
+        same keyset filter and LIMIT, then merged in memory. Keys must be
+        unique across the querysets, and a merged ordering must sort all of
+        its fields in one direction.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering_name = self.get_ordering_name(request)
+        self.ordering = self.orderings[self.ordering_name]
+        self.model = querysets[0].model
+
+        position, reverse = self.decode_cursor(request)
+        self.cursor_given = position is not None
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._flip(field) for field in ordering)
+        rows = []
+        for queryset in querysets:
+            queryset = queryset.order_by(*ordering)
+            if position is not None:
+                queryset = queryset.filter(self.keyset_filter(ordering, position))
+            rows.extend(queryset[: self.page_size + 1])
+        if len(querysets) > 1:
+            # get_position читает поля текущего self.ordering — направление задаёт ordering
+            rows.sort(key=self.get_position, reverse=ordering[0].startswith("-"))
+            rows = rows[: self.page_size + 1]
+
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = rows
+        return rows
+
+    def paginate_rows(self, rows, keys, model, request, view=None):
+        """
+        Same contract as paginate_queryset, but over an in-memory list already
+        sorted by the default ordering; `keys[i]` is the sort-key tuple of
+        `rows[i]` (used by the product list snapshot, store/snapshot.py).
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering_name = self.default_ordering
+        self.ordering = self.orderings[self.ordering_name]
+        self.model = model
+
+        position, reverse = self.decode_cursor(request)
+        if position is None:
+            start, end = 0, self.page_size
+        elif reverse:
+            end = bisect_left(keys, tuple(position))
+            start = max(end - self.page_size, 0)
+        else:
+            start = bisect_right(keys, tuple(position))
+            end = start + self.page_size
+
+        self.page = rows[start:end]
+        if reverse:
+            self.has_next = True
+            self.has_previous = start > 0
+        else:
+            self.has_next = end < len(rows)
+            self.has_previous = position is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering_name(self, request):
+        name = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        return name if name in self.orderings else self.default_ordering
+
+    # ────────── keyset ──────────
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def keyset_filter(ordering, position):
+        """(a, b, c) > (x, y, z)  →  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)"""
+        clauses = []
+        for i, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            equal = {f.lstrip("-"): position[j] for j, f in enumerate(ordering[:i])}
+            clauses.append(Q(**equal, **{f"{name}__{lookup}": position[i]}))
+        return reduce(or_, clauses)
+
+    def get_position(self, row):
+        names = [field.lstrip("-") for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
+
+    # ────────── cursor encoding ──────────
+    def encode_cursor(self, row, reverse=False):
+        position = [str(value) for value in self.get_position(row)]
+        payload = {"o": self.ordering_name, "p": position}
+        if reverse:
+            payload["r"] = 1
+        raw = json.dumps(payload, separators=(",", ":")).encode()
+        cursor = base64.urlsafe_b64encode(raw).decode().rstrip("=")
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+            payload = json.loads(raw)
+            if payload["o"] != self.ordering_name or len(payload["p"]) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.model._meta.get_field(field.lstrip("-")).to_python(value)
+                for field, value in zip(self.ordering, payload["p"])
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(payload.get("r"))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {"name": self.cursor_query_param, "required": False, "in": "query",
+             "description": "Opaque pagination cursor", "schema": {"type": "string"}},
+            {"name": self.page_size_query_param, "required": False, "in": "query",
+             "description": f"Page size (max {self.max_page_size})", "schema": {"type": "integer"}},
+            {"name": self.ordering_query_param, "required": False, "in": "query",
+             "description": "One of: " + ", ".join(self.orderings), "schema": {"type": "string"}},
+        ]
+
+
+class ProductCursorPagination(KeysetPagination):
+    """GET /products/?ordering=price&page_size=24&cursor=..."""
+    page_size = getattr(settings, "PRODUCT_PAGE_SIZE", 24)
+    max_page_size = getattr(settings, "PRODUCT_MAX_PAGE_SIZE", 100)
+    orderings = {
+        "id": ("id",),
+        "-id": ("-id",),
+        "price": ("price", "id"),
+        "-price": ("-price", "-id"),
+    }
+    default_ordering = "id"
+
+
+class OrderCursorPagination(KeysetPagination):
+    """GET /orders/?page_size=20&cursor=... — newest first."""
+    page_size = getattr(settings, "ORDER_PAGE_SIZE", 20)
+    max_page_size = getattr(settings, "ORDER_MAX_PAGE_SIZE", 100)
+    orderings = {
+        "-order_date": ("-order_date", "-id"),
+        "order_date": ("order_date", "id"),
+    }
+    default_ordering = "-order_date"
@@ -0,0 +1,69 @@
+# onlinestore/store/renderers.py
+from decimal import Decimal
+
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:  # необязательная зависимость — без неё работает обычный JSONRenderer
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+_SCALARS = {str, int, bool, type(None)}
+
+
+def _needs_stdlib(value):
+    """
+    True if orjson would not produce json.dumps' bytes for `value`: non-str
+    dict keys, non-finite floats (DRF raises on them) and floats that repr()
+    writes with an exponent (1e+16, 1e-05 — orjson writes 1e16, 0.00001).
+    """
+    kind = type(value)
+    if kind is float:
+        # NaN и бесконечности тоже не проходят проверку диапазона
+        return bool(value) and not 1e-4 <= abs(value) < 1e16
+    if kind in _SCALARS:
+        return False
+    if isinstance(value, Decimal):
+        return True  # JSONEncoder DRF отдаёт float(value) — формат снова как у json.dumps
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if type(key) is not str:
+                return True
+            if type(item) not in _SCALARS and _needs_stdlib(item):
+                return True
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            if type(item) not in _SCALARS and _needs_stdlib(item):
+                return True
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Same media type and byte output as DRF's JSONRenderer, encoded with orjson
+    when it is installed. Pretty-printing (`; indent=N`), non-default JSON
+    settings and values orjson formats differently (see _needs_stdlib) fall
+    back to the stock implementation.
+    """
+    _default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+            or _needs_stdlib(data)
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # datetime/date/time — через JSONEncoder DRF (…Z, миллисекунды), а не формат orjson
+        try:
+            ret = orjson.dumps(data, default=self._default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:  # например, int больше 64 бит
+            return super().render(data, accepted_media_type, renderer_context)
+        # как и JSONRenderer: \u2028 / \u2029 всегда экранируются
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
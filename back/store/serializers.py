@@ -1,8 +1,20 @@
 # onlinestore/store/serializers.py
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
-from .models import Chat, ChatMessage, Coupon, Product, Order, OrderItem, Checkout, CheckoutItem
+from .coupons import lookup_coupon
+from .models import (
+    ArchivedOrder, CategorySalesRollup, Category, Chat, ChatMessage, Coupon, InsufficientStock, Product,
+    ProductSalesRollup, Order, OrderItem, Checkout, CheckoutItem, ROLLUP_GRANULARITY_CHOICES,
+)
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -41,13 +53,58 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = '__all__'
         ref_name = "ProductSerializerBasic"  # Add a unique ref_name
 
+def resolve_products(items):
+    """
+    Replaces `product_id` in validated item dicts with Product instances,
+    fetched with a single IN query; unknown ids are reported all at once.
+    """
+    ids = {item['product_id'] for item in items}
+    products = Product.objects.in_bulk(ids)
+    missing = sorted(ids - products.keys())
+    if missing:
+        raise serializers.ValidationError(f"Invalid product id(s) {missing} - object does not exist.")
+    for item in items:
+        item['product'] = products[item.pop('product_id')]
+    return items
+
+
+def reserve_stock(lines):
+    """Reserves stock for OrderItem / CheckoutItem lines (see Product.reserve_stock)."""
+    quantities = Counter()
+    shards = {}
+    for line in lines:
+        quantities[line.product.pk] += line.quantity
+        if line.product.hot_shards:
+            shards[line.product.pk] = line.product.hot_shards
+    try:
+        Product.reserve_stock(quantities, shards)
+    except InsufficientStock as exc:
+        raise serializers.ValidationError(str(exc))
+
+
+def seed_prefetch(instance, related_name, objs):
+    """
+    Puts freshly created related rows into the prefetch cache (the same way
+    prefetch_related_objects does), so serializing them needs no SELECT.
+    """
+    prefetched = getattr(instance, related_name).all()
+    prefetched._result_cache = list(objs)
+    prefetched._prefetch_done = True
+    instance._prefetched_objects_cache = {
+        **getattr(instance, '_prefetched_objects_cache', {}), related_name: prefetched,
+    }
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
-    product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='product', write_only=True)
+    # товары резолвятся одним IN-запросом (resolve_products), а не по строке
+    product_id = serializers.IntegerField(write_only=True)
 
     class Meta:
         model = OrderItem
-        fields = ['id', 'product', 'product_id', 'quantity']
+        fields = ['id', 'product', 'product_id', 'quantity', 'unit_price']
+        read_only_fields = ['unit_price']
+        extra_kwargs = {'quantity': {'min_value': 1}}
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
@@ -57,27 +114,104 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'items', 'amount', 'status', 'order_date']
         read_only_fields = ['user', 'amount', 'status', 'order_date']
 
+    def validate_items(self, items):
+        return resolve_products(items)
+
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         user = self.context['request'].user
 
-        order = Order.objects.create(user=user, amount=0)
-        total_amount = 0
-        for item_data in items_data:
-            product = item_data['product']
-            quantity = item_data['quantity']
-
-            OrderItem.objects.create(order=order, product=product, quantity=quantity)
-            total_amount += product.price * quantity
-        order.amount = total_amount
-        order.save()
+        items = [
+            OrderItem(product=data['product'], quantity=data['quantity'], unit_price=data['product'].price)
+            for data in items_data
+        ]
+        reserve_stock(items)
+        total_amount = sum((item.product.price * item.quantity for item in items), Decimal(0))
+        order = Order.objects.create(user=user, amount=total_amount)
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+        seed_prefetch(order, 'items', items)  # ответ сериализует order.items без SELECT
         return order
+
+
+def recent_orders_prefetch(lookup="orders"):
+    """
+    The user's PROFILE_RECENT_ORDERS newest orders with items and products,
+    in a fixed number of queries, stored as `recent_orders` on the user.
+    """
+    limit = getattr(settings, "PROFILE_RECENT_ORDERS", 5)
+    items = OrderItem.objects.select_related("product").order_by("id")
+    orders = Order.objects.order_by("-order_date", "-id").prefetch_related(Prefetch("items", queryset=items))
+    return Prefetch(lookup, queryset=orders[:limit], to_attr="recent_orders")
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    """Same shape as OrderSerializer; items are the snapshot taken at archive time."""
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'user', 'items', 'amount', 'status', 'order_date', 'archived_at']
+        read_only_fields = fields
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Order history row; line items are only loaded by GET /orders/{id}/."""
+    item_count = serializers.IntegerField(read_only=True)  # annotate(Count("items"))
+
+    class Meta:
+        model = Order
+        fields = ['id', 'order_date', 'status', 'amount', 'item_count']
+        read_only_fields = fields
+
+
+# ────────── /analytics/ ──────────
+# максимальный диапазон одного запроса — ответ не растёт с историей магазина
+ANALYTICS_MAX_RANGE = {"hour": 31, "day": 366}  # дней
+
+
+class SalesRollupQuerySerializer(serializers.Serializer):
+    """Query string of the /analytics/sales/ endpoints."""
+    granularity = serializers.ChoiceField(choices=ROLLUP_GRANULARITY_CHOICES, default="day")
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    category = serializers.ChoiceField(choices=Category.choices, required=False)
+    product = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        max_days = ANALYTICS_MAX_RANGE[data["granularity"]]
+        data.setdefault("until", timezone.now())
+        data.setdefault("since", data["until"] - timedelta(days=2 if data["granularity"] == "hour" else 30))
+        if data["since"] > data["until"]:
+            raise serializers.ValidationError("since must not be later than until")
+        if data["until"] - data["since"] > timedelta(days=max_days):
+            raise serializers.ValidationError(
+                f"At most {max_days} days per request with granularity={data['granularity']}"
+            )
+        return data
+
+
+class ProductSalesRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductSalesRollup
+        fields = ['bucket', 'product', 'category', 'revenue', 'units', 'orders']
+        read_only_fields = fields
+
+
+class CategorySalesRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CategorySalesRollup
+        fields = ['bucket', 'category', 'revenue', 'units', 'orders']
+        read_only_fields = fields
 class CheckoutItemSerializer(serializers.ModelSerializer):
-    product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='product')
+    # как и в заказе — один IN-запрос на все строки (resolve_products)
+    product_id = serializers.IntegerField()
 
     class Meta:
         model = CheckoutItem
         fields = ['product_id', 'quantity']
+        extra_kwargs = {'quantity': {'min_value': 1}}
 
 class CheckoutSerializer(serializers.ModelSerializer):
     items = CheckoutItemSerializer(many=True)
@@ -105,21 +239,26 @@ class CheckoutSerializer(serializers.ModelSerializer):
             'items',
             'created_at',
             'coupon_code',
+            'status',
 
         ]
-        read_only_fields = ("id", "created_at")
+        read_only_fields = ("id", "created_at", "status")
 
     def validate_coupon_code(self, value):
         if not value:
             return None
-        try:
-            coupon = Coupon.objects.get(code=value)
-        except Coupon.DoesNotExist:
+        coupon = lookup_coupon(value)  # промах обычно без запроса к БД
+        if coupon is None:
             raise serializers.ValidationError("Coupon not found")
         if not coupon.is_valid:
             raise serializers.ValidationError("Coupon expired or inactive")
         return coupon
 
+    def validate_items(self, items):
+        return resolve_products(items)
+
+    # весь checkout — одна транзакция: ошибка купона не оставляет строк-сирот
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop("items")
         coupon_obj = validated_data.pop("coupon_code", None)  # уже купон или None
@@ -127,23 +266,34 @@ class CheckoutSerializer(serializers.ModelSerializer):
         if request and request.user.is_authenticated:
             validated_data["user"] = request.user
 
+        defer_order = self.context.get("defer_order", False)
+        if defer_order and coupon_obj:
+            validated_data["coupon_code"] = coupon_obj.code  # купон погасит воркер
+
         checkout = Checkout.objects.create(**validated_data)
 
-        # bulk create items
-        objs = [
-            CheckoutItem(checkout=checkout, **item) for item in items_data
+        # bulk create items — товары уже загружены в validate_items
+        lines = [
+            CheckoutItem(checkout=checkout, product=item["product"], quantity=item["quantity"])
+            for item in items_data
         ]
-        CheckoutItem.objects.bulk_create(objs)
+        CheckoutItem.objects.bulk_create(lines)
+        seed_prefetch(checkout, "items", lines)
+
+        if defer_order:
+            # CHECKOUT_ASYNC: цены, купон и Order — в Celery, после коммита
+            from .tasks import process_checkout_task
+            transaction.on_commit(lambda: process_checkout_task.delay(checkout.pk))
+            return checkout
 
         # применяем купон и создаём Order
-        self._create_confirmed_order(checkout, coupon_obj)
+        self._create_confirmed_order(checkout, lines, coupon_obj)
         return checkout
 
     # вынесли сюда логику из View
-    def _create_confirmed_order(self, checkout, coupon: Coupon | None):
-        total = 0
-        for cit in checkout.items.select_related("product"):
-            total += cit.product.price * cit.quantity
+    def _create_confirmed_order(self, checkout, lines, coupon: Coupon | None):
+        """`lines` — CheckoutItem с загруженными product; цены считаются в памяти."""
+        total = sum((line.product.price * line.quantity for line in lines), Decimal(0))
 
         discount = 0
         if coupon:
@@ -151,10 +301,12 @@ class CheckoutSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError(
                     "Order total must exceed coupon amount"
                 )
+            # validate_coupon_code мог видеть купон активным — решает условный UPDATE
+            if not coupon.redeem():
+                raise serializers.ValidationError("Coupon expired or inactive")
             discount = coupon.amount
-            coupon.is_active = False
-            coupon.save(update_fields=["is_active"])
 
+        reserve_stock(lines)
         order = Order.objects.create(
             user=checkout.user,
             amount=total - discount,
@@ -164,47 +316,66 @@ class CheckoutSerializer(serializers.ModelSerializer):
             [
                 OrderItem(
                     order=order,
-                    product=ci.product,
-                    quantity=ci.quantity,
+                    product=line.product,
+                    quantity=line.quantity,
+                    unit_price=line.product.price,
                 )
-                for ci in checkout.items.all()
+                for line in lines
             ]
         )
 
         checkout.order = order
-        checkout.save()
+        checkout.status = "completed"
+        checkout.save(update_fields=["order", "status"])
         return order
 
+
+class CheckoutStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Checkout
+        fields = ['id', 'status', 'error', 'order']
+        read_only_fields = fields
+
 from accounts.models import Profile
 
 class ProfileSerializer(serializers.ModelSerializer):
+    """
+    Profile + order counters + the newest orders only; the full history is
+    GET /orders/. Load the instance with `ProfileSerializer.get_profile(user)`.
+    """
     email = serializers.EmailField(source='user.email', read_only=True)
     username = serializers.CharField(source='user.username', read_only=True)
-    orders = OrderSerializer(source='user.orders', many=True, read_only=True)
+    recent_orders = OrderSerializer(source='user.recent_orders', many=True, read_only=True)
     photo = serializers.ImageField(allow_null=True, required=False)
 
     class Meta:
         model = Profile
-        fields = ['email', 'username', 'photo', 'orders']
+        fields = ['email', 'username', 'photo', 'order_count', 'lifetime_spend', 'recent_orders']
+        read_only_fields = ['order_count', 'lifetime_spend']
+
+    @staticmethod
+    def get_profile(user):
+        return (Profile.objects.select_related('user')
+                .prefetch_related(recent_orders_prefetch('user__orders'))
+                .get(user=user))
 
 from .models import Product, ProductImage, Review
 
+
 class ProductImageSerializer(serializers.ModelSerializer):
-    image = serializers.SerializerMethodField()
+    # URL посчитаны при сохранении (ProductImage.save) — здесь только чтение
+    image    = serializers.SerializerMethodField()
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model  = ProductImage
-        fields = ["id", "image"]
+        fields = ["id", "image", "variants"]
 
     def get_image(self, obj):
-        # obj.image.url уже будет абсолютным, если SECURE=True; иначе — добавляем сами
-        url = obj.image.url
-        if url.startswith("http"):
-            return url
-        # сформировать абсолютный URL через Cloudinary utils
-        from cloudinary.utils import cloudinary_url
-        full, _ = cloudinary_url(url, secure=True)
-        return full
+        return obj.image_urls[0]
+
+    def get_variants(self, obj):
+        return obj.image_urls[1]
 
 
 
@@ -240,16 +411,79 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
 
         # Update the Profile model
         return super().update(instance, validated_data)
-class ProductSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    ?fields=id,name   — only these fields
+    ?expand=images    — Meta.default_fields plus these
+    Without either, Meta.default_fields (or every declared field) is returned.
+
+    `only_columns()` / `needs_images()` tell the view which columns to load,
+    so the queryset can be narrowed with .only() to what is rendered.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        params = request.query_params if request is not None else {}
+        default = getattr(self.Meta, "default_fields", None)
+
+        requested = self._split(params.get("fields"))
+        if requested:
+            keep = requested
+        elif default is not None:
+            keep = set(default) | self._split(params.get("expand"))
+        else:
+            return
+        for name in set(self.fields) - keep:
+            self.fields.pop(name)
+
+    @staticmethod
+    def _split(value):
+        return {name.strip() for name in (value or "").split(",") if name.strip()}
+
+    def only_columns(self):
+        mapping = getattr(self.Meta, "field_columns", {})
+        columns = {"id"}
+        for name in self.fields:
+            columns.update(mapping.get(name, (name,)))
+        return sorted(columns)
+
+    def needs_images(self):
+        return bool({"image", "images"} & set(self.fields))
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images  = ProductImageSerializer(many=True, read_only=True)
     rating  = serializers.FloatField(read_only=True)
+    rating_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model  = Product
         fields = ["id", "name", "price", "quantity",
-                  "category", "description", "images", "rating"]
+                  "category", "description", "images", "rating", "rating_count"]
+        field_columns = {"images": (), "rating": ("rating_avg",)}
         ref_name = "ProductSerializerDetailed"  # Add a unique ref_name
 
+
+class ProductCardSerializer(ProductSerializer):
+    """
+    Lean tile / cart-row representation: id, name, price and the first image.
+    Any detailed field can be added back with ?expand=description,rating,...
+    """
+    image = serializers.SerializerMethodField()
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ["image"]
+        default_fields = ["id", "name", "price", "image"]
+        field_columns = {**ProductSerializer.Meta.field_columns, "image": ()}
+        ref_name = "ProductCard"
+
+    def get_image(self, obj):
+        images = obj.images.all()  # prefetch, без запроса
+        if not images:
+            return None
+        return images[0].image_urls[0]
+
 class ChatMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model  = ChatMessage
@@ -263,6 +497,9 @@ class ChatSerializer(serializers.ModelSerializer):
         fields = ("id", "created_at", "messages")
 
 class CouponSerializer(serializers.ModelSerializer):
+    # просроченный купон неактивен сразу, не дожидаясь ночной чистки
+    is_active = serializers.BooleanField(source="is_valid", read_only=True)
+
     class Meta:
         model  = Coupon
         fields = ["code", "amount", "expires_at", "is_active"]
@@ -272,10 +509,8 @@ class CouponValidateSerializer(serializers.Serializer):
     amount = serializers.DecimalField(max_digits=10, decimal_places=2)
 
     def validate(self, data):
-        from .models import Coupon
-        try:
-            coupon = Coupon.objects.get(code=data["code"])
-        except Coupon.DoesNotExist:
+        coupon = lookup_coupon(data["code"])
+        if coupon is None:
             raise serializers.ValidationError("Coupon not found")
         if not coupon.is_valid:
             raise serializers.ValidationError("Coupon expired or inactive")
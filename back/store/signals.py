@@ -1,9 +1,105 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.core.cache import cache
-from .models import Product
+from .cache import PRODUCT_LIST_TAG, bump, orders_tag, product_tag
+from accounts.models import Profile
+from .coupons import forget_coupon, remember_code
+from .models import Coupon, Order, OrderItem, Product, ProductImage, Review
+from .snapshot import request_refresh, snapshot_enabled
+
+# ────────── инвалидация кэша каталога ──────────
+# cache_page хранил ответы под хэшами URL — delete("products_list") их не трогал.
+# Теперь увеличиваем поколение тегов: все закэшированные варианты промахиваются.
+# on_commit — чтобы параллельный запрос не закэшировал данные до коммита.
+def _bump_product(product_id):
+    transaction.on_commit(lambda: _invalidate_product(product_id))
+
+
+def _invalidate_product(product_id):
+    bump(PRODUCT_LIST_TAG, product_tag(product_id))
+    if snapshot_enabled():
+        request_refresh()  # снимок списка пересоберёт Celery, до тех пор отдаём старый
+
 
 @receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
 def clear_product_list_cache(sender, instance, **kwargs):
-    cache_key = "products_list"
-    cache.delete(cache_key)
\ No newline at end of file
+    _bump_product(instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def clear_product_cache_on_related_change(sender, instance, **kwargs):
+    _bump_product(instance.product_id)
+
+
+# ────────── агрегаты рейтинга ──────────
+# Review.save() оборачивает сохранение в transaction.atomic, а post_delete
+# вызывается внутри транзакции Collector.delete — дельта пишется атомарно с отзывом.
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance, created, raw=False, **kwargs):
+    if raw:  # loaddata — агрегаты пересобираются командой
+        return
+    if created:
+        Product.apply_rating_delta(instance.product_id, added=instance.rate)
+        return
+
+    old_product_id, old_rate = getattr(instance, "_loaded_rating", (None, None))
+    if old_product_id is None or old_rate is None:
+        # исходное значение неизвестно — пересчитываем товар целиком
+        Product.rebuild_ratings([instance.product_id])
+        return
+    if old_product_id != instance.product_id:
+        Product.apply_rating_delta(old_product_id, removed=old_rate)
+        Product.apply_rating_delta(instance.product_id, added=instance.rate)
+    elif old_rate != instance.rate:
+        Product.apply_rating_delta(instance.product_id, added=instance.rate, removed=old_rate)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance, **kwargs):
+    old_product_id, old_rate = getattr(
+        instance, "_loaded_rating", (instance.product_id, instance.rate)
+    )
+    Product.apply_rating_delta(old_product_id, removed=old_rate)
+
+
+# ────────── версии истории заказов (ETag для /orders/) ──────────
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def bump_user_orders(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump(orders_tag(user_id)))
+
+
+# ────────── счётчики заказов в профиле ──────────
+# та же транзакция, что и INSERT заказа; сумма заказа к этому моменту уже итоговая
+@receiver(post_save, sender=Order)
+def count_user_order(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Profile.record_order(instance.user_id, instance.amount)
+
+
+# позиции пишутся вместе с заказом (его post_save уже поднял версию), отдельно —
+# только из админки. post_delete не подключён: он отключил бы fast-delete позиций
+# при каскадном удалении заказа — удаления из админки см. OrderItemAdmin.
+@receiver(post_save, sender=OrderItem)
+def bump_user_orders_on_item_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if OrderItem.order.is_cached(instance):
+        user_id = instance.order.user_id
+    else:
+        user_id = Order.objects.filter(pk=instance.order_id).values_list("user_id", flat=True).first()
+    transaction.on_commit(lambda: bump(orders_tag(user_id)))
+
+
+# ────────── фильтр и кэш купонов (store/coupons.py) ──────────
+@receiver(post_save, sender=Coupon)
+def refresh_coupon_lookup(sender, instance, created, **kwargs):
+    code = instance.code
+    if created:
+        remember_code(code)  # до коммита: лишний бит в фильтре безвреден, пропущенный — нет
+    transaction.on_commit(lambda: forget_coupon(code))
@@ -0,0 +1,98 @@
+# onlinestore/store/snapshot.py
+"""
+Stale-while-revalidate snapshot of the serialized product list.
+
+A Celery beat task (`refresh_product_list_snapshot`) rebuilds the snapshot
+ahead of time; request handlers only read the last good one. A rebuild
+triggered on demand (cold start, stale snapshot, catalog write) is
+single-flight: one cache.add lock, everyone else keeps serving the old copy.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .cache import tiered_cache
+
+SNAPSHOT_KEY = "products:snapshot"
+VERSION_KEY = "products:snapshot:version"
+LOCK_KEY = "products:snapshot:lock"
+REFRESH_QUEUED_KEY = "products:snapshot:queued"
+
+LOCK_TIMEOUT = 60            # сек — страховка, если воркер умер посреди сборки
+COLD_START_WAIT = 2.0        # сек — сколько ждать чужую сборку без снимка
+
+
+def snapshot_enabled():
+    return getattr(settings, "PRODUCT_LIST_SNAPSHOT", False)
+
+
+def build_snapshot():
+    from .models import Product, ProductImage
+    from .serializers import ProductCardSerializer
+
+    # те же карточки, что /products/ отдаёт без параметров
+    queryset = Product.objects.prefetch_related(
+        Prefetch("images", queryset=ProductImage.objects.order_by("id"))
+    ).order_by("id")
+    rows = [dict(row) for row in ProductCardSerializer(queryset, many=True).data]
+    snapshot = {
+        "built_at": time.time(),
+        "keys": [(row["id"],) for row in rows],
+        "rows": rows,
+    }
+    tiered_cache.set(SNAPSHOT_KEY, snapshot, timeout=None)
+    tiered_cache.set(VERSION_KEY, snapshot["built_at"], timeout=None)
+    return snapshot
+
+
+def snapshot_version():
+    """Cheap marker for ETags: changes whenever a new snapshot is published."""
+    if not snapshot_enabled():
+        return 0
+    return tiered_cache.get(VERSION_KEY, 0)
+
+
+def refresh_snapshot():
+    """Rebuilds the snapshot unless another worker is already doing it."""
+    if not cache.add(LOCK_KEY, 1, timeout=LOCK_TIMEOUT):
+        return None
+    try:
+        return build_snapshot()
+    finally:
+        cache.delete(LOCK_KEY)
+        cache.delete(REFRESH_QUEUED_KEY)
+
+
+def request_refresh():
+    """Queues one background rebuild; repeated calls coalesce until it runs."""
+    if not cache.add(REFRESH_QUEUED_KEY, 1, timeout=LOCK_TIMEOUT):
+        return
+    from .tasks import refresh_product_list_snapshot
+    refresh_product_list_snapshot.delay()
+
+
+def get_snapshot():
+    """
+    Returns the last good snapshot, or None if there is none yet and it could
+    not be built in time (callers then fall back to the database).
+    """
+    snapshot = tiered_cache.get(SNAPSHOT_KEY)
+    if snapshot is not None:
+        max_age = getattr(settings, "PRODUCT_SNAPSHOT_MAX_AGE", 300)
+        if time.time() - snapshot["built_at"] > max_age:
+            request_refresh()
+        return snapshot
+
+    # холодный старт: собираем сами или ждём того, кто уже собирает
+    snapshot = refresh_snapshot()
+    if snapshot is not None:
+        return snapshot
+    deadline = time.monotonic() + COLD_START_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is not None:
+            return snapshot
+    return None
@@ -1,4 +1,7 @@
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
 from .models import Checkout, Coupon, Order, OrderItem
 from django.utils import timezone
 # @shared_task
@@ -50,25 +53,155 @@ from django.utils import timezone
 
 from celery import shared_task
 from django.utils import timezone
-from django.utils.crypto import get_random_string
 from datetime import timedelta
 from django.contrib.auth import get_user_model
 from .models import Coupon
 
 @shared_task
 def create_welcome_coupon_for_user(user_id):
+    """Fallback for an empty welcome pool (store/campaigns.py): claims again, else mints one code."""
+    from django.db import IntegrityError
+    from .campaigns import claim_welcome_coupon, random_codes
+
     User = get_user_model()
     user = User.objects.get(pk=user_id)
     if hasattr(user, "welcome_coupon"):        # уже есть
         return
-    code = get_random_string(8).upper()
-    Coupon.objects.create(
-        user=user,
-        code=code,
-        expires_at=timezone.now() + timedelta(days=30),
-    )
+    if claim_welcome_coupon(user) is not None:
+        return
+    for code in random_codes(5):  # unique=True: при коллизии берём следующий код
+        try:
+            with transaction.atomic():
+                Coupon.objects.create(
+                    user=user,
+                    code=code,
+                    expires_at=timezone.now() + timedelta(days=30),
+                )
+            return
+        except IntegrityError:
+            if Coupon.objects.filter(user=user).exists():
+                return
+
+
+@shared_task
+def top_up_welcome_coupon_pool():
+    """Keeps the welcome campaign's pool of pre-generated codes filled (store/campaigns.py)."""
+    from .campaigns import top_up_welcome_pool
+    return top_up_welcome_pool()
 
 @shared_task
 def deactivate_expired_coupons():
-    from django.utils import timezone
-    Coupon.objects.filter(is_active=True, expires_at__lt=timezone.now()).update(is_active=False)
+    """Cleanup only — Coupon.is_valid already rejects expired coupons (store/coupons.py)."""
+    from .coupons import expire_coupons
+    return expire_coupons()
+
+
+@shared_task
+def refresh_product_list_snapshot():
+    """Rebuilds the serialized product list snapshot (store/snapshot.py)."""
+    from .snapshot import refresh_snapshot, snapshot_enabled
+    if snapshot_enabled():
+        refresh_snapshot()
+
+
+def _processing_timeout():
+    return timedelta(seconds=getattr(settings, "CHECKOUT_PROCESSING_TIMEOUT", 60 * 5))
+
+
+def _max_attempts():
+    return getattr(settings, "CHECKOUT_MAX_ATTEMPTS", 3)
+
+
+def _claim_checkout(checkout_id):
+    """
+    pending → processing, or a `processing` checkout whose worker died (older
+    than CHECKOUT_PROCESSING_TIMEOUT) is taken over. Returns the claim time,
+    which identifies this attempt, or None if there is nothing to do.
+    """
+    now = timezone.now()
+    abandoned = Q(status="processing", processing_started_at__lt=now - _processing_timeout(),
+                  attempts__lt=_max_attempts())
+    claimed = Checkout.objects.filter(Q(status="pending") | abandoned, pk=checkout_id).update(
+        status="processing", processing_started_at=now, attempts=F("attempts") + 1,
+    )
+    return now if claimed else None
+
+
+@shared_task
+def process_checkout_task(checkout_id):
+    """
+    Prices a pending checkout, redeems its coupon and creates the order
+    (POST /checkout/ with CHECKOUT_ASYNC on). Only a `pending` or abandoned
+    `processing` checkout is claimed, so a redelivered message does nothing.
+    """
+    from rest_framework.exceptions import ValidationError
+    from .serializers import CheckoutSerializer
+
+    claimed_at = _claim_checkout(checkout_id)
+    if claimed_at is None:
+        return
+    # эта попытка — пока её не перехватили после таймаута
+    attempt = Checkout.objects.filter(pk=checkout_id, status="processing", processing_started_at=claimed_at)
+    checkout = Checkout.objects.get(pk=checkout_id)
+    lines = list(checkout.items.select_related("product"))
+    try:
+        with transaction.atomic():
+            # строка заблокирована до коммита — медленную, но живую попытку никто не перехватит
+            if not attempt.select_for_update().exists():
+                return
+            coupon = None
+            if checkout.coupon_code:
+                coupon = Coupon.objects.filter(code=checkout.coupon_code).first()
+                if coupon is None:  # активность и срок проверит Coupon.redeem
+                    raise ValidationError("Coupon expired or inactive")
+            CheckoutSerializer()._create_confirmed_order(checkout, lines, coupon)
+    except ValidationError as exc:
+        error = "; ".join(str(detail) for detail in exc.detail)
+        attempt.update(status="failed", error=error)
+    except Exception:
+        attempt.update(status="failed", error="Internal error")
+        raise
+
+
+@shared_task
+def recover_stale_checkouts():
+    """
+    Checkouts stuck in `processing` past CHECKOUT_PROCESSING_TIMEOUT (the
+    worker died) are queued again; after CHECKOUT_MAX_ATTEMPTS they fail.
+    """
+    stale = Checkout.objects.filter(
+        status="processing", processing_started_at__lt=timezone.now() - _processing_timeout()
+    )
+    stale.filter(attempts__gte=_max_attempts()).update(status="failed", error="Processing timed out")
+    retry = list(stale.values_list("pk", flat=True))
+    for checkout_id in retry:
+        process_checkout_task.delay(checkout_id)
+    return len(retry)
+
+
+@shared_task
+def reconcile_stock_shards():
+    """Folds StockShard counters of hot products back into Product.quantity."""
+    from .models import StockShard
+    return StockShard.reconcile()
+
+
+@shared_task
+def archive_old_orders():
+    """Moves orders older than ORDER_ARCHIVE_AFTER_DAYS to ArchivedOrder (store/archive.py)."""
+    from .archive import archive_orders
+    return archive_orders()
+
+
+@shared_task
+def update_sales_rollups():
+    """Adds orders above the RollupCheckpoint mark to the /analytics/ rollups (store/analytics.py)."""
+    from .analytics import update_rollups
+    return update_rollups()
+
+
+@shared_task
+def rebuild_coupon_filter():
+    """Rebuilds and publishes the Bloom filter of coupon codes (store/coupons.py)."""
+    from .coupons import build_filter
+    build_filter()
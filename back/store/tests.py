@@ -1,3 +1,1202 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import cloudinary
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import Profile
+
+from .cache import LocalLRUCache, orders_tag, tiered_cache
+from .models import (
+    ArchivedOrder, CategorySalesRollup, Checkout, CheckoutItem, Coupon, CouponCampaign, InsufficientStock, Order, OrderItem, Product, ProductImage,
+    ProductSalesRollup, Review, RollupCheckpoint, StockShard, _image_urls,
+)
+from .serializers import CheckoutSerializer, CouponSerializer, OrderSerializer, ProductImageSerializer
+from . import analytics, campaigns, coupons, fastpath, gemini, snapshot
+from .analytics import update_rollups
+from .archive import archive_orders
+from .pagination import ProductCursorPagination
+from .renderers import FastJSONRenderer
+from .tasks import process_checkout_task, recover_stale_checkouts
+from .views import (
+    CouponValidateAPIView,
+    CategorySalesAPIView,
+    CheckoutAPIView,
+    CheckoutStatusAPIView,
+    OrderCreateAPIView,
+    OrderDetailAPIView,
+    OrderListAPIView,
+    ProductDetailAPIView,
+    UserProfileAPIView,
+    ProductConsultAPIView,
+    ProductListAPIView,
+    ProductSalesAPIView,
+    ProductViewSet,
+    RegistrationAPIView,
+    ReviewViewSet,
+)
+
+User = get_user_model()
+
+TEST_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StoreTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        tiered_cache.local.clear()
+
+
+class ProductRatingAggregateTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name="Phone", price=1000)
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="pass12345")
+            for i in range(3)
+        ]
+
+    def review(self, user, rate):
+        return Review.objects.create(product=self.product, user=user, rate=rate)
+
+    def test_create_update_delete_keep_aggregates_in_sync(self):
+        self.review(self.users[0], 5)
+        second = self.review(self.users[1], 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 2)
+        self.assertEqual(self.product.rating, 3.5)
+        self.assertEqual(self.product.rating_histogram["5"], 1)
+
+        second = Review.objects.get(pk=second.pk)
+        second.rate = 4
+        second.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating, 4.5)
+        self.assertEqual((self.product.stars_2, self.product.stars_4), (0, 1))
+
+        second.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 1)
+        self.assertEqual(self.product.rating, 5.0)
+
+        Review.objects.all().delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating), (0, 0))
+
+    def test_rebuild_matches_incremental(self):
+        for user, rate in zip(self.users, (1, 3, 5)):
+            self.review(user, rate)
+        Product.objects.update(rating_avg=0, rating_count=0, rating_sum=0, stars_3=0)
+
+        self.assertEqual(Product.rebuild_ratings(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 3)
+        self.assertEqual(self.product.rating, 3.0)
+        self.assertEqual(self.product.stars_3, 1)
+
+
+class ProductKeysetPaginationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = ProductViewSet.as_view({"get": "list"})
+        for i, price in enumerate([30, 10, 20, 10, 40]):
+            Product.objects.create(name=f"P{i}", price=price)
+
+    def get(self, url):
+        response = self.view(self.factory.get(url))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            data = self.get(url)
+            ids += [row["id"] for row in data["results"]]
+            url, pages = data["next"], pages + 1
+        return ids, pages
+
+    def test_price_ordering_is_stable_across_pages(self):
+        expected = list(Product.objects.order_by("price", "id").values_list("id", flat=True))
+        ids, pages = self.walk("/products/?ordering=price&page_size=2")
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_previous_link_returns_same_page(self):
+        first = self.get("/products/?page_size=2")
+        second = self.get(first["next"])
+        back = self.get(second["previous"])
+        self.assertEqual(back["results"], first["results"])
+
+    def test_page_size_is_capped(self):
+        paginator = ProductCursorPagination()
+        request = Request(self.factory.get("/products/?page_size=100000"))
+        self.assertEqual(paginator.get_page_size(request), paginator.max_page_size)
+
+
+class CatalogCacheInvalidationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = ProductListAPIView.as_view()
+        self.product = Product.objects.create(name="Old name", price=100)
+
+    def names(self, url):
+        response = self.view(self.factory.get(url))
+        if hasattr(response, "render"):
+            response.render()
+        return [row["name"] for row in json.loads(response.content)["results"]]
+
+    def test_write_invalidates_every_cached_variant(self):
+        urls = ["/products/", "/products/?ordering=-price", "/products/?page_size=5"]
+        for url in urls:
+            self.assertEqual(self.names(url), ["Old name"])
+
+        # без коммита кэш остаётся прежним
+        Product.objects.filter(pk=self.product.pk).update(name="Sneaky")
+        self.assertEqual(self.names(urls[0]), ["Old name"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "New name"
+            self.product.save()
+        for url in urls:
+            self.assertEqual(self.names(url), ["New name"])
+
+    def test_second_read_is_served_from_local_tier(self):
+        self.names("/products/")
+        before = tiered_cache.stats()
+        self.names("/products/")
+        after = tiered_cache.stats()
+        self.assertEqual(after["l1_hits"] - before["l1_hits"], 1)
+        self.assertEqual(after["l2_hits"], before["l2_hits"])
+
+
+class LocalLRUCacheTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        lru = LocalLRUCache(max_entries=2, timeout=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+
+    def test_entries_expire(self):
+        lru = LocalLRUCache(max_entries=2, timeout=60)
+        lru.set("a", 1, timeout=-1)
+        self.assertIsNone(lru.get("a"))
+
+
+@override_settings(PRODUCT_LIST_SNAPSHOT=True)
+class ProductListSnapshotTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = ProductListAPIView.as_view()
+        for i in range(3):
+            Product.objects.create(name=f"P{i}", price=10 + i)
+
+    def get(self, url):
+        response = self.view(self.factory.get(url))
+        response.render()
+        return json.loads(response.content)
+
+    def test_serves_last_good_snapshot_without_queries(self):
+        first = self.get("/products/?page_size=2")
+        Product.objects.create(name="Fresh", price=1)
+
+        with self.assertNumQueries(0):
+            stale = self.get("/products/?page_size=10")
+        self.assertEqual(len(stale["results"]), 3)
+
+        snapshot.refresh_snapshot()
+        fresh = self.get("/products/?page_size=10")
+        self.assertEqual(len(fresh["results"]), 4)
+
+        second = self.get(first["next"])
+        self.assertEqual([row["name"] for row in second["results"]], ["P2", "Fresh"])
+
+    def test_snapshot_rows_match_database_cards(self):
+        from_snapshot = self.get("/products/")
+        cache.clear()
+        tiered_cache.local.clear()
+        with self.settings(PRODUCT_LIST_SNAPSHOT=False):
+            self.assertEqual(self.get("/products/"), from_snapshot)
+
+    def test_other_orderings_fall_back_to_database(self):
+        self.get("/products/")
+        Product.objects.create(name="Cheapest", price=1)
+        data = self.get("/products/?ordering=price")
+        self.assertEqual(data["results"][0]["name"], "Cheapest")
+
+
+class ConditionalGetTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = ProductDetailAPIView.as_view()
+        self.product = Product.objects.create(name="Phone", price=100)
+
+    def get(self, **headers):
+        response = self.view(self.factory.get("/products/1/", **headers), pk=self.product.pk)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def test_if_none_match_returns_304_until_product_changes(self):
+        etag = self.get()["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        with self.assertNumQueries(0):
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 90
+            self.product.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIn("Last-Modified", response)
+
+
+class SparseProductFieldsTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.view = ProductViewSet.as_view({"get": "list"})
+        Product.objects.create(name="Phone", price=100, description="Long text")
+
+    def first_row(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.view(self.factory.get(url))
+        return response.data["results"][0], queries
+
+    def test_list_uses_card_representation_and_narrow_select(self):
+        row, queries = self.first_row("/products/")
+        self.assertEqual(set(row), {"id", "name", "price", "image"})
+        self.assertNotIn("description", queries[0]["sql"])
+
+    def test_expand_and_fields(self):
+        row, _ = self.first_row("/products/?expand=description,rating")
+        self.assertEqual(row["description"], "Long text")
+        self.assertIn("rating", row)
+
+        row, queries = self.first_row("/products/?fields=id,name")
+        self.assertEqual(set(row), {"id", "name"})
+        self.assertEqual(len(queries), 1)  # без изображений — без prefetch
+
+    @override_settings(ROOT_URLCONF="store.urls")
+    def test_category_and_search_filter_on_the_server(self):
+        Product.objects.create(name="Chess", price=5, category="gaming", description="Board game")
+        Product.objects.create(name="Drill", price=50, category="diy")
+        view = resolve("/products/").func
+        for fast in (False, True):
+            with self.settings(FAST_READ_SERIALIZERS=fast):
+                cache.clear()
+                tiered_cache.local.clear()
+
+                def names(url):
+                    response = view(self.factory.get(url))
+                    response.render()
+                    return [row["name"] for row in json.loads(response.content)["results"]]
+
+                self.assertEqual(names("/products/?category=gaming"), ["Chess"])
+                self.assertEqual(names("/products/?search=board drill"), ["Chess", "Drill"])
+                self.assertEqual(names("/products/?search=LONG&category=electronics"), ["Phone"])
+                self.assertEqual(len(names("/products/?search=a")), 3)  # короткие слова не фильтруют
+
+    @override_settings(ROOT_URLCONF="store.urls")
+    def test_served_list_defaults_to_card(self):
+        view = resolve("/products/").func
+
+        def first(url):
+            response = view(self.factory.get(url))
+            response.render()
+            return json.loads(response.content)["results"][0]
+
+        self.assertEqual(set(first("/products/")), {"id", "name", "price", "image"})
+        self.assertEqual(first("/products/?expand=category,description")["description"], "Long text")
+        self.assertIn("quantity", first("/products/?view=full"))
+
+
+class ProductBatchLookupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        cloudinary.config(cloud_name="demo")
+        self.factory = APIRequestFactory()
+        self.view = ProductViewSet.as_view({"get": "list"})
+        self.products = [Product.objects.create(name=f"P{i}", price=i + 1, quantity=i) for i in range(5)]
+
+    def get(self, url):
+        response = self.view(self.factory.get(url))
+        response.render()
+        return response
+
+    def test_request_order_missing_ids_and_query_count(self):
+        a, b, c = self.products[3].pk, self.products[0].pk, self.products[4].pk
+        for product in (self.products[3], self.products[0]):
+            ProductImage.objects.create(product=product, image="products/x")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(f"/products/?ids={a},999,{b},{a},{c}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["id"] for row in response.data["results"]], [a, b, c])
+        self.assertEqual(response.data["missing"], [999])
+        self.assertIn("quantity", response.data["results"][0])  # полный товар, не карточка
+        self.assertEqual(len(queries), 2)  # товары + prefetch изображений
+
+    def test_invalid_and_oversized_requests(self):
+        self.assertEqual(self.get("/products/?ids=1,x").status_code, 400)
+        self.assertEqual(self.get("/products/?ids=").status_code, 400)
+        too_many = ",".join(str(i) for i in range(ProductViewSet.max_batch_ids + 1))
+        self.assertEqual(self.get(f"/products/?ids={too_many}").status_code, 400)
+
+
+class FastPathParityTests(StoreTestCase):
+    """The fast path must render byte-for-byte what the DRF serializers render."""
+
+    def setUp(self):
+        super().setUp()
+        cloudinary.config(cloud_name="demo")
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username="łukasz", password="pass12345")
+        self.products = [
+            Product.objects.create(name="Телефон\u2028", price="1999.90", description="x"),
+            Product.objects.create(name="Cable", price=5),
+        ]
+        ProductImage.objects.create(product=self.products[0], image="products/phone_b")
+        ProductImage.objects.create(product=self.products[0], image="products/phone_a")
+        Review.objects.create(product=self.products[0], user=self.user, rate=4, comment="ok 👍")
+        order = Order.objects.create(user=self.user, amount="2004.90")
+        OrderItem.objects.create(order=order, product=self.products[0], quantity=1)
+        OrderItem.objects.create(order=order, product=self.products[1], quantity=3)
+        Order.objects.create(user=self.user, amount=0, status="cancelled")
+
+    def render(self, view, url, **kwargs):
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        response = (view or resolve(request.path).func)(request, **kwargs)
+        response.render()
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def assertParity(self, view, url, **kwargs):
+        # эталон — сериализаторы DRF и его JSONRenderer, без orjson
+        with self.settings(FAST_READ_SERIALIZERS=False), \
+                mock.patch.object(FastJSONRenderer, "render", JSONRenderer.render):
+            cache.clear()
+            tiered_cache.local.clear()
+            slow = self.render(view, url, **kwargs)
+        with self.settings(FAST_READ_SERIALIZERS=True):
+            cache.clear()
+            tiered_cache.local.clear()
+            fast = self.render(view, url, **kwargs)
+        self.assertEqual(fast, slow)
+
+    def test_product_cards(self):
+        view = ProductViewSet.as_view({"get": "list"})
+        self.assertParity(view, "/products/")
+        self.assertParity(view, "/products/?ordering=-price&page_size=1")
+
+    @override_settings(ROOT_URLCONF="store.urls")
+    def test_served_product_list_uses_fast_path(self):
+        # view=None — вьюха берётся из URLconf, как для реального запроса
+        self.assertParity(None, "/products/?view=card")
+        cache.clear()
+        tiered_cache.local.clear()
+        view = resolve("/products/").func
+        with self.settings(FAST_READ_SERIALIZERS=True), \
+                mock.patch.object(fastpath, "product_cards", wraps=fastpath.product_cards) as cards:
+            response = view(self.factory.get("/products/?view=card&page_size=5"))
+        cards.assert_called_once()
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+
+    def test_reviews(self):
+        view = ReviewViewSet.as_view({"get": "list"})
+        self.assertParity(view, "/products/1/reviews/", product_pk=self.products[0].pk)
+
+    def test_orders(self):
+        self.assertParity(OrderListAPIView.as_view(), "/orders/")
+
+
+class FastJSONRendererTests(TestCase):
+    def test_bytes_match_drf_renderer(self):
+        moment = timezone.now().replace(microsecond=123456)
+        samples = [
+            {"rating": 4.5, "big": 1e16, "tiny": 1e-7, "small": 0.00005, "zero": 0.0},
+            {"at": moment, "day": moment.date(), "nested": [{"at": moment}]},
+            {1: "int key", "x": Decimal("0.00001")},
+            {"text": "Телефон\u2028👍", "n": 2 ** 70},
+        ]
+        for data in samples:
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_non_finite_floats_raise_like_drf(self):
+        for value in (float("nan"), float("inf")):
+            with self.assertRaises(ValueError):
+                FastJSONRenderer().render({"rating": value})
+
+
+class ProductImageUrlTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        cloudinary.config(cloud_name="demo")
+        self.product = Product.objects.create(name="Phone", price=1)
+
+    def test_urls_are_stored_on_save(self):
+        image = ProductImage.objects.create(product=self.product, image="image/upload/v12/phone.jpg")
+        image.refresh_from_db()
+        self.assertTrue(image.url.startswith("https://"))
+        self.assertIn("w_200", image.variants["thumb"])
+
+    def test_legacy_rows_use_process_memo(self):
+        image = ProductImage.objects.create(product=self.product, image="image/upload/v12/old.jpg")
+        ProductImage.objects.filter(pk=image.pk).update(url="", variants={})
+        legacy = ProductImage.objects.get(pk=image.pk)
+        _image_urls.cache_clear()
+        data = ProductImageSerializer([legacy, legacy], many=True).data
+        self.assertEqual(data[0]["image"], image.url)
+        self.assertEqual(_image_urls.cache_info().misses, 1)
+
+
+class OrderCreationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.products = [Product.objects.create(name=f"P{i}", price=i + 1, quantity=10) for i in range(200)]
+        self.request = Request(APIRequestFactory().post("/orders/create/"))
+        self.request.user = self.user
+
+    def create_order(self, lines):
+        payload = {"items": [{"product_id": p.pk, "quantity": 2} for p in self.products[:lines]]}
+        with CaptureQueriesContext(connection) as queries:
+            serializer = OrderSerializer(data=payload, context={"request": self.request})
+            serializer.is_valid(raise_exception=True)
+            order = serializer.save()
+            data = serializer.data
+        return order, data, len(queries)
+
+    def test_query_count_does_not_depend_on_line_count(self):
+        _, _, one = self.create_order(1)
+        order, data, many = self.create_order(200)
+        self.assertEqual(one, many)
+        self.assertEqual(len(data["items"]), 200)
+        self.assertEqual(order.items.count(), 200)
+        self.assertEqual(order.amount, sum(2 * (i + 1) for i in range(200)))
+
+    def test_unknown_product_is_rejected_without_writes(self):
+        payload = {"items": [{"product_id": self.products[0].pk, "quantity": 1},
+                             {"product_id": 10**6, "quantity": 1}]}
+        serializer = OrderSerializer(data=payload, context={"request": self.request})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("items", serializer.errors)
+        self.assertFalse(Order.objects.exists())
+
+    def test_stock_is_reserved_all_or_nothing(self):
+        self.create_order(1)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity, 8)
+
+        payload = {"items": [{"product_id": self.products[1].pk, "quantity": 5},
+                             {"product_id": self.products[0].pk, "quantity": 5},
+                             {"product_id": self.products[0].pk, "quantity": 5}]}  # 10 > 8
+        serializer = OrderSerializer(data=payload, context={"request": self.request})
+        serializer.is_valid(raise_exception=True)
+        with self.assertRaisesMessage(ValidationError, str([self.products[0].pk])):
+            serializer.save()
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).quantity, 10)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class StockReservationTests(StoreTestCase):
+    def test_single_conditional_update(self):
+        a = Product.objects.create(name="A", price=1, quantity=3)
+        b = Product.objects.create(name="B", price=1, quantity=1)
+        with CaptureQueriesContext(connection) as queries:
+            Product.reserve_stock({a.pk: 2, b.pk: 1})
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Product.objects.get(pk=a.pk).quantity, 1)
+
+        with self.assertRaises(InsufficientStock) as ctx:
+            Product.reserve_stock({a.pk: 1, b.pk: 1})
+        self.assertEqual(ctx.exception.product_ids, [b.pk])
+        self.assertEqual(Product.objects.get(pk=a.pk).quantity, 1)  # откат всей брони
+
+    def test_reservation_invalidates_only_lists_showing_stock(self):
+        product = Product.objects.create(name="A", price=1, quantity=5)
+        view = ProductListAPIView.as_view()
+
+        def first(url):
+            response = view(APIRequestFactory().get(url))
+            if hasattr(response, "render"):
+                response.render()
+            return json.loads(response.content)["results"][0]
+
+        self.assertEqual(first("/products/?fields=id,quantity")["quantity"], 5)
+        self.assertEqual(first("/products/?view=full")["quantity"], 5)
+        card = first("/products/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.reserve_stock({product.pk: 3})
+        self.assertEqual(first("/products/?fields=id,quantity")["quantity"], 2)
+        self.assertEqual(first("/products/?view=full")["quantity"], 2)
+        with self.assertNumQueries(0):  # карточки без остатка остаются в кэше
+            self.assertEqual(first("/products/"), card)
+
+    def test_hot_product_takes_from_shards_and_reconciles(self):
+        hot = Product.objects.create(name="Hot", price=1, quantity=10)
+        hot.shard_stock(4)
+        self.assertEqual(list(hot.stock_shards.order_by("index").values_list("quantity", flat=True)),
+                         [3, 3, 2, 2])
+
+        Product.reserve_stock({hot.pk: 1}, {hot.pk: 4})
+        Product.reserve_stock({hot.pk: 6}, {hot.pk: 4})  # ни в одном шарде нет 6 — по частям
+        self.assertEqual(Product.objects.get(pk=hot.pk).quantity, 10)  # до сверки
+        with self.assertRaises(InsufficientStock):
+            Product.reserve_stock({hot.pk: 4}, {hot.pk: 4})
+        self.assertEqual(sum(hot.stock_shards.values_list("quantity", flat=True)), 3)
+
+        self.assertEqual(StockShard.reconcile(), [hot.pk])
+        self.assertEqual(Product.objects.get(pk=hot.pk).quantity, 3)
+        self.assertEqual(sorted(hot.stock_shards.values_list("quantity", flat=True)), [0, 1, 1, 1])
+
+        hot.shard_stock(0)
+        self.assertFalse(hot.stock_shards.exists())
+        self.assertEqual(Product.objects.get(pk=hot.pk).quantity, 3)
+
+
+class CheckoutTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.products = [Product.objects.create(name=f"P{i}", price=1000, quantity=10) for i in range(50)]
+        self.request = Request(APIRequestFactory().post("/checkout/"))
+        self.request.user = self.user
+
+    def payload(self, lines, **extra):
+        return {
+            "first_name": "A", "last_name": "B", "email": "a@example.com", "address": "Street 1",
+            "country": "KZ", "state": "Almaty", "zip_code": "050000", "card_name": "A B",
+            "card_number": "4242424242424242", "expiration": "12/30", "cvv": "123",
+            "items": [{"product_id": p.pk, "quantity": 1} for p in self.products[:lines]],
+            **extra,
+        }
+
+
+class CheckoutPipelineTests(CheckoutTestCase):
+    def checkout(self, payload):
+        with CaptureQueriesContext(connection) as queries:
+            serializer = CheckoutSerializer(data=payload, context={"request": self.request})
+            serializer.is_valid(raise_exception=True)
+            checkout = serializer.save()
+            data = serializer.data
+        return checkout, data, len(queries)
+
+    def test_query_count_does_not_depend_on_line_count(self):
+        Coupon.objects.create(code="ONE", amount=500)
+        Coupon.objects.create(code="MANY", amount=500)
+        _, _, one = self.checkout(self.payload(1, coupon_code="ONE"))
+        checkout, data, many = self.checkout(self.payload(50, coupon_code="MANY"))
+        self.assertEqual(one, many)
+        self.assertEqual(len(data["items"]), 50)
+        self.assertEqual(checkout.order.amount, 50 * 1000 - 500)
+        self.assertEqual(checkout.order.items.count(), 50)
+        self.assertFalse(Coupon.objects.get(code="MANY").is_active)
+
+    def test_coupon_failure_leaves_no_rows(self):
+        Coupon.objects.create(code="BIG", amount=5000)
+        serializer = CheckoutSerializer(data=self.payload(1, coupon_code="BIG"),
+                                        context={"request": self.request})
+        serializer.is_valid(raise_exception=True)
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        self.assertFalse(Checkout.objects.exists())
+        self.assertFalse(CheckoutItem.objects.exists())
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Coupon.objects.get(code="BIG").is_active)
+
+    def test_coupon_redeemed_concurrently_is_rejected(self):
+        Coupon.objects.create(code="RACE", amount=500)
+        serializer = CheckoutSerializer(data=self.payload(1, coupon_code="RACE"),
+                                        context={"request": self.request})
+        serializer.is_valid(raise_exception=True)
+        # другой checkout погасил купон после validate_coupon_code
+        self.assertTrue(Coupon.objects.get(code="RACE").redeem())
+        with self.assertRaisesMessage(ValidationError, "Coupon expired or inactive"):
+            serializer.save()
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity, 10)
+
+    def test_redemption_is_one_conditional_update(self):
+        coupon = Coupon.objects.create(code="ONCE", amount=500)
+        expired = Coupon.objects.create(code="OLD", amount=500, expires_at=timezone.now() - timedelta(minutes=1))
+        with self.assertNumQueries(1):
+            self.assertTrue(coupon.redeem())
+        self.assertFalse(Coupon.objects.get(code="ONCE").redeem())
+        self.assertFalse(expired.redeem())
+        self.assertTrue(Coupon.objects.get(code="OLD").is_active)
+
+    def test_stock_failure_rolls_back_redemption(self):
+        Coupon.objects.create(code="STOCK", amount=500)
+        Product.objects.filter(pk=self.products[0].pk).update(quantity=0)
+        serializer = CheckoutSerializer(data=self.payload(1, coupon_code="STOCK"),
+                                        context={"request": self.request})
+        serializer.is_valid(raise_exception=True)
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        self.assertTrue(Coupon.objects.get(code="STOCK").is_active)
+
+
+@override_settings(CHECKOUT_ASYNC=True, ROOT_URLCONF="store.urls")
+class AsyncCheckoutTests(CheckoutTestCase):
+    def post(self, payload):
+        request = APIRequestFactory().post("/checkout/", payload, format="json")
+        force_authenticate(request, user=self.user)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = CheckoutAPIView.as_view()(request)
+        self.assertEqual(len(callbacks), 1)  # задача ставится в очередь только после коммита
+        return response
+
+    def status(self, checkout_id):
+        request = APIRequestFactory().get(f"/checkouts/{checkout_id}/status/")
+        force_authenticate(request, user=self.user)
+        return CheckoutStatusAPIView.as_view()(request, pk=checkout_id).data
+
+    def test_accepts_then_worker_creates_order(self):
+        Coupon.objects.create(code="ASYNC", amount=500)
+        response = self.post(self.payload(3, coupon_code="ASYNC"))
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response["Location"].endswith(f"/checkouts/{response.data['id']}/status/"))
+        self.assertEqual(self.status(response.data["id"])["status"], "pending")
+        self.assertFalse(Order.objects.exists())
+
+        process_checkout_task(response.data["id"])
+        process_checkout_task(response.data["id"])  # повторная доставка — без второго заказа
+        status = self.status(response.data["id"])
+        self.assertEqual(status["status"], "completed")
+        self.assertEqual(Order.objects.get().pk, status["order"])
+        self.assertEqual(Order.objects.get().amount, 3 * 1000 - 500)
+        self.assertFalse(Coupon.objects.get(code="ASYNC").is_active)
+
+    def test_worker_reports_failure(self):
+        Coupon.objects.create(code="LATE", amount=500)
+        response = self.post(self.payload(1, coupon_code="LATE"))
+        Coupon.objects.filter(code="LATE").update(is_active=False)  # погашен до запуска воркера
+        process_checkout_task(response.data["id"])
+        status = self.status(response.data["id"])
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(status["error"], "Coupon expired or inactive")
+        self.assertFalse(Order.objects.exists())
+
+    @override_settings(CHECKOUT_PROCESSING_TIMEOUT=60, CHECKOUT_MAX_ATTEMPTS=2)
+    def test_stale_processing_is_reclaimed_then_failed(self):
+        first = self.post(self.payload(1)).data["id"]
+        second = self.post(self.payload(1)).data["id"]
+        # воркер взял оба checkout и умер
+        long_ago = timezone.now() - timedelta(minutes=5)
+        Checkout.objects.filter(pk=first).update(status="processing", processing_started_at=long_ago, attempts=1)
+        Checkout.objects.filter(pk=second).update(status="processing", processing_started_at=long_ago, attempts=2)
+        fresh = self.post(self.payload(1)).data["id"]
+        Checkout.objects.filter(pk=fresh).update(status="processing", processing_started_at=timezone.now())
+
+        process_checkout_task(fresh)  # живая попытка не перехватывается
+        self.assertEqual(self.status(fresh)["status"], "processing")
+
+        self.assertEqual(recover_stale_checkouts(), 1)
+        self.assertEqual(self.status(first)["status"], "completed")
+        self.assertEqual(Checkout.objects.get(pk=first).attempts, 2)
+        self.assertEqual(self.status(second), {"id": second, "status": "failed",
+                                               "error": "Processing timed out", "order": None})
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class IdempotencyKeyTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.product = Product.objects.create(name="Phone", price=100, quantity=10)
+        self.view = OrderCreateAPIView.as_view()
+
+    def post(self, quantity=1, key="retry-1"):
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        request = APIRequestFactory().post(
+            "/orders/create/", {"items": [{"product_id": self.product.pk, "quantity": quantity}]},
+            format="json", **headers,
+        )
+        force_authenticate(request, user=self.user)
+        response = self.view(request)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def test_retry_replays_stored_response(self):
+        first = self.post()
+        retry = self.post()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).quantity, 9)
+
+        self.assertEqual(self.post(quantity=2).status_code, 422)  # тот же ключ, другое тело
+        self.post(key=None)
+        self.post(key=None)
+        self.assertEqual(Order.objects.count(), 3)
+
+    @override_settings(IDEMPOTENCY_WAIT=0.1)
+    def test_duplicate_in_flight_is_not_run(self):
+        self.post(key="other")  # чужой ключ не мешает
+        with mock.patch("store.idempotency.cache.add", return_value=False):
+            response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class OrderHistoryTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        product = Product.objects.create(name="Phone", price=10)
+        self.orders = []
+        for i in range(5):
+            order = Order.objects.create(user=self.user, amount=10 * (i + 1))
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=product)] * (i + 1))
+            self.orders.append(order)
+
+    def get(self, view, url, **kwargs):
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        return view(request, **kwargs).data
+
+    def test_summaries_are_cursor_paginated_newest_first(self):
+        view = OrderListAPIView.as_view()
+        for fast in (False, True):
+            with self.settings(FAST_READ_SERIALIZERS=fast):
+                first = self.get(view, "/orders/?page_size=3")
+                self.assertEqual([row["id"] for row in first["results"]],
+                                 [o.pk for o in self.orders[::-1][:3]])
+                self.assertEqual(set(first["results"][0]), {"id", "order_date", "status", "amount", "item_count"})
+                self.assertEqual(first["results"][0]["item_count"], 5)
+                second = self.get(view, first["next"].split("testserver")[1])
+                self.assertEqual([row["id"] for row in second["results"]], [o.pk for o in self.orders[1::-1]])
+                self.assertIsNone(second["next"])
+
+    def test_detail_has_items_and_is_scoped_to_user(self):
+        view = OrderDetailAPIView.as_view()
+        data = self.get(view, "/orders/1/", pk=self.orders[2].pk)
+        self.assertEqual(len(data["items"]), 3)
+        other = Order.objects.create(user=User.objects.create_user(username="other"), amount=1)
+        request = self.factory.get("/orders/1/")
+        force_authenticate(request, user=self.user)
+        self.assertEqual(view(request, pk=other.pk).status_code, 404)
+
+    def test_detail_etag_follows_its_products(self):
+        view = OrderDetailAPIView.as_view()
+
+        def get(**headers):
+            request = self.factory.get("/orders/1/", **headers)
+            force_authenticate(request, user=self.user)
+            return view(request, pk=self.orders[0].pk)
+
+        etag = get()["ETag"]
+        self.assertEqual(get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        product = Product.objects.get(name="Phone")
+        with self.captureOnCommitCallbacks(execute=True):
+            product.description = "New text"
+            product.save()
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["items"][0]["product"]["description"], "New text")
+
+    def test_profile_counters_follow_order_creation(self):
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.order_count, 5)
+        self.assertEqual(self.user.profile.lifetime_spend, 150)
+
+    def test_item_signals_cost_no_extra_queries(self):
+        item = OrderItem.objects.filter(order=self.orders[0]).first()
+        item.quantity = 2
+        with mock.patch("store.signals.bump") as bumped, self.captureOnCommitCallbacks(execute=True), \
+                self.assertNumQueries(2):  # UPDATE + user_id заказа
+            item.save()
+        bumped.assert_called_once_with(orders_tag(self.user.pk))
+
+        order_pk = self.orders[4].pk
+        with CaptureQueriesContext(connection) as queries:
+            self.orders[4].delete()
+        # без post_delete у OrderItem позиции удаляются одним DELETE, без SELECT
+        self.assertFalse([q for q in queries if q["sql"].startswith("SELECT") and "store_orderitem" in q["sql"]])
+        self.assertFalse(OrderItem.objects.filter(order_id=order_pk).exists())
+
+
+@override_settings(PROFILE_RECENT_ORDERS=2)
+class ProfileRecentOrdersTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.product = Product.objects.create(name="Phone", price=10)
+
+    def add_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, amount=10)
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=self.product)] * 3)
+
+    def profile(self):
+        request = APIRequestFactory().get("/profile/")
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = UserProfileAPIView.as_view()(request)
+            response.render()
+        return response.data, len(queries)
+
+    def test_fixed_queries_and_newest_orders_only(self):
+        self.add_orders(1)
+        _, few = self.profile()
+        self.add_orders(10)
+        data, many = self.profile()
+        self.assertEqual(few, many)
+        self.assertEqual(data["order_count"], 11)
+        newest = list(Order.objects.order_by("-order_date", "-id").values_list("id", flat=True)[:2])
+        self.assertEqual([order["id"] for order in data["recent_orders"]], newest)
+        self.assertEqual(len(data["recent_orders"][0]["items"]), 3)
+
+
+class OrderArchiveTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        product = Product.objects.create(name="Phone", price=10)
+        now = timezone.now()
+        self.orders = []
+        for days in (900, 800, 700, 10, 5):  # три старых, два свежих
+            order = Order.objects.create(user=self.user, amount=days)
+            Order.objects.filter(pk=order.pk).update(order_date=now - timedelta(days=days))
+            OrderItem.objects.create(order=order, product=product, quantity=2)
+            self.orders.append(order)
+        checkout = Checkout.objects.create(
+            user=self.user, first_name="A", last_name="B", email="a@example.com", address="x",
+            country="KZ", state="A", zip_code="1", card_name="A B", card_number="4242424242424242",
+            expiration="12/30", cvv="123", order=self.orders[0], status="completed",
+        )
+        CheckoutItem.objects.create(checkout=checkout, product=product, quantity=2)
+
+    def get(self, view, url, **kwargs):
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, user=self.user)
+        return view(request, **kwargs)
+
+    def test_old_orders_move_in_chunks(self):
+        self.assertEqual(archive_orders(timezone.now() - timedelta(days=365), chunk_size=2), 3)
+        self.assertEqual(list(Order.objects.values_list("pk", flat=True).order_by("pk")),
+                         [o.pk for o in self.orders[3:]])
+        self.assertFalse(Checkout.objects.exists())
+        self.assertFalse(CheckoutItem.objects.exists())
+        archived = ArchivedOrder.objects.get(pk=self.orders[0].pk)
+        self.assertEqual(archived.items[0]["quantity"], 2)
+        self.assertEqual(archived.checkout["items"][0]["quantity"], 2)
+        self.assertNotIn("card_number", archived.checkout)
+
+    def test_rebuilt_counters_include_archived_orders(self):
+        archive_orders(timezone.now() - timedelta(days=365))
+        Profile.objects.filter(user=self.user).update(order_count=0, lifetime_spend=0)
+        call_command("rebuild_order_counters", stdout=StringIO())
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.order_count, 5)
+        self.assertEqual(self.user.profile.lifetime_spend, 900 + 800 + 700 + 10 + 5)
+
+    def test_read_paths_include_archive_only_when_asked(self):
+        archive_orders(timezone.now() - timedelta(days=365))
+        view = OrderListAPIView.as_view()
+        hot = self.get(view, "/orders/").data["results"]
+        self.assertEqual(len(hot), 2)
+
+        ids, url = [], "/orders/?include_archived=1&page_size=2"
+        while url:
+            page = self.get(view, url).data
+            ids += [row["id"] for row in page["results"]]
+            url = page["next"] and page["next"].split("testserver")[1]
+        self.assertEqual(ids, [o.pk for o in reversed(self.orders)])
+
+        detail = OrderDetailAPIView.as_view()
+        self.assertEqual(self.get(detail, "/orders/1/", pk=self.orders[0].pk).status_code, 404)
+        response = self.get(detail, "/orders/1/?include_archived=1", pk=self.orders[0].pk)
+        self.assertEqual(response.data["items"][0]["product"]["name"], "Phone")
+
+
+class SalesRollupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.phone = Product.objects.create(name="Phone", price=100, category="electronics")
+        self.game = Product.objects.create(name="Game", price=20, category="gaming")
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+
+    def order(self, lines, minutes=5, status="confirmed"):
+        order = Order.objects.create(user=self.user, amount=0, status=status)
+        Order.objects.filter(pk=order.pk).update(order_date=self.hour + timedelta(minutes=minutes))
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, unit_price=product.price)
+        return order
+
+    def test_new_orders_are_added_incrementally(self):
+        self.order([(self.phone, 1), (self.game, 2)])
+        self.order([(self.phone, 2)], minutes=30)
+        self.order([(self.phone, 5)], status="cancelled")
+        self.assertEqual(update_rollups(chunk_size=1), 3)
+
+        Product.objects.filter(pk=self.phone.pk).update(price=999)  # выручка — по unit_price
+        last = self.order([(self.phone, 1)], minutes=50)
+        with self.assertNumQueries(15):  # чанк с заказом + пустой чанк, без SELECT по старым заказам
+            self.assertEqual(update_rollups(), 1)
+        self.assertEqual(update_rollups(), 0)
+        self.assertEqual(RollupCheckpoint.objects.get().last_order_id, last.pk)
+
+        phone = ProductSalesRollup.objects.get(granularity="hour", product=self.phone)
+        self.assertEqual((phone.bucket, phone.revenue, phone.units, phone.orders), (self.hour, 400, 4, 3))
+        self.assertEqual(ProductSalesRollup.objects.filter(granularity="day").count(), 2)
+        electronics = CategorySalesRollup.objects.get(granularity="day", category="electronics")
+        self.assertEqual((electronics.revenue, electronics.orders), (400, 3))
+        gaming = CategorySalesRollup.objects.get(granularity="hour", category="gaming")
+        self.assertEqual((gaming.revenue, gaming.units, gaming.orders), (40, 2, 1))
+
+    def test_rebuild_replays_outside_the_reset_transaction(self):
+        self.order([(self.phone, 1)])
+        update_rollups()
+        ProductSalesRollup.objects.update(units=99)  # испорченные агрегаты
+        depth = len(connection.atomic_blocks)
+        replay = analytics.update_rollups
+
+        def check_depth(*args, **kwargs):
+            self.assertEqual(len(connection.atomic_blocks), depth)  # сброс уже закоммичен
+            return replay(*args, **kwargs)
+
+        with mock.patch.object(analytics, "update_rollups", side_effect=check_depth):
+            self.assertEqual(analytics.rebuild_rollups(), 1)
+        self.assertEqual(ProductSalesRollup.objects.get(granularity="hour").units, 1)
+
+    def test_orders_inside_the_lag_wait_for_the_next_run(self):
+        Order.objects.create(user=self.user, amount=0)
+        self.assertEqual(update_rollups(), 0)
+        self.assertEqual(RollupCheckpoint.objects.get().last_order_id, 0)
+
+    def test_endpoints_are_admin_only_and_read_rollups(self):
+        self.order([(self.phone, 1), (self.game, 2)])
+        update_rollups()
+        factory = APIRequestFactory()
+
+        request = factory.get("/analytics/sales/products/")
+        force_authenticate(request, user=self.user)
+        self.assertEqual(ProductSalesAPIView.as_view()(request).status_code, 403)
+
+        admin = User.objects.create_user(username="admin", password="pass12345", is_staff=True)
+        request = factory.get("/analytics/sales/products/", {"granularity": "hour"})
+        force_authenticate(request, user=admin)
+        with self.assertNumQueries(1):
+            rows = ProductSalesAPIView.as_view()(request).data
+        self.assertEqual([(row["product"], row["units"]) for row in rows], [(self.phone.pk, 1), (self.game.pk, 2)])
+
+        request = factory.get("/analytics/sales/categories/", {"category": "gaming"})
+        force_authenticate(request, user=admin)
+        rows = CategorySalesAPIView.as_view()(request).data
+        self.assertEqual([(row["category"], row["revenue"]) for row in rows], [("gaming", "40.00")])
+
+        request = factory.get("/analytics/sales/categories/", {"granularity": "hour", "since": "2020-01-01T00:00Z"})
+        force_authenticate(request, user=admin)
+        self.assertEqual(CategorySalesAPIView.as_view()(request).status_code, 400)
+
+
+class CouponLookupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        Coupon.objects.create(code="KNOWN1", amount=500)
+        coupons.build_filter()
+
+    def validate(self, code):
+        request = APIRequestFactory().post("/coupons/validate/", {"code": code, "amount": 1000}, format="json")
+        force_authenticate(request, user=self.user)
+        return CouponValidateAPIView.as_view()(request)
+
+    def test_guessed_codes_do_not_reach_the_database(self):
+        with self.assertNumQueries(0):
+            for n in range(100):
+                self.assertIsNone(coupons.lookup_coupon(f"GUESS{n:03d}"))
+            response = self.validate("NOPE0000")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Coupon not found", str(response.data))
+
+    def test_valid_coupon_is_cached_until_redeemed(self):
+        self.assertEqual(self.validate("KNOWN1").data["discounted_total"], 500)
+        with self.assertNumQueries(0):
+            coupon = coupons.lookup_coupon("KNOWN1")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(coupon.redeem())
+        self.assertFalse(coupons.lookup_coupon("KNOWN1").is_valid)
+
+    def test_new_code_is_visible_to_workers_with_an_older_filter(self):
+        published = cache.get(coupons.FILTER_KEY)
+        Coupon.objects.create(code="NEW1", amount=500)
+        coupons._local.filter = published  # копия другого воркера, собранная до купона
+        self.assertNotIn("NEW1", published)
+        self.assertEqual(coupons.lookup_coupon("NEW1").code, "NEW1")
+
+        cache.clear()  # вместе с фильтром пропали и маркеры — только БД
+        coupons._local.checked_at = 0
+        self.assertIsNone(coupons.current_filter())
+        self.assertEqual(coupons.lookup_coupon("NEW1").code, "NEW1")
+
+
+class CouponCampaignTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.campaign = CouponCampaign.objects.create(name="spring", prefix="SP", amount=700, valid_days=7)
+
+    def test_codes_are_generated_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(campaigns.generate_codes(self.campaign, 1200, batch_size=500), 1200)
+        self.assertLess(len(queries), 20)
+        counts = [q["sql"] for q in queries if q["sql"].startswith("SELECT COUNT")]
+        self.assertTrue(counts and all(" IN (" in sql for sql in counts))  # только своя пачка, не весь пул
+        codes = list(self.campaign.coupons.values_list("code", flat=True))
+        self.assertEqual(len(set(codes)), 1200)
+        self.assertTrue(all(code.startswith("SP") and len(code) == 10 for code in codes))
+        self.assertFalse(self.campaign.coupons.filter(is_active=True).exists())
+        self.assertEqual(campaigns.pool_size(self.campaign), 1200)
+
+    def test_collisions_are_topped_up(self):
+        Coupon.objects.create(code="SPTAKEN01", amount=1)
+        batches = [["SPTAKEN01", "SPTAKEN01", "SPFRESH01"], ["SPFRESH02"]]
+        with mock.patch.object(campaigns, "random_codes", side_effect=lambda *args: batches.pop(0)):
+            self.assertEqual(campaigns.generate_codes(self.campaign, 2), 2)
+        self.assertEqual(sorted(self.campaign.coupons.values_list("code", flat=True)), ["SPFRESH01", "SPFRESH02"])
+
+    def test_claim_issues_one_pooled_code(self):
+        campaigns.generate_codes(self.campaign, 2)
+        user = User.objects.create_user(username="buyer", password="pass12345")
+        with self.assertNumQueries(4):  # SAVEPOINT, UPDATE, SELECT, RELEASE
+            coupon = campaigns.claim_code(self.campaign, user)
+        self.assertEqual((coupon.user, coupon.amount, coupon.is_valid), (user, 700, True))
+        self.assertEqual(coupons.lookup_coupon(coupon.code).pk, coupon.pk)
+        self.assertEqual(campaigns.pool_size(self.campaign), 1)
+
+        self.assertEqual(len(campaigns.issue_codes(self.campaign, 5)), 1)
+        other = User.objects.create_user(username="late", password="pass12345")
+        self.assertIsNone(campaigns.claim_code(self.campaign, other))
+
+    def test_registration_claims_from_the_welcome_pool(self):
+        campaigns.generate_codes(campaigns.welcome_campaign(), 3)
+        request = APIRequestFactory().post("/register/", {
+            "username": "newbie", "email": "n@example.com",
+            "password": "Str0ng-pass-42", "password2": "Str0ng-pass-42",
+        }, format="json")
+        with mock.patch("store.tasks.create_welcome_coupon_for_user.delay") as fallback:
+            self.assertEqual(RegistrationAPIView.as_view()(request).status_code, 201)
+        fallback.assert_not_called()
+        coupon = Coupon.objects.get(user__username="newbie")
+        self.assertTrue(coupon.is_valid)
+        self.assertEqual(campaigns.pool_size(campaigns.welcome_campaign()), 2)
+
+
+class CouponExpiryTests(StoreTestCase):
+    def test_expired_coupons_are_deactivated_in_chunks(self):
+        past = timezone.now() - timedelta(days=1)
+        for n in range(5):
+            Coupon.objects.create(code=f"OLD{n}", amount=1, expires_at=past - timedelta(minutes=n))
+        Coupon.objects.create(code="LIVE", amount=1)
+        Coupon.objects.create(code="USED", amount=1, expires_at=past, is_active=False)
+
+        self.assertEqual(coupons.expire_coupons(chunk_size=2, max_chunks=1), 2)
+        # остаток — с того места, где остановились: выключенные ушли из частичного индекса
+        self.assertEqual(coupons.expire_coupons(chunk_size=2), 3)
+        self.assertEqual(coupons.expire_coupons(), 0)
+        self.assertEqual(list(Coupon.objects.filter(is_active=True).values_list("code", flat=True)), ["LIVE"])
+        self.assertEqual(cache.get(coupons.EXPIRY_PROGRESS_KEY)["expired"], 3)
+
+    def test_expiry_is_lazy_on_read(self):
+        user = User.objects.create_user(username="buyer", password="pass12345")
+        coupon = Coupon.objects.create(user=user, code="LAPSED", amount=1,
+                                       expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(Coupon.objects.get(pk=coupon.pk).is_active)  # чистка ещё не прошла
+        self.assertFalse(coupon.is_valid)
+        self.assertFalse(CouponSerializer(coupon).data["is_active"])
+        self.assertFalse(coupons.lookup_coupon("LAPSED").is_valid)
+        self.assertFalse(coupon.redeem())
+
+
+class FakeGeminiClient:
+    def __init__(self, delay=0, fail=False):
+        self.calls = []
+        self.delay, self.fail = delay, fail
+        self.models = self
+
+    def generate_content(self, model, contents):
+        self.calls.append(contents)
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return SimpleNamespace(text=f"answer #{len(self.calls)}")
+
+
+class GeminiResponseCacheTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        gemini.answer_cache.local.clear()
+        gemini.counters.clear()
+
+    def test_normalized_prompts_share_an_answer(self):
+        client = FakeGeminiClient()
+        first = gemini.generate(client, "m", "Is it  waterproof?\n")
+        self.assertEqual(gemini.generate(client, "m", "is it waterproof?"), first)
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(gemini.generate(client, "other-model", "is it waterproof?"), "answer #2")
+        self.assertEqual(gemini.generate(client, "m", "is it waterproof?", bypass=True), "answer #3")
+        self.assertEqual(gemini.generate(client, "m", "is it waterproof?"), "answer #3")
+        self.assertEqual(gemini.stats()["hit_rate"], 0.5)
+
+    def test_concurrent_identical_prompts_make_one_call(self):
+        client = FakeGeminiClient(delay=0.3)
+        answers = []
+        threads = [threading.Thread(target=lambda: answers.append(gemini.generate(client, "m", "same")))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(answers, ["answer #1"] * 8)
+
+    def test_errors_are_not_cached(self):
+        with self.assertRaises(RuntimeError):
+            gemini.generate(FakeGeminiClient(fail=True), "m", "hello")
+        self.assertEqual(gemini.generate(FakeGeminiClient(), "m", "hello"), "answer #1")
+
+    def test_product_consult_repeats_hit_the_cache(self):
+        user = User.objects.create_user(username="buyer", password="pass12345")
+        product = Product.objects.create(name="Phone", price=100, description="Waterproof")
+        client = FakeGeminiClient()
+        with mock.patch("store.views.client", client):
+            for headers in ({}, {}, {"HTTP_CACHE_CONTROL": "no-cache"}):
+                request = APIRequestFactory().post(f"/products/{product.pk}/ask/", {"prompt": "Battery?"},
+                                                   format="json", **headers)
+                force_authenticate(request, user=user)
+                response = ProductConsultAPIView.as_view()(request, pk=product.pk)
+        self.assertEqual(len(client.calls), 2)
+        self.assertEqual(response.data["answer"], "answer #2")
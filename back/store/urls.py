@@ -4,7 +4,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.routers import SimpleRouter
 from rest_framework_nested import routers
-from .views import ChatClearAPIView, CouponDetailAPIView, CouponValidateAPIView, GeminiChatAPIView, ProductConsultAPIView, ProductViewSet, ReviewViewSet, UserCouponAPIView
+from .views import CacheStatsAPIView, ChatClearAPIView, CouponDetailAPIView, CouponValidateAPIView, GeminiChatAPIView, ProductConsultAPIView, ProductViewSet, ReviewViewSet, UserCouponAPIView
 
 
 from rest_framework import permissions
@@ -38,6 +38,7 @@ from .views import (
     LoginAPIView,
     OrderCreateAPIView,
     OrderListAPIView,
+    OrderDetailAPIView,
     ProductListAPIView,
     UserProfileAPIView,
     ProductDetailAPIView,
@@ -46,6 +47,9 @@ from .views import (
     UserProfilePhotoUploadAPIView,
     UserProfileUpdateAPIView,
     CheckoutListAPIView,
+    CheckoutStatusAPIView,
+    ProductSalesAPIView,
+    CategorySalesAPIView,
     # ProductListCreateAPIView,
 )
 from rest_framework_simplejwt.views import TokenRefreshView
@@ -57,6 +61,7 @@ urlpatterns = [
     path('login/', LoginAPIView.as_view(), name='login'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('orders/', OrderListAPIView.as_view(), name='orders-list'),
+    path('orders/<int:pk>/', OrderDetailAPIView.as_view(), name='order-detail'),
     path('profile/', UserProfileAPIView.as_view(), name='profile'),
     path('profile/update/', UserProfileUpdateAPIView.as_view(), name='profile-update'),
     path('profile/photo/', UserProfilePhotoUploadAPIView.as_view(), name='profile-photo-upload'),
@@ -71,6 +76,7 @@ urlpatterns = [
 
     path('checkout/', CheckoutAPIView.as_view(), name='checkout'),
     path('checkouts/', CheckoutListAPIView.as_view(), name='checkouts-list'),  # GET
+    path('checkouts/<int:pk>/status/', CheckoutStatusAPIView.as_view(), name='checkout-status'),  # GET
      path("chat/", GeminiChatAPIView.as_view()), 
         #  path("coupons/welcome/", WelcomeCouponAPIView.as_view(),  name="coupon-welcome"),
     path("coupons/validate/", CouponValidateAPIView.as_view(), name="coupon-validate"),
@@ -78,6 +84,9 @@ urlpatterns = [
     path("chat/clear/", ChatClearAPIView.as_view(),           name="chat-clear"),
     path("products/<int:pk>/ask/", ProductConsultAPIView.as_view(), name="product-ask"),
     path('coupon/user/', UserCouponAPIView.as_view(), name='user-coupon'),
+    path('cache/stats/', CacheStatsAPIView.as_view(), name='cache-stats'),
+    path('analytics/sales/products/', ProductSalesAPIView.as_view(), name='analytics-product-sales'),
+    path('analytics/sales/categories/', CategorySalesAPIView.as_view(), name='analytics-category-sales'),
         path('', include(router.urls)),
     path('', include(products_router.urls)),
     path("silk/", include("silk.urls", namespace="silk")),
@@ -8,6 +8,7 @@ from django.contrib.auth.models import User
 # from .tasks import process_checkout_task
 
 from rest_framework.views import APIView
+from rest_framework.renderers import BrowsableAPIRenderer
 from silk.profiling.profiler import silk_profile
 from rest_framework.throttling import ScopedRateThrottle
 from google import genai
@@ -21,11 +22,34 @@ from .serializers import (
     RegistrationSerializer,
     LoginSerializer,
     OrderSerializer,
+    OrderSummarySerializer,
+    ArchivedOrderSerializer,
+    CategorySalesRollupSerializer,
+    ProductSalesRollupSerializer,
     ProductSerializer,
+    SalesRollupQuerySerializer,
     UserSerializer,
 )
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Chat, ChatMessage, Checkout, Order, OrderItem, Product,Category
+from django.db.models import Count, Prefetch, Q
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from .pagination import OrderCursorPagination
+from django.utils.decorators import method_decorator
+from . import fastpath, gemini
+from .renderers import FastJSONRenderer
+from .idempotency import idempotent
+from .cache import (
+    cache_response,
+    conditional_response,
+    order_detail_tags,
+    product_detail_tags,
+    product_list_tags,
+    product_reviews_tags,
+    user_orders_tags,
+)
+from .analytics import truncate
+from .models import ArchivedOrder, CategorySalesRollup, Chat, ChatMessage, Checkout, Order, OrderItem, Product, ProductSalesRollup, Category
 
 
 class RegistrationAPIView(generics.CreateAPIView):
@@ -50,8 +74,11 @@ class RegistrationAPIView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         user = serializer.save()
-        from .tasks import create_welcome_coupon_for_user
-        create_welcome_coupon_for_user.delay(user.id)
+        # код берётся из заранее сгенерированного пула одним UPDATE
+        from .campaigns import claim_welcome_coupon
+        if claim_welcome_coupon(user) is None:
+            from .tasks import create_welcome_coupon_for_user
+            create_welcome_coupon_for_user.delay(user.id)
 
 
 
@@ -105,42 +132,113 @@ class LoginAPIView(generics.GenericAPIView):
             return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
 
+@method_decorator(idempotent("order_create"), name="post")
 class OrderCreateAPIView(generics.CreateAPIView):
     """
     POST /orders/
     Creates a new order for the authenticated user.
     Requires authentication.
+    An `Idempotency-Key` header makes retries return the first response.
     
     Request Body: Order data
     Responses:
     - 201: Order created successfully
     - 400: Invalid order data
+    - 409: the same Idempotency-Key is still being processed
+    - 422: the Idempotency-Key was used with a different body
     """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
+@method_decorator(conditional_response(user_orders_tags), name="get")
 class OrderListAPIView(generics.ListAPIView):
     """
     GET /orders/
-    Returns a list of orders for the authenticated user.
+    Returns the authenticated user's order history, newest first, as
+    summaries (id, order_date, status, amount, item_count).
+    Line items: GET /orders/{id}/.
     Requires authentication.
+    Supports If-None-Match / If-Modified-Since (304 when nothing changed).
+
+    Query params:
+    - page_size: orders per page (default 20, max 100)
+    - cursor: opaque value taken from the `next` / `previous` links
+    - include_archived=1: also orders moved to cold storage (store/archive.py)
     
     Responses:
-    - 200: List of user's orders with items and products
+    - 200: {"next", "previous", "results": [order summaries]}
     """
-    serializer_class = OrderSerializer
+    serializer_class = OrderSummarySerializer
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    pagination_class = OrderCursorPagination
 
     # def get_queryset(self): N+1
     #     return Order.objects.filter(user=self.request.user)
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).prefetch_related('items__product')
+        if getattr(self, 'swagger_fake_view', False):
+            return Order.objects.none()
+        return Order.objects.filter(user=self.request.user).annotate(item_count=Count("items"))
+
+    def list(self, request, *args, **kwargs):
+        if include_archived(request):
+            # горячая таблица + архив одним keyset-проходом (KeysetPagination.paginate_querysets)
+            columns = fastpath.order_summary_columns()
+            archived = ArchivedOrder.objects.filter(user=request.user).values(*columns)
+            page = self.paginator.paginate_querysets(
+                [self.get_queryset().values(*columns), archived], request, view=self
+            )
+            return self.get_paginated_response(self.summaries(page))
+        if fastpath.fast_path_enabled():
+            rows = self.get_queryset().values(*fastpath.order_summary_columns())
+            page = self.paginate_queryset(rows)
+            return self.get_paginated_response(fastpath.order_summaries(page))
+        return super().list(request, *args, **kwargs)
+
+    def summaries(self, rows):
+        if fastpath.fast_path_enabled():
+            return fastpath.order_summaries(rows)
+        return self.get_serializer(rows, many=True).data
+
+
+@method_decorator(conditional_response(order_detail_tags), name="get")
+class OrderDetailAPIView(generics.RetrieveAPIView):
+    """
+    GET /orders/{id}/
+    One order of the authenticated user with its line items and products.
+    With ?include_archived=1 an archived order is returned as well (its items
+    are the snapshot taken when it was archived).
+    Requires authentication.
+    """
+    serializer_class = OrderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Order.objects.none()
+        items = OrderItem.objects.select_related("product").order_by("id")
+        return (Order.objects.filter(user=self.request.user)
+                .prefetch_related(Prefetch("items", queryset=items)))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if not include_archived(request):
+                raise
+        archived = get_object_or_404(ArchivedOrder, user=request.user, pk=kwargs["pk"])
+        return Response(ArchivedOrderSerializer(archived).data)
+
+
+def include_archived(request):
+    return request.query_params.get("include_archived") in ("1", "true")
     
 class UserProfileSerializer(serializers.ModelSerializer):
     """
     GET /profile/
-    Returns the authenticated user's profile with their orders.
+    Returns the authenticated user's profile with their newest orders.
     Requires authentication.
     
     Responses:
@@ -149,14 +247,16 @@ class UserProfileSerializer(serializers.ModelSerializer):
             "id": integer,
             "username": "string",
             "email": "string",
-            "orders": [Order objects]
+            "order_count": integer,
+            "recent_orders": [Order objects]
         }
     """
-    orders = OrderSerializer(many=True, read_only=True)
+    order_count = serializers.IntegerField(source='profile.order_count', read_only=True)
+    recent_orders = OrderSerializer(many=True, read_only=True)
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'orders']
+        fields = ['id', 'username', 'email', 'order_count', 'recent_orders']
 
 class UserProfileAPIView(generics.RetrieveAPIView):
     """
@@ -172,10 +272,11 @@ class UserProfileAPIView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        return self.get_queryset().get()
 
     def get_queryset(self):
-        return User.objects.filter(id=self.request.user.id).prefetch_related('order_set')
+        return (User.objects.filter(id=self.request.user.id).select_related('profile')
+                .prefetch_related(recent_orders_prefetch()))
 @silk_profile(name='Product List API')
 class ProductListAPIView(generics.ListAPIView):
     """
@@ -194,18 +295,79 @@ class ProductListAPIView(generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
     # queryset = Product.objects.all() N+1 solved
-    queryset = Product.objects.prefetch_related('images', 'reviews')
+    queryset = Product.objects.prefetch_related('images')
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs["product_pk"]).select_related('user')
 
 
 
-class ProductDetailAPIView(generics.RetrieveAPIView):
+from .models import ProductImage
+from .serializers import ProductCardSerializer
+
+
+class SparseProductMixin:
+    """
+    ?fields= / ?expand= / ?view=card for product endpoints. The queryset is
+    narrowed with .only() to the columns the chosen fields render, and images
+    are prefetched only if an image field survives.
+    """
+    card_by_default = False
+
+    def use_card(self):
+        request = getattr(self, "request", None)
+        if request is None:
+            return self.card_by_default
+        view = request.query_params.get("view")
+        return view == "card" or (self.card_by_default and view != "full")
+
+    def get_serializer_class(self):
+        return ProductCardSerializer if self.use_card() else ProductSerializer
+
+    def get_queryset(self):
+        serializer = self.get_serializer()
+        # price/id — ключи keyset-пагинации, без них .only() дал бы запрос на строку
+        columns = set(serializer.only_columns()) | {"id", "price"}
+        queryset = Product.objects.only(*columns)
+        if serializer.needs_images():
+            queryset = queryset.prefetch_related(
+                Prefetch("images", queryset=ProductImage.objects.order_by("id"))
+            )
+        return queryset
 
 
+class ProductFilterMixin:
+    """
+    ?category=gaming and ?search=phone narrow product lists on the
+    server, so clients ask for one small page instead of the whole catalog.
+    Search matches any of its words (3+ letters, at most
+    PRODUCT_SEARCH_MAX_WORDS) in the name or description.
+    """
+    def filter_products(self, queryset):
+        params = self.request.query_params
+        category = params.get("category")
+        if category:
+            queryset = queryset.filter(category=category)
+        words = [word for word in params.get("search", "").split() if len(word) >= 3]
+        if words:
+            match = Q()
+            for word in words[:getattr(settings, "PRODUCT_SEARCH_MAX_WORDS", 5)]:
+                match |= Q(name__icontains=word) | Q(description__icontains=word)
+            queryset = queryset.filter(match)
+        return queryset
+
+    def get_queryset(self):
+        return self.filter_products(super().get_queryset())
+
+
+@method_decorator(conditional_response(product_detail_tags), name="get")
+@method_decorator(cache_response("product_detail", product_detail_tags), name="get")
+class ProductDetailAPIView(SparseProductMixin, generics.RetrieveAPIView):
+
+
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
-    queryset = Product.objects.all()
+    queryset = Product.objects.prefetch_related("images")
 
 
 
@@ -236,23 +398,64 @@ from django.contrib import messages
 #         checkout.save()
 #         return order               N+1 solved
 # store/views.py
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import generics, permissions
-from .serializers import CheckoutSerializer
+from .serializers import CheckoutSerializer, CheckoutStatusSerializer
 
+@method_decorator(idempotent("checkout"), name="post")
 class CheckoutAPIView(generics.CreateAPIView):
     """
     POST /checkout/
     Creates a checkout and associated order with discount/coupon logic.
     Requires authentication.
+    An `Idempotency-Key` header makes retries return the first response.
     
     Request Body: Checkout data
     Responses:
     - 201: Checkout and order created successfully
+    - 202: (CHECKOUT_ASYNC) checkout accepted, poll `status_url` for the order
     - 400: Invalid checkout data
+    - 409: the same Idempotency-Key is still being processed
+    - 422: the Idempotency-Key was used with a different body
     """
     serializer_class   = CheckoutSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["defer_order"] = getattr(settings, "CHECKOUT_ASYNC", False)
+        return context
+
+    def create(self, request, *args, **kwargs):
+        if not getattr(settings, "CHECKOUT_ASYNC", False):
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        checkout = serializer.save()
+        status_url = request.build_absolute_uri(reverse("checkout-status", args=[checkout.pk]))
+        return Response(
+            {"id": checkout.pk, "status": checkout.status, "status_url": status_url},
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": status_url},
+        )
+
+
+class CheckoutStatusAPIView(generics.RetrieveAPIView):
+    """
+    GET /checkouts/{id}/status/
+    Progress of an asynchronous checkout: pending → processing → completed | failed.
+    `order` is set once the order exists, `error` explains a failure.
+    Requires authentication.
+    """
+    serializer_class = CheckoutStatusSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Checkout.objects.none()
+        return Checkout.objects.filter(user=self.request.user)
+
     
 # @silk_profile(name='CheckoutList API')
 class CheckoutListAPIView(generics.ListAPIView):
@@ -276,7 +479,7 @@ class CheckoutListAPIView(generics.ListAPIView):
 from rest_framework import generics, permissions
 
 from accounts.models import Profile
-from .serializers import ProfileSerializer
+from .serializers import ProfileSerializer, recent_orders_prefetch
 from rest_framework.parsers import MultiPartParser, FormParser
 
 class UserProfileAPIView(generics.RetrieveAPIView):
@@ -294,7 +497,7 @@ class UserProfileAPIView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user.profile
+        return ProfileSerializer.get_profile(self.request.user)
 
 class UserProfileUpdateAPIView(generics.UpdateAPIView):
     """
@@ -314,7 +517,7 @@ class UserProfileUpdateAPIView(generics.UpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user.profile
+        return ProfileSerializer.get_profile(self.request.user)
 
 class UserProfilePhotoUploadAPIView(generics.UpdateAPIView):
     serializer_class = ProfileSerializer
@@ -322,7 +525,7 @@ class UserProfilePhotoUploadAPIView(generics.UpdateAPIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get_object(self):
-        return self.request.user.profile
+        return ProfileSerializer.get_profile(self.request.user)
 
     def patch(self, request, *args, **kwargs):
         return self.partial_update(request, *args, **kwargs)
@@ -342,31 +545,156 @@ class UserProfilePhotoDeleteAPIView(generics.DestroyAPIView):
         profile.photo.delete(save=True)
         return Response({'detail': 'Profile photo deleted.'}, status=status.HTTP_204_NO_CONTENT)
     
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from rest_framework import generics
 from .models import Product
+from .pagination import ProductCursorPagination
 from .serializers import ProductSerializer
+from . import snapshot
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
 
-@method_decorator(cache_page(60 * 5, key_prefix="products_list"), name="get")
-class ProductListAPIView(generics.ListAPIView):
 
-    queryset = Product.objects.all()  # Removed select_related('category')
+class ProductBatchLookupMixin:
+    """
+    GET /products/?ids=1,5,9 — the cart / checkout lookup. All requested
+    products come from one query (+ one images prefetch), unpaginated and in
+    request order; ids that do not exist are listed in `missing`.
+    """
+    batch_query_param = "ids"
+    max_batch_ids = getattr(settings, "PRODUCT_BATCH_MAX_IDS", 100)
+
+    def is_batch_lookup(self):
+        request = getattr(self, "request", None)
+        return request is not None and self.batch_query_param in request.query_params
+
+    def get_batch_ids(self, request):
+        raw = request.query_params.get(self.batch_query_param, "")
+        try:
+            ids = [int(part) for part in raw.split(",") if part.strip()]
+        except ValueError:
+            raise ValidationError({self.batch_query_param: "Expected a comma-separated list of integers."})
+        ids = list(dict.fromkeys(ids))  # без дублей, порядок запроса сохраняется
+        if not ids:
+            raise ValidationError({self.batch_query_param: "At least one id is required."})
+        if len(ids) > self.max_batch_ids:
+            raise ValidationError({self.batch_query_param: f"At most {self.max_batch_ids} ids per request."})
+        return ids
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_batch_lookup():
+            return super().list(request, *args, **kwargs)
+        ids = self.get_batch_ids(request)
+        found = {product.pk: product for product in self.get_queryset().filter(pk__in=ids)}
+        serializer = self.get_serializer([found[pk] for pk in ids if pk in found], many=True)
+        return Response({
+            "results": serializer.data,
+            "missing": [pk for pk in ids if pk not in found],
+        })
+
+
+class ProductSnapshotListMixin:
+    """
+    With PRODUCT_LIST_SNAPSHOT on, the default listing (ordering by id, any
+    cursor / page_size) is paged out of the Celery-refreshed snapshot and
+    never touches Postgres. Anything else falls through to the queryset.
+    """
+    snapshot_query_params = {"cursor", "page_size", "ordering"}
+
+    def list(self, request, *args, **kwargs):
+        if snapshot.snapshot_enabled() and self._can_use_snapshot(request):
+            current = snapshot.get_snapshot()
+            if current is not None:
+                page = self.paginator.paginate_rows(
+                    current["rows"], current["keys"], Product, request, view=self
+                )
+                response = self.paginator.get_paginated_response(page)
+                response.skip_response_cache = True
+                return response
+        return super().list(request, *args, **kwargs)
+
+    def _can_use_snapshot(self, request):
+        params = request.query_params
+        return (
+            set(params) <= self.snapshot_query_params
+            and params.get("ordering", self.paginator.default_ordering)
+            == self.paginator.default_ordering
+        )
+
+
+class ProductFastPathMixin:
+    """
+    Card listings without ?fields / ?expand / ?ids are built straight from
+    .values() rows (store/fastpath.py) when FAST_READ_SERIALIZERS is on and
+    rendered with orjson; everything else goes through the serializers.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    fast_path_excluded_params = {"fields", "expand", "ids"}
+
+    def list(self, request, *args, **kwargs):
+        if (fastpath.fast_path_enabled() and self.use_card()
+                and not set(request.query_params) & self.fast_path_excluded_params):
+            queryset = self.filter_products(Product.objects.values(*fastpath.product_card_columns()))
+            page = self.paginate_queryset(queryset)
+            return self.get_paginated_response(fastpath.product_cards(page))
+        return super().list(request, *args, **kwargs)
+
+
+# кэш версионируется тегами (store/cache.py) — любая запись в каталог
+# инвалидирует все страницы и варианты query string сразу
+@method_decorator(conditional_response(product_list_tags, snapshot.snapshot_version), name="get")
+@method_decorator(cache_response("products_list", product_list_tags), name="get")
+class ProductListAPIView(ProductBatchLookupMixin, ProductSnapshotListMixin, ProductFastPathMixin,
+                         ProductFilterMixin, SparseProductMixin, generics.ListAPIView):
+    """
+    GET /products/
+    Cursor-paginated list of product cards (id, name, price, first image).
+    ?expand=a,b adds fields to the card, ?fields=a,b picks them exactly and
+    ?view=full returns the whole product (see SparseFieldsMixin).
+    ?category= and ?search= filter on the server (see ProductFilterMixin).
+    ?ids=1,5,9 returns just those products (see ProductBatchLookupMixin).
+    """
+
+    queryset = Product.objects.prefetch_related("images")  # рейтинг хранится в Product — без N+1
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = ProductCursorPagination
+
+    @property
+    def card_by_default(self):
+        # корзине нужны цена и остаток — ?ids= по умолчанию отдаёт полный товар
+        return not self.is_batch_lookup()
 from rest_framework import viewsets, mixins, permissions
 from .models import Product, Review
 from .serializers import ProductSerializer, ReviewSerializer
 
 # ────────── Список + деталь товаров (кэш остался) ──────────
-class ProductViewSet(mixins.ListModelMixin,
+@method_decorator(conditional_response(product_list_tags), name="list")
+@method_decorator(cache_response("products_list", product_list_tags), name="list")
+@method_decorator(conditional_response(product_detail_tags), name="retrieve")
+@method_decorator(cache_response("product_detail", product_detail_tags), name="retrieve")
+class ProductViewSet(ProductBatchLookupMixin,
+                     ProductFastPathMixin,
+                     ProductFilterMixin,
+                     SparseProductMixin,
+                     mixins.ListModelMixin,
                      mixins.RetrieveModelMixin,
                      viewsets.GenericViewSet):
     """
     GET /products/
-    Returns list of all products with images.
+    Returns a cursor-paginated list of product cards (id, name, price, image).
     No authentication required.
-    Cached for 5 minutes.
+    Cached until the catalog changes (see store/cache.py).
+
+    Query params:
+    - ordering: id | -id | price | -price (default: id)
+    - category: e.g. gaming; search: words matched in name / description
+    - page_size: items per page (default 24, max 100)
+    - cursor: opaque value taken from the `next` / `previous` links
+    - expand: extra fields for the card, e.g. description,images,rating
+    - fields: exact field list, e.g. id,name,price
+    - view=full: the detailed representation
+    - ids: e.g. 1,5,9 — only these products, full representation, in this
+      order, unpaginated: {"results": [...], "missing": [...]}
     
     GET /products/{id}/
     Returns details for a specific product.
@@ -375,23 +703,38 @@ class ProductViewSet(mixins.ListModelMixin,
     queryset = Product.objects.prefetch_related("images")
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = ProductCursorPagination
+
+    @property
+    def card_by_default(self):
+        # корзине нужны цена и остаток — ?ids= по умолчанию отдаёт полный товар
+        return self.action == "list" and not self.is_batch_lookup()
 
 # ────────── Отзывы ──────────
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+@method_decorator(conditional_response(product_reviews_tags), name="list")
+@method_decorator(cache_response("product_reviews", product_reviews_tags), name="list")
 class ReviewViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows reviews to be viewed or edited.
     """
     serializer_class = ReviewSerializer
     permission_classes = [permissions.AllowAny]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Review.objects.none()
             
-        return Review.objects.filter(product_id=self.kwargs["product_pk"])
+        return (Review.objects.filter(product_id=self.kwargs["product_pk"])
+                .select_related("user").order_by("id"))
+
+    def list(self, request, *args, **kwargs):
+        if fastpath.fast_path_enabled():
+            return Response(fastpath.reviews(self.get_queryset()))
+        return super().list(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         product_id = self.kwargs["product_pk"]
@@ -449,6 +792,9 @@ class GeminiChatAPIView(APIView):
     
     Request Body:
     - prompt: string (required)
+
+    Answers are cached per normalized prompt (store/gemini.py);
+    `Cache-Control: no-cache` or ?no_cache=1 bypasses the cache.
     
     Responses:
     - 201: Returns AI response
@@ -472,12 +818,12 @@ class GeminiChatAPIView(APIView):
             return Response({"detail": "prompt is required"}, status=400)
 
 
-        ai_answer = f"Gemini would answer to: {prompt}"  
-        response = client.models.generate_content(
-        model="gemini-2.0-flash", contents="LOCAL: Kazakhstan, currency KZT (tenge), you are an E-commerce shop assistant" + prompt,
+        # одинаковые вопросы — из кэша, одновременные — одним вызовом (store/gemini.py)
+        ai_answer = gemini.generate(
+            client, "gemini-2.0-flash",
+            "LOCAL: Kazakhstan, currency KZT (tenge), you are an E-commerce shop assistant" + prompt,
+            bypass=gemini.bypass_requested(request),
         )
-        print(response.text)
-        ai_answer = response.text
 
 
         # persist chat
@@ -575,6 +921,8 @@ class ProductConsultAPIView(APIView):
     """
     POST /products/{id}/ask/
     body: {"prompt": "optional extra question"}
+    Answers are cached per normalized prompt; send `Cache-Control: no-cache`
+    (or ?no_cache=1) for a fresh one.
     """
     permission_classes = [permissions.IsAuthenticated]
     throttle_classes   = [ScopedRateThrottle]
@@ -584,10 +932,7 @@ class ProductConsultAPIView(APIView):
         product = generics.get_object_or_404(Product, pk=pk)
         extra   = request.data.get("prompt", "")
         prompt  = f"About this product {product.name}: {product.description}\nUser: {extra}"
-        response = client.models.generate_content(
-            model="gemini-2.0-flash", contents=prompt
-        )
-        ai_answer = response.text
+        ai_answer = gemini.generate(client, "gemini-2.0-flash", prompt, bypass=gemini.bypass_requested(request))
         chat, _ = Chat.objects.get_or_create(user=request.user)
         ChatMessage.objects.bulk_create([
             ChatMessage(chat=chat, role="user", text=prompt),
@@ -608,3 +953,82 @@ class UserCouponAPIView(generics.RetrieveAPIView):
         user = self.request.user
         coupon = generics.get_object_or_404(Coupon, user=user)
         return coupon
+
+
+class CacheStatsAPIView(APIView):
+    """
+    GET /cache/stats/
+    Hit/miss counters of the catalog cache tiers for the worker that served
+    the request (L1 = in-process LRU, L2 = Redis), plus the coupon lookup
+    counters (store/coupons.py) and the Gemini answer cache (store/gemini.py).
+    Admin only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        from . import coupons, gemini
+        from .cache import tiered_cache
+        return Response({**tiered_cache.stats(), "coupons": coupons.stats(), "gemini": gemini.stats()})
+
+
+# ────────── /analytics/ — только агрегаты, без Order / OrderItem ──────────
+class SalesRollupAPIView(generics.ListAPIView):
+    """
+    Base for the read-only sales endpoints. Rows come from the rollup tables
+    that store/analytics.py updates incrementally in Celery.
+
+    Query params: granularity=hour|day (default day), since, until (ISO 8601;
+    default: last 2 days for hours, 30 days for days), category.
+    Admin only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    pagination_class = None  # диапазон ограничен ANALYTICS_MAX_RANGE
+    model = None
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return self.model.objects.none()
+        query = SalesRollupQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        queryset = self.model.objects.filter(
+            granularity=params["granularity"],
+            bucket__gte=truncate(params["since"], params["granularity"]),
+            bucket__lte=params["until"],
+        )
+        if "category" in params:
+            queryset = queryset.filter(category=params["category"])
+        return self.filter_rollups(queryset, params).order_by("bucket", *self.ordering)
+
+    def filter_rollups(self, queryset, params):
+        return queryset
+
+
+class ProductSalesAPIView(SalesRollupAPIView):
+    """
+    GET /analytics/sales/products/
+    Revenue, units and order count per product and hour/day.
+    Extra query param: product (id).
+    Admin only.
+    """
+    serializer_class = ProductSalesRollupSerializer
+    model = ProductSalesRollup
+    ordering = ("product_id",)
+
+    def filter_rollups(self, queryset, params):
+        if "product" in params:
+            queryset = queryset.filter(product_id=params["product"])
+        return queryset
+
+
+class CategorySalesAPIView(SalesRollupAPIView):
+    """
+    GET /analytics/sales/categories/
+    Revenue, units and order count per category and hour/day; `orders`
+    counts each order once per category.
+    Admin only.
+    """
+    serializer_class = CategorySalesRollupSerializer
+    model = CategorySalesRollup
+    ordering = ("category",)
@@ -8,10 +8,18 @@ import "react-loading-skeleton/dist/skeleton.css";
 import { Link } from "react-router-dom";
 import toast from "react-hot-toast";
 
+const PRODUCTS_API = "https://kajet24.work.gd/api/products/";
+const PRODUCTS_URL = `${PRODUCTS_API}?page_size=24&expand=category,rating`;
+
+// `next` строит бэкенд за прокси (может прийти http://) — берём только query string с курсором
+const nextPageUrl = (next) => next && PRODUCTS_API + new URL(next).search;
+
 const Products = () => {
   const [data, setData] = useState([]);
   const [filter, setFilter] = useState([]);
   const [loading, setLoading] = useState(false);
+  const [nextUrl, setNextUrl] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [searchTerm, setSearchTerm] = useState("");
   const [activeCategory, setActiveCategory] = useState("all");
   let componentMounted = true;
@@ -27,12 +35,14 @@ const Products = () => {
     const getProducts = async () => {
       setLoading(true);
       try {
-        const response = await fetch("https://kajet24.work.gd/api/products/");
+        // список отдаёт карточки (id, name, price, image) — категорию и рейтинг просим явно
+        const response = await fetch(PRODUCTS_URL);
         
         if (componentMounted) {
-          const products = await response.json();
+          const { results: products, next } = await response.json();
           setData(products);
           setFilter(products);
+          setNextUrl(nextPageUrl(next));
           setLoading(false);
         }
       } catch (error) {
@@ -48,6 +58,34 @@ const Products = () => {
     getProducts();
   }, []);
 
+  const applyFilters = (list, cat, keyword) => {
+    let filteredList = cat === "all" ? [...list] : list.filter(item => item.category === cat);
+    if (keyword) {
+      filteredList = filteredList.filter(item =>
+        item.name.toLowerCase().includes(keyword.toLowerCase())
+      );
+    }
+    return filteredList;
+  };
+
+  // следующая страница по курсору из `next`; фильтры применяются и к ней
+  const loadMore = async () => {
+    if (!nextUrl || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const response = await fetch(nextUrl);
+      const { results: products, next } = await response.json();
+      const all = [...data, ...products];
+      setData(all);
+      setFilter(applyFilters(all, activeCategory, searchTerm));
+      setNextUrl(nextPageUrl(next));
+    } catch (error) {
+      console.error("Error fetching products:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSearch = (e) => {
     const keyword = e.target.value.toLowerCase();
     setSearchTerm(keyword);
@@ -208,7 +246,7 @@ const Products = () => {
                   <div className="image-container" style={{ height: "280px", overflow: "hidden", padding: "1rem" }}>
                     <img
                       className="card-img-top"
-                      src={product.images && product.images.length > 0 ? product.images[0].image : product.imageLink}
+                      src={product.image || product.imageLink}
                       alt={product.name}
                       style={{ height: "100%", width: "100%", objectFit: "contain" }}
                       onError={(e) => {
@@ -300,6 +338,16 @@ const Products = () => {
           </div>
         </div>
       )}
+
+      {!loading && nextUrl && (
+        <div className="row mt-2">
+          <div className="col-12 text-center">
+            <button className="btn btn-outline-dark" onClick={loadMore} disabled={loadingMore}>
+              {loadingMore ? "Загрузка..." : "Показать ещё"}
+            </button>
+          </div>
+        </div>
+      )}
     </div>
   );
 };
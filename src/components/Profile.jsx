@@ -49,7 +49,9 @@ const Profile = () => {
           email: data.email,
           username: data.username,
           photo: data.photo || null,
-          orders: data.orders || [],
+          // newest orders only; the full history is paginated at /api/orders/
+          orders: data.recent_orders || [],
+          orderCount: data.order_count || 0,
         });
         setEditForm({
           username: data.username,
@@ -571,7 +573,7 @@ const Profile = () => {
             <div className="col-md-8">
               <div className="card shadow-sm">
                 <div className="card-body">
-                  <h5 className="card-title mb-4">My Orders</h5>
+                  <h5 className="card-title mb-4">My Orders ({profile.orderCount || 0})</h5>
                   
                   {profile.orders.length === 0 ? (
                     <div className="text-center py-4">
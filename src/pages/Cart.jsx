@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { Footer, Navbar } from "../components";
 import { useSelector, useDispatch } from "react-redux";
 import { addCart, delCart } from "../redux/action"; 
@@ -9,6 +9,33 @@ const Cart = () => {
   const state = useSelector((state) => state.handleCart);
   const dispatch = useDispatch();
   const [showModal, setShowModal] = useState(false);
+  // Current price and stock for every cart line: one batch request
+  const [fresh, setFresh] = useState({});
+  const cartIds = state.map((item) => item.id).join(",");
+  // One Idempotency-Key per order attempt: a retry after a network error or a 5xx
+  // reuses it. A final answer from the server or a cart change drops it.
+  const idempotencyKey = useRef(null);
+
+  useEffect(() => {
+    idempotencyKey.current = null;
+  }, [state]);
+
+  useEffect(() => {
+    if (!cartIds) return;
+    fetch(`https://kajet24.work.gd/api/products/?ids=${cartIds}`)
+      .then((response) => response.json())
+      .then((data) => {
+        const byId = {};
+        data.results.forEach((product) => {
+          byId[product.id] = product;
+        });
+        setFresh(byId);
+      })
+      .catch((error) => console.error("Error:", error));
+  }, [cartIds]);
+
+  const currentPrice = (item) =>
+    fresh[item.id] ? parseFloat(fresh[item.id].price) : item.price;
 
   // If cart is empty
   const EmptyCart = () => {
@@ -38,6 +65,9 @@ const Cart = () => {
 
   // Create Order via API
   const handleCreateOrder = async (subtotal, shipping) => {
+    if (!idempotencyKey.current) {
+      idempotencyKey.current = crypto.randomUUID();
+    }
     try {
       // Build request body
       const orderData = {
@@ -53,10 +83,17 @@ const Cart = () => {
         headers: {
           "Content-Type": "application/json",
           Authorization: `Bearer ${localStorage.getItem("access_token")}`,
+          "Idempotency-Key": idempotencyKey.current,
         },
         body: JSON.stringify(orderData),
       });
 
+      // a final answer drops the key (5xx and 409 "in progress" are retryable). Successes are
+      // stored under it for replay; raised 4xx validation errors are not, the server just frees the key
+      if (response.status < 500 && response.status !== 409) {
+        idempotencyKey.current = null;
+      }
+
       if (response.ok) {
         console.log("Order created successfully");
         localStorage.removeItem("cart");
@@ -80,7 +117,7 @@ const Cart = () => {
     let totalItems = 0;
 
     state.forEach((item) => {
-      subtotal += item.price * item.qty;
+      subtotal += currentPrice(item) * item.qty;
       totalItems += item.qty;
     });
 
@@ -141,9 +178,14 @@ const Cart = () => {
                             <p className="text-start text-md-center">
                               <strong>
                                 <span className="text-muted">{item.qty}</span> x ₸
-                                {item.price}
+                                {currentPrice(item)}
                               </strong>
                             </p>
+                            {fresh[item.id] && fresh[item.id].quantity < item.qty && (
+                              <p className="text-danger text-start text-md-center">
+                                В наличии: {fresh[item.id].quantity}
+                              </p>
+                            )}
                           </div>
                         </div>
                         <hr className="my-4" />
@@ -18,7 +18,6 @@ const ChatSupport = () => {
   const [showToast, setShowToast] = useState(false);
   const [toastMessage, setToastMessage] = useState('');
   const [isLoadingHistory, setIsLoadingHistory] = useState(true);
-  const [products, setProducts] = useState([]);
   const [isTyping, setIsTyping] = useState(false);
   const [suggestionItems, setSuggestionItems] = useState([]);
   const messagesEndRef = useRef(null);
@@ -44,18 +43,8 @@ const ChatSupport = () => {
 
   useEffect(() => {
     loadChatHistory();
-    fetchProducts();
   }, [userEmail]);
 
-  const fetchProducts = async () => {
-    try {
-      const res = await axios.get('https://kajet24.work.gd/api/products/');
-      setProducts(res.data);
-    } catch (error) {
-      console.error('Error fetching products:', error);
-    }
-  };
-
   const showNotification = (message) => {
     setToastMessage(message);
     setShowToast(true);
@@ -119,16 +108,17 @@ const ChatSupport = () => {
     showNotification('История чата очищена');
   };
 
-  // Find relevant products based on keywords
-  const findRelevantProducts = (query) => {
-    const keywords = query.toLowerCase().split(' ');
-    return products.filter(product => {
-      const name = product.name.toLowerCase();
-      const description = product.description.toLowerCase();
-      return keywords.some(keyword => 
-        name.includes(keyword) || description.includes(keyword)
-      );
-    }).slice(0, 3); // Limit to 3 products
+  // Find relevant products based on keywords — ищет сервер (?search=), берём одну страницу из 3 карточек
+  const findRelevantProducts = async (query) => {
+    try {
+      const res = await axios.get('https://kajet24.work.gd/api/products/', {
+        params: { search: query, page_size: 3, expand: 'rating' },
+      });
+      return res.data.results;
+    } catch (error) {
+      console.error('Error fetching products:', error);
+      return [];
+    }
   };
 
   // Simulate typing effect for AI responses
@@ -159,12 +149,12 @@ const ChatSupport = () => {
     setLoading(true);
   
     try {
-      // Try to find relevant products based on the prompt
-      const relevantProducts = findRelevantProducts(prompt);
-      
       // Check for shopping-related keywords
       const shoppingKeywords = ['купить', 'заказать', 'товар', 'продукт', 'цена', 'стоимость', 'сравни', 'лучше', 'рекомендуй', 'смартфон', 'телефон', 'электроника'];
       const isShoppingQuery = shoppingKeywords.some(keyword => prompt.toLowerCase().includes(keyword));
+
+      // Try to find relevant products based on the prompt — только для покупательских запросов, параллельно с ИИ
+      const productsRequest = isShoppingQuery ? findRelevantProducts(prompt) : Promise.resolve([]);
       
       // Send to backend for AI processing
       const res = await fetch('https://kajet24.work.gd/api/chat/', {
@@ -182,9 +172,10 @@ const ChatSupport = () => {
       if (!res.ok) throw new Error('Network response was not ok');
       
       const data = await res.json();
+      const relevantProducts = await productsRequest;
       
       // Add product suggestions if this is a shopping query
-      if (isShoppingQuery && relevantProducts.length > 0) {
+      if (relevantProducts.length > 0) {
         await simulateTyping(data.answer, relevantProducts);
       } else {
         await simulateTyping(data.answer);
@@ -241,9 +232,9 @@ const ChatSupport = () => {
     >
       <div className="d-flex">
         <div className="product-image" style={{ width: '80px', height: '80px' }}>
-          {product.images && product.images.length > 0 ? (
+          {product.image || (product.images && product.images.length > 0) ? (
             <img 
-              src={product.images[0].image} 
+              src={product.image || product.images[0].image} 
               alt={product.name} 
               className="img-fluid p-1" 
               style={{ width: '100%', height: '100%', objectFit: 'contain' }}
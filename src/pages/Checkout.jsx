@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { Footer, Navbar } from "../components";
 import { useSelector } from "react-redux";
 import { Link } from "react-router-dom";
@@ -11,6 +11,14 @@ const Checkout = () => {
   const [discount, setDiscount] = useState(0);
   const [couponError, setCouponError] = useState("");
   const [isApplyingCoupon, setIsApplyingCoupon] = useState(false);
+  // One Idempotency-Key per checkout attempt. It lives here, not in ShowCheckout,
+  // which is re-created on every render. A retry after a network error, a 5xx or a
+  // timeout reuses it; a final answer from the server or a cart change drops it.
+  const idempotencyKey = useRef(null);
+
+  useEffect(() => {
+    idempotencyKey.current = null;
+  }, [state]);
 
   const EmptyCart = () => {
     return (
@@ -117,8 +125,28 @@ const Checkout = () => {
       }
     };
 
+    // Async checkout (202 Accepted): poll the status URL until the order exists
+    const waitForCheckout = async (statusUrl) => {
+      for (let attempt = 0; attempt < 30; attempt++) {
+        const response = await fetch(statusUrl, {
+          headers: {
+            "Authorization": `Bearer ${localStorage.getItem("access_token")}`,
+          },
+        });
+        const result = await response.json();
+        if (result.status === "completed" || result.status === "failed") {
+          return result;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+      }
+      throw new Error("Checkout is still processing");
+    };
+
     const handleSubmit = async (e) => {
       e.preventDefault();
+      if (!idempotencyKey.current) {
+        idempotencyKey.current = crypto.randomUUID();
+      }
 
       const first_name = document.getElementById("firstName").value;
       const last_name = document.getElementById("lastName").value;
@@ -165,9 +193,17 @@ const Checkout = () => {
           headers: {
             "Content-Type": "application/json",
             "Authorization": `Bearer ${localStorage.getItem("access_token")}`,
+            "Idempotency-Key": idempotencyKey.current,
           },
           body: JSON.stringify(orderData),
         });
+
+        // 4xx (except 409, still in progress) is final, so the next submit gets a new key. A 4xx the view
+        // returns is stored under the key (resending a changed body would get 422); a raised
+        // validation error is not stored, the server just releases the key.
+        if (response.status >= 400 && response.status < 500 && response.status !== 409) {
+          idempotencyKey.current = null;
+        }
         
         if (!response.ok) {
           if (response.status === 401) {
@@ -183,7 +219,20 @@ const Checkout = () => {
           throw new Error("Failed to submit order");
         }
 
+        if (response.status === 202) {
+          const { status_url } = await response.json();
+          const result = await waitForCheckout(status_url);
+          idempotencyKey.current = null;
+          if (result.status !== "completed") {
+            throw new Error(result.error || "Checkout failed");
+          }
+          clearFormFields();
+          setShowSuccessModal(true);
+          return;
+        }
+
         if (response.status === 201) {
+          idempotencyKey.current = null;
           console.log("Order submitted successfully");
           clearFormFields();
           setShowSuccessModal(true);
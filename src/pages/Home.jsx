@@ -181,11 +181,11 @@ const Home = () => {
     const getProducts = async () => {
       setLoading(true);
       try {
-        const response = await fetch("https://kajet24.work.gd/api/products/");
+        const response = await fetch("https://kajet24.work.gd/api/products/?page_size=4");
         if (componentMounted) {
           const data = await response.json();
           // Get only the first 4 products for the featured section
-          setProducts(data.slice(0, 4));
+          setProducts(data.results);
           setLoading(false);
         }
       } catch (error) {
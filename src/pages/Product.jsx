@@ -8,6 +8,8 @@ import { Footer, Navbar } from "../components";
 import ReactMarkdown from "react-markdown";
 import remarkGfm from "remark-gfm";
 
+const SIMILAR_LIMIT = 10;
+
 const Product = () => {
   const { id } = useParams();
   const [product, setProduct] = useState({});
@@ -64,13 +66,13 @@ const Product = () => {
         setProduct(data);
         setLoading(false);
 
-        // Fetch similar products
-        const response2 = await fetch("https://kajet24.work.gd/api/products/");
-        const products = await response2.json();
-        const filteredProducts = products.filter(
-          (item) => item.category === data.category && item.id !== data.id
+        // Fetch similar products — одна страница этой категории, фильтрует сервер
+        const response2 = await fetch(
+          `https://kajet24.work.gd/api/products/?category=${encodeURIComponent(data.category)}` +
+          `&page_size=${SIMILAR_LIMIT + 1}&expand=rating`
         );
-        setSimilarProducts(filteredProducts);
+        const { results: products } = await response2.json();
+        setSimilarProducts(products.filter((item) => item.id !== data.id).slice(0, SIMILAR_LIMIT));
         setLoading2(false);
 
         // Fetch reviews
@@ -375,7 +377,7 @@ const Product = () => {
           <div key={item.id} className="card mx-4 text-center">
             <img
               className="card-img-top p-3"
-              src={item.images && item.images.length > 0 ? item.images[0].image : item.imageLink}
+              src={item.image || item.imageLink}
               alt="Card"
               style={{ height: '280px', objectFit: 'contain' }}
             />